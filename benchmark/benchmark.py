@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the model engine on synthetic base data, without arcpy.
+
+The daily step (grid and compact storage), PET, IDW interpolation, whole parameter sweeps and the output writers are
+timed over grid sizes, day counts and sweep sizes. The results are written as JSON and can be compared with a baseline
+to flag regressions. The golden check runs a fixed synthetic case and compares its streamflow with golden/Q_golden.csv.
+The golden table is written by an independent cell by cell reference of the toolbox equations (reference.py), not by
+the engine; --update-golden regenerates it from the reference and checks the engine against it.
+
+Usage:
+    python benchmark/benchmark.py --sizes 100 300 --days 60 --combinations 1 27 --output results.json
+    python benchmark/benchmark.py --output results.json --baseline baseline.json --threshold 0.2
+    python benchmark/benchmark.py --golden-only
+    python benchmark/benchmark.py --update-golden
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# The model engine (package "swm") is located next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from swm import (AsyncRasterWriter, CellIndex, FileDataStore, ParameterSweep, QResultWriter, idw_weights,
+                 interpolate_precipitation, synthetic_data)
+from swm.idw import clear_cache
+from swm.parallel import simulate_q
+from swm.synthetic import BASIN_MASK
+
+from reference import reference_q, write_golden
+
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "Q_golden.csv")
+# Fixed case of the golden streamflow: grid size, days, stations, seed and parameter ranges. The domain is larger than
+# the IDW search radius, so days with missing readings change the neighbours of the cells
+GOLDEN_CASE = {"nrows": 40, "ncols": 50, "cellsize": 1000.0, "n_days": 90, "n_stations": 12, "seed": 0,
+               "rp_factor": [0.6, 0.85], "c": [100, 250], "idw_exponent": [1.0, 2.0]}
+
+
+def time_call(function, repeat):
+    """
+    Runs a function several times.
+    :param function: function without arguments (type: callable)
+    :param repeat: number of runs (type: integer)
+    :return: run times in seconds (type: list)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def sweep_combinations(n):
+    """
+    Creates about n combinations from a cube of rp, c and idw values.
+    :param n: number of combinations (type: integer)
+    :return: RP factors, c parameters and IDW exponents (type: tuple of lists)
+    """
+    per_axis = max(int(round(n ** (1.0 / 3))), 1)
+    rp_factor = [round(value, 2) for value in np.linspace(0.6, 0.95, per_axis)]
+    c = [int(value) for value in np.linspace(100, 300, per_axis)]
+    idw_exponent = [float(value) for value in np.linspace(1.0, 2.0, per_axis)]
+    return rp_factor, c, idw_exponent
+
+
+class Case(object):
+    def __init__(self, directory, size, n_days, n_stations=20, seed=0):
+        """
+        Synthetic base data of one benchmark size with its forcing read and calculated once.
+        :param directory: directory of the data (type: string)
+        :param size: number of rows and columns (type: integer)
+        :param n_days: number of days (type: integer)
+        :param n_stations: number of precipitation stations (type: integer)
+        :param seed: seed of the random numbers (type: integer)
+        """
+        store, self.grid, start, end = synthetic_data(directory, size, size, n_days, n_stations, seed=seed)
+        self.grids = FileDataStore(directory, BASIN_MASK).static_grids()
+        self.forcing, _ = store.load_forcing(start, end)
+        self.size = size
+        self.n_days = n_days
+
+    def pet(self, i):
+        climate = self.forcing.climate
+        return self.grids.pet(int(climate.month[i]), climate.temperature[i], climate.humidity[i])
+
+    def precipitation(self, i, idw_exponent):
+        precipitation = self.forcing.precipitation
+        return interpolate_precipitation(precipitation.station_xy, precipitation.values[i], self.grid, idw_exponent)
+
+    def sweep(self, n_combinations, compact):
+        rp_factor, c, idw_exponent = sweep_combinations(n_combinations)
+        cells = CellIndex(self.grids, self.grids.fc) if compact else None
+        return ParameterSweep(self.grids, rp_factor, c, self.grids.fc.copy(), None, idw_exponent, cells=cells)
+
+
+def run_benchmarks(sizes, days, combinations, repeat, log=print):
+    """
+    Times the parts of the model for every grid size, number of days and sweep size.
+    :param sizes: numbers of rows and columns (type: list)
+    :param days: numbers of days (type: list)
+    :param combinations: numbers of parameter combinations (type: list)
+    :param repeat: number of runs per benchmark (type: integer)
+    :param log: function for messages (type: callable)
+    :return: results (type: list of dicts)
+    """
+    results = []
+
+    def record(name, params, times, units=1):
+        result = {"name": name, "params": params, "seconds": statistics.median(times), "min_seconds": min(times),
+                  "per_unit": statistics.median(times) / units, "repeat": len(times)}
+        results.append(result)
+        log("{:<16} {:<66} {:10.4f} s".format(name, json.dumps(params, sort_keys=True), result["seconds"]))
+
+    with tempfile.TemporaryDirectory() as root:
+        for size in sizes:
+            for n_days in days:
+                case = Case(os.path.join(root, "{}_{}".format(size, n_days)), size, n_days)
+                base = {"size": size, "days": n_days}
+                precipitation = case.forcing.precipitation
+                exponents = [1.0, 2.0]
+
+                clear_cache()
+                record("idw_weights", base, time_call(lambda: (clear_cache(), idw_weights(
+                    precipitation.station_xy, case.grid, exponents)), repeat))
+                record("idw_daily", base, time_call(lambda: [case.precipitation(i, exponents) for i in range(n_days)],
+                                                    repeat), n_days)
+                weights = idw_weights(precipitation.station_xy, case.grid, exponents)
+                record("idw_batched", base, time_call(lambda: weights.interpolate(precipitation.values.T), repeat),
+                       n_days)
+                record("pet", base, time_call(lambda: [case.pet(i) for i in range(n_days)], repeat), n_days)
+
+                pet = [case.pet(i) for i in range(n_days)]
+                for n_combinations in combinations:
+                    _, _, idw_exponent = sweep_combinations(n_combinations)
+                    fields = [case.precipitation(i, idw_exponent) for i in range(n_days)]
+                    for compact in (False, True):
+                        sweep = case.sweep(n_combinations, compact)
+                        params = dict(base, combinations=len(sweep), compact=compact)
+
+                        def run():
+                            sweep.reset()
+                            return simulate_q(sweep, pet.__getitem__, fields.__getitem__, n_days)
+                        record("sweep", params, time_call(run, repeat), n_days * len(sweep))
+
+                    q = run()
+                    paths = [os.path.join(root, "Q_{}_{}_{}.csv".format(*name)) for name in sweep.names]
+
+                    def write_tables():
+                        with QResultWriter(paths, sweep.combinations) as writer:
+                            for i in range(n_days):
+                                writer.add(int(case.forcing.climate.tages_id[i]), q[i])
+                    record("output_tables", dict(base, combinations=len(sweep)), time_call(write_tables, repeat),
+                           n_days * len(sweep))
+
+                raster_path = os.path.join(root, "raster.npy")
+
+                def write_rasters():
+                    with AsyncRasterWriter(lambda array, path: np.save(path, array), workers=2) as writer:
+                        for i in range(n_days):
+                            writer.submit(pet[i], raster_path)
+                record("output_rasters", base, time_call(write_rasters, repeat), n_days)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with a baseline.
+    :param results: results of this run (type: list of dicts)
+    :param baseline: results of the baseline (type: list of dicts)
+    :param threshold: relative slow-down counted as regression, e.g. 0.2 for 20 % (type: float)
+    :return: regressions as (name, params, baseline seconds, seconds) (type: list of tuples)
+    """
+    reference = {(result["name"], json.dumps(result["params"], sort_keys=True)): result["seconds"]
+                 for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result["name"], json.dumps(result["params"], sort_keys=True))
+        if key in reference and result["seconds"] > reference[key] * (1.0 + threshold):
+            regressions.append((result["name"], result["params"], reference[key], result["seconds"]))
+    return regressions
+
+
+def golden_q(root):
+    """
+    Runs the golden case in grid and compact storage.
+    :param root: directory for the base data of the case (type: string)
+    :return: combinations, daily IDs and streamflow of both runs (type: tuple)
+    """
+    case = GOLDEN_CASE
+    store, grid, start, end = synthetic_data(root, case["nrows"], case["ncols"], case["n_days"], case["n_stations"],
+                                             case["cellsize"], seed=case["seed"])
+    grids = FileDataStore(root, BASIN_MASK).static_grids()
+    forcing, _ = store.load_forcing(start, end)
+    climate, precipitation = forcing.climate, forcing.precipitation
+    pet = [grids.pet(int(climate.month[i]), climate.temperature[i], climate.humidity[i]) for i in range(len(forcing))]
+    fields = [interpolate_precipitation(precipitation.station_xy, precipitation.values[i], grid, case["idw_exponent"])
+              for i in range(len(forcing))]
+    runs = []
+    for cells in (None, CellIndex(grids, grids.fc)):
+        sweep = ParameterSweep(grids, case["rp_factor"], case["c"], grids.fc.copy(), None, case["idw_exponent"],
+                               cells=cells)
+        runs.append(simulate_q(sweep, pet.__getitem__, fields.__getitem__, len(forcing)))
+    return sweep.combinations, climate.tages_id, runs
+
+
+def read_golden(path):
+    """
+    :return: streamflow of the golden table keyed by (rp, c, idw) as lists in the order of the days (type: dict)
+    """
+    table = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8")
+    golden = {}
+    for row in table:
+        golden.setdefault((float(row["rp"]), float(row["c"]), float(row["idw"])), []).append(float(row["Q"]))
+    return golden
+
+
+def check_golden(path=GOLDEN_PATH, rtol=1e-9, update=False, log=print):
+    """
+    Compares the streamflow of the golden case with the golden table. With update, the table is written first from
+    the reference of the toolbox equations (reference.py) on the same base data.
+    :param path: path of the golden table (type: string)
+    :param rtol: relative tolerance (type: float)
+    :param update: write the golden table from the reference before comparing (type: boolean)
+    :param log: function for messages (type: callable)
+    :return: True if the streamflow matches (type: boolean)
+    """
+    case = GOLDEN_CASE
+    with tempfile.TemporaryDirectory() as root:
+        combinations, tages_id, runs = golden_q(root)
+        if update:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_golden(path, *reference_q(root, BASIN_MASK, case["rp_factor"], case["c"], case["idw_exponent"]))
+            log("Golden table written from the reference: {}".format(path))
+    golden = read_golden(path)
+    ok = True
+    for label, q in zip(["grid", "compact"], runs):
+        for k, combination in enumerate(combinations):
+            expected = golden.get(tuple(float(value) for value in combination))
+            if expected is None or len(expected) != len(q) or not np.allclose(q[:, k], expected, rtol=rtol, atol=0.0):
+                log("Golden mismatch ({}): rp={} c={} idw={}".format(label, *combination))
+                ok = False
+    log("Golden check {}: {} combinations, {} days, grid and compact storage".format(
+        "passed" if ok else "FAILED", len(combinations), len(tages_id)))
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the SWM model engine on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300], help="rows and columns of the grids")
+    parser.add_argument("--days", type=int, nargs="+", default=[60], help="numbers of days")
+    parser.add_argument("--combinations", type=int, nargs="+", default=[1, 27], help="numbers of combinations")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the median is reported")
+    parser.add_argument("--output", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON file of a baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slow-down counted as regression")
+    parser.add_argument("--golden-only", action="store_true", help="only run the golden check")
+    parser.add_argument("--update-golden", action="store_true", help="write the golden table from the reference and check")
+    args = parser.parse_args(argv)
+
+    if args.update_golden:
+        return int(not check_golden(update=True))
+    failed = not check_golden()
+    if args.golden_only:
+        return int(failed)
+
+    results = run_benchmarks(args.sizes, args.days, args.combinations, args.repeat)
+    if args.output:
+        document = {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                    "processor": platform.processor(), "golden": not failed, "results": results}
+        with open(args.output, "w", encoding="utf-8") as json_file:
+            json.dump(document, json_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as json_file:
+            baseline = json.load(json_file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, params, before, after in regressions:
+            print("Regression {} {}: {:.4f} s -> {:.4f} s (+{:.0%})".format(
+                name, json.dumps(params, sort_keys=True), before, after, after / before - 1))
+        if not regressions:
+            print("No regression above {:.0%} against {}".format(args.threshold, args.baseline))
+        failed = failed or bool(regressions)
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Independent reference of the golden streamflow, without the package "swm".
+
+The equations of the original toolbox (PET by Haude, AET, total runoff, soil runoff according to Glugla (1969),
+overflow runoff, soilwater content and streamflow) are evaluated cell by cell and day by day with plain Python floats,
+and the precipitation of every cell is interpolated as the "Idw" tool of the Spatial Analyst does on the query table
+of a day: only stations with a reading are searched, all of them within the radius, or the nearest min_points if the
+radius holds fewer. The base data are read directly from the ASCII rasters and CSV tables of a data directory, so the
+golden table does not depend on the engine it checks.
+
+The golden table is regenerated from this reference (e.g. after an intended change of the model equations) with
+    python benchmark/benchmark.py --update-golden
+"""
+
+import csv
+import datetime
+import math
+import os
+
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'Mai', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dez']
+
+
+def read_ascii(path):
+    """
+    Reads an ESRI ASCII raster.
+    :param path: path of the raster (type: string)
+    :return: header keyed by lower case name (type: dict) and the values by row, None for NoData (type: list of lists)
+    """
+    with open(path, encoding="utf-8") as asc_file:
+        lines = asc_file.read().splitlines()
+    header = {}
+    for line in lines[:6]:
+        name, value = line.split()
+        header[name.lower()] = float(value)
+    nodata = header.get("nodata_value")
+    rows = [[None if float(value) == nodata else float(value) for value in line.split()] for line in lines[6:]
+            if line.strip()]
+    return header, rows
+
+
+def read_table(path):
+    """
+    :param path: path of a semicolon separated CSV table (type: string)
+    :return: rows keyed by field name (type: list of dicts)
+    """
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        return list(csv.DictReader(csv_file, delimiter=";"))
+
+
+def idw(x, y, stations, power, radius, min_points):
+    """
+    Interpolates the precipitation of a cell.
+    :param x: x coordinate of the cell centre (type: float)
+    :param y: y coordinate of the cell centre (type: float)
+    :param stations: x, y and reading of the stations with a reading (type: list of tuples)
+    :param power: IDW power (type: float)
+    :param radius: search radius (type: float)
+    :param min_points: minimum number of stations (type: integer)
+    :return: precipitation (type: float)
+    """
+    by_distance = sorted((math.hypot(sx - x, sy - y), value) for sx, sy, value in stations)
+    neighbours = [pair for rank, pair in enumerate(by_distance) if pair[0] <= radius or rank < min_points]
+    for distance, value in neighbours:
+        if distance == 0:
+            return value
+    numerator = sum(value / distance ** power for distance, value in neighbours)
+    denominator = sum(1.0 / distance ** power for distance, value in neighbours)
+    return numerator / denominator
+
+
+def reference_q(directory, basin, rp_factor, c, idw_exponent, radius=20000.0, min_points=5):
+    """
+    Simulates all combinations of RP factor, c parameter and IDW exponent over the days of the climate table, starting
+    from a soilwater content at field capacity.
+    :param directory: data directory as written by swm.synthetic_data (type: string)
+    :param basin: raster whose NoData cells lie outside the basin (type: string)
+    :param rp_factor: RP factors (type: list)
+    :param c: c parameters (type: list)
+    :param idw_exponent: IDW exponents (type: list)
+    :param radius: IDW search radius (type: float)
+    :param min_points: minimum number of stations per cell (type: integer)
+    :return: combinations, daily IDs and the streamflow per combination and day (type: tuple of lists)
+    """
+    def raster(name):
+        return read_ascii(os.path.join(directory, name + ".asc"))
+
+    header, mask = raster(basin)
+    nrows, ncols, cellsize = int(header["nrows"]), int(header["ncols"]), header["cellsize"]
+    x_min, y_max = header["xllcorner"], header["yllcorner"] + nrows * cellsize
+    fc, wp, l_m, water = [raster(name)[1] for name in ["FK", "WP", "L_in_metern", "Gewaessermaske"]]
+    haude = [raster("Haude_" + month)[1] for month in MONTHS]
+
+    # Cells of the basin, water cells have the value 1 in the water mask and land cells 0
+    cells = []
+    for row in range(nrows):
+        for col in range(ncols):
+            if mask[row][col] is None or water[row][col] not in (0.0, 1.0):
+                continue
+            cells.append({"x": x_min + (col + 0.5) * cellsize, "y": y_max - (row + 0.5) * cellsize,
+                          "water": water[row][col] == 1.0, "fc": fc[row][col], "wp": wp[row][col],
+                          "l_m": l_m[row][col], "haude": [factor[row][col] for factor in haude]})
+
+    # RP factors not above the maximum quotient of wilting point and field capacity are skipped
+    rp_control = max([cell["wp"] / cell["fc"] for cell in cells if cell["fc"]] + [0.0])
+    combinations = [(rp, c_value, power) for rp in rp_factor for c_value in c for power in idw_exponent
+                    if rp_control < rp]
+
+    climate = read_table(os.path.join(directory, "TempFeuchte.csv"))
+    station_xy = {row["Stationsnummer"]: (float(row["X"]), float(row["Y"]))
+                  for row in read_table(os.path.join(directory, "N_Messstationen.csv"))}
+    readings = {}
+    for row in read_table(os.path.join(directory, "N_Zeitreihen.csv")):
+        readings.setdefault(int(row["TagesID"]), []).append(station_xy[row["Stationsnummer"]] +
+                                                              (float(row["Tagessumme_mm"]),))
+
+    tages_id = [int(day["TagesID"]) for day in climate]
+    q = {combination: [] for combination in combinations}
+    soilwater = {combination: [cell["fc"] for cell in cells] for combination in combinations}
+    for day in climate:
+        month, humidity, temperature = int(day["Monat"]), float(day["RelFeu"]), float(day["Temp_"])
+        stations = readings.get(int(day["TagesID"]), [])
+        vapour_pressure = 6.1 * 10 ** ((7.5 * temperature) / (temperature + 237.2))
+        pet = [cell["haude"][month - 1] * vapour_pressure * (1.0 - humidity / 100.0) for cell in cells]
+        precipitation = {power: [idw(cell["x"], cell["y"], stations, power, radius, min_points) for cell in cells]
+                         for power in idw_exponent}
+        for combination in combinations:
+            rp_value, c_value, power = combination
+            runoff_sum = 0.0
+            for i, cell in enumerate(cells):
+                p, s_pre = precipitation[power][i], soilwater[combination][i]
+                if cell["water"]:
+                    runoff_sum += p - pet[i] if p > pet[i] else p
+                    continue
+                rp = cell["fc"] * rp_value
+                rpwp_dif = rp - cell["wp"]
+                if s_pre >= rp:
+                    aet = pet[i]
+                elif rpwp_dif == 0:
+                    aet = 0.0
+                else:
+                    aet = (s_pre - cell["wp"]) / rpwp_dif * pet[i]
+                lambda_param = c_value / (cell["l_m"] * 1000) ** 2
+                runoff = lambda_param * (s_pre - cell["wp"]) ** 2 + max(p + s_pre - cell["fc"], 0.0)
+                runoff_sum += runoff
+                soilwater[combination][i] = max(s_pre + p - aet - runoff, 0.0)
+            q[combination].append(runoff_sum * 0.001 * cellsize ** 2 / 24 / 60 / 60)
+    return combinations, tages_id, [q[combination] for combination in combinations]
+
+
+def write_golden(path, combinations, tages_id, q):
+    """
+    Writes the golden table in long format (rp, c, idw, Datum, Q).
+    :param path: path of the CSV file (type: string)
+    :param combinations: (rp, c, idw) combinations (type: list of tuples)
+    :param tages_id: daily IDs (type: list)
+    :param q: streamflow per combination and day (type: list of lists)
+    """
+    dates = [datetime.date(day // 10000, day // 100 % 100, day % 100).strftime("%d.%m.%Y") for day in tages_id]
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file, lineterminator="\n")
+        writer.writerow(["rp", "c", "idw", "Datum", "Q"])
+        for (rp, c, power), values in zip(combinations, q):
+            writer.writerows([rp, c, power, date, repr(float(value))] for date, value in zip(dates, values))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Array based engine of the soil water model (SWM). The package does not depend on arcpy, except for the data source of
+the geodatabase (ArcpyDataStore), which imports arcpy when it is created. The ArcGIS toolbox (swm_arcgispro.pyt) and
+the command line (python -m swm) both run the model through swm.engine.
+"""
+
+from .kernel import MONTHS, RASTER_NAMES, StaticGrids, SoilWaterModel, haude_pet, runoff_to_q, water_balance_step
+from .compact import CellIndex, CompactSoilWaterModel
+from .sweep import ParameterSweep, combination_name, parameter_range
+from .grid import Grid
+from .idw import (IdwNeighbours, IdwRanking, IdwWeights, idw_neighbours, idw_ranking, idw_weights,
+                  interpolate_precipitation)
+from .forcing import ClimateSeries, Forcing, PrecipitationSeries, daily_ids, date_to_tages_id, tages_id_to_date
+from .cache import DiskCache, ForcingCache, ForcingCube
+from .output import QResultWriter, read_q_csv, write_q_csv, write_q_long_csv, write_q_quantile_csv
+from .parallel import run_parallel
+from .writer import AsyncRasterWriter
+from .aggregate import STATISTICS, Aggregator, Window, hydrological_year_windows, monthly_windows, period_window
+from .checkpoint import Snapshot, latest_snapshot, save_checkpoint, snapshot_path
+from .evaluate import SKILL_SCORES, ObservedSeries, evaluate, observed_on, rank, skill_scores, write_skill_table
+from .optimize import Candidate, GridRefinement
+from .tiles import run_tiled, tile_windows
+from .ensemble import EnsembleForcing, EnsembleSweep, Perturbation, run_ensemble
+from .basins import BasinSet, run_basins
+from .datastore import (FileDataStore, read_ascii_grid, read_geotiff, read_raster, write_ascii_grid, write_geotiff,
+                        write_raster)
+from .synthetic import synthetic_data
+from .profiling import STAGES, NullProfiler, Profiler, peak_memory
+from .arcgis import ArcpyDataStore
+from .results import ResultStore, StoredResult, forcing_mode, input_key
+from .engine import DEFAULTS, ModelRun, RunConfig, open_source
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregation of the daily rasters over time windows (calendar months, hydrological years, user defined periods).
+
+Every window holds in-place float64 accumulators of the chosen statistics (sum, mean, min, max, count) per raster and
+is emitted as soon as its last day has been added, so any number of windows can be calculated in one run. NaN values
+(NoData) are not counted, cells without any value are NaN in the results.
+"""
+
+import datetime
+
+import numpy as np
+
+from .forcing import date_to_tages_id, tages_id_to_date
+
+
+STATISTICS = ["sum", "mean", "min", "max", "count"]
+# Statistics of the former raster sums: totals of the fluxes and the mean soilwater content
+DEFAULT_STATISTICS = {"S": ["mean"]}
+DEFAULT_STATISTIC = ["sum"]
+
+
+class Window(object):
+    def __init__(self, name, start, end):
+        """
+        Time window of an aggregation.
+        :param name: name used in the file names of the results (type: string)
+        :param start: first daily ID (type: integer)
+        :param end: last daily ID (type: integer)
+        """
+        self.name = name
+        self.start = int(start)
+        self.end = int(end)
+
+    def __contains__(self, tages_id):
+        return self.start <= int(tages_id) <= self.end
+
+    def __repr__(self):
+        return "Window({!r}, {}, {})".format(self.name, self.start, self.end)
+
+
+def period_window(start, end):
+    """
+    Creates a user defined window named after its first and last day (as the former raster sums).
+    :param start: first daily ID (type: integer)
+    :param end: last daily ID (type: integer)
+    :return: window (type: Window)
+    """
+    return Window("{}_{}".format(int(start), int(end)), start, end)
+
+
+def monthly_windows(start, end):
+    """
+    Creates one window per calendar month of a period. The first and last month are clipped to the period.
+    :param start: first daily ID (type: integer)
+    :param end: last daily ID (type: integer)
+    :return: windows (type: list)
+    """
+    windows = []
+    first, last = tages_id_to_date(start), tages_id_to_date(end)
+    month_start = first
+    while month_start <= last:
+        next_month = datetime.date(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1)
+        month_end = min(next_month - datetime.timedelta(days=1), last)
+        windows.append(Window("M{:04d}{:02d}".format(month_start.year, month_start.month),
+                              date_to_tages_id(month_start), date_to_tages_id(month_end)))
+        month_start = next_month
+    return windows
+
+
+def hydrological_year_windows(start, end, first_month=11):
+    """
+    Creates one window per hydrological year of a period, which is named after the calendar year it ends in (in
+    Germany from 1 November to 31 October). The first and last year are clipped to the period.
+    :param start: first daily ID (type: integer)
+    :param end: last daily ID (type: integer)
+    :param first_month: first month of the hydrological year (type: integer)
+    :return: windows (type: list)
+    """
+    windows = []
+    first, last = tages_id_to_date(start), tages_id_to_date(end)
+    year = first.year + (1 if first.month >= first_month and first_month > 1 else 0)
+    year_start = first
+    while year_start <= last:
+        next_start = datetime.date(year if first_month > 1 else year + 1, first_month, 1)
+        year_end = min(next_start - datetime.timedelta(days=1), last)
+        windows.append(Window("HJ{:04d}".format(year), date_to_tages_id(year_start), date_to_tages_id(year_end)))
+        year_start = next_start
+        year += 1
+    return windows
+
+
+class Aggregator(object):
+    def __init__(self, windows, statistics=None):
+        """
+        Aggregates the daily rasters over several windows at once.
+        :param windows: time windows (type: list of Window)
+        :param statistics: statistics for all rasters, the totals of the fluxes and the mean soilwater content if None
+                           (type: list)
+        """
+        self.windows = sorted(windows, key=lambda window: (window.end, window.start))
+        self.statistics = None if statistics is None else list(statistics)
+        unknown = set(self.statistics or []) - set(STATISTICS)
+        if unknown:
+            raise ValueError("Unbekannte Statistik: {}".format(", ".join(sorted(unknown))))
+        self._open = {}
+
+    def statistics_of(self, name):
+        """
+        :param name: raster name (type: string)
+        :return: statistics calculated for the raster (type: list)
+        """
+        if self.statistics is not None:
+            return self.statistics
+        return DEFAULT_STATISTICS.get(name, DEFAULT_STATISTIC)
+
+    def add(self, tages_id, rasters):
+        """
+        Adds the rasters of a day to all windows containing the day.
+        :param tages_id: daily ID (type: integer)
+        :param rasters: arrays keyed by raster name (type: dict)
+        :return: windows ending with this day and their results keyed by "<raster>_<statistic>" (type: list of tuples)
+        """
+        closed = []
+        prepared = None
+        for window in self.windows:
+            if tages_id not in window:
+                continue
+            if prepared is None:
+                # Values, validity and NaN-free values are prepared once per day for all windows
+                prepared = {}
+                for name, array in rasters.items():
+                    array = np.asarray(array, dtype=np.float64)
+                    valid = ~np.isnan(array)
+                    prepared[name] = (array, valid, np.where(valid, array, 0.0))
+            accumulators = self._open.setdefault(window.name, {})
+            for name, values in prepared.items():
+                self._accumulate(accumulators, name, *values)
+            if int(tages_id) == window.end:
+                closed.append((window, self._results(self._open.pop(window.name))))
+        return closed
+
+    def _accumulate(self, accumulators, name, array, valid, filled):
+        """
+        Adds one raster to the accumulators of a window in place.
+        """
+        if name not in accumulators:
+            accumulators[name] = {"count": valid.astype(np.float64), "sum": filled.copy(), "min": array.copy(),
+                                  "max": array.copy()}
+            return
+        acc = accumulators[name]
+        if acc["count"].shape != np.broadcast_shapes(acc["count"].shape, array.shape):
+            for key in acc:
+                acc[key] = np.broadcast_to(acc[key], array.shape).copy()
+        acc["count"] += valid
+        acc["sum"] += filled
+        np.fmin(acc["min"], array, out=acc["min"])
+        np.fmax(acc["max"], array, out=acc["max"])
+
+    def _results(self, accumulators):
+        """
+        Calculates the statistics of a closed window.
+        :param accumulators: accumulators keyed by raster name (type: dict)
+        :return: results keyed by "<raster>_<statistic>" (type: dict)
+        """
+        results = {}
+        for name, acc in accumulators.items():
+            empty = acc["count"] == 0
+            for statistic in self.statistics_of(name):
+                if statistic == "count":
+                    result = acc["count"]
+                elif statistic == "mean":
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        result = acc["sum"] / acc["count"]
+                else:
+                    result = np.where(empty, np.nan, acc[statistic])
+                results["{}_{}".format(name, statistic)] = result
+        return results
+
+    def state(self):
+        """
+        :return: accumulators of the open windows keyed by window, raster and accumulator name (type: dict)
+        """
+        return {window: {name: {key: array.copy() for key, array in acc.items()} for name, acc in accumulators.items()}
+                for window, accumulators in self._open.items()}
+
+    def set_state(self, state):
+        """
+        Restores the accumulators of the open windows, e.g. from a snapshot.
+        :param state: accumulators as returned by state (type: dict)
+        """
+        self._open = {window: {name: {key: np.array(array, dtype=np.float64) for key, array in acc.items()}
+                               for name, acc in accumulators.items()} for window, accumulators in state.items()}
+
+    def pending(self):
+        """
+        :return: names of the windows that have started but not yet ended (type: list)
+        """
+        return list(self._open)
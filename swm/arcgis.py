@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Data source of the geodatabase of the toolbox. This is the only module of the package that needs arcpy and the Spatial
+Analyst extension, arcpy is imported when the data source is created.
+"""
+
+import threading
+
+import numpy as np
+
+from .datastore import CLIMATE_FIELDS, PRECIPITATION_FIELDS, STATIC_RASTERS
+from .forcing import ClimateSeries, Forcing, PrecipitationSeries
+from .grid import Grid
+from .kernel import MONTHS, StaticGrids
+from .tiles import tile_windows
+
+
+class ArcpyDataStore(object):
+    def __init__(self, data, basin, s_init, basins=None):
+        """
+        Base data of a basin in a geodatabase, all rasters are clipped to the basin and read on the grid of the initial
+        soilwater content.
+        :param data: path of the geodatabase (type: string)
+        :param basin: feature class of the basin (type: string)
+        :param s_init: raster of the initial soilwater content (type: string)
+        :param basins: feature classes of several basins, the rasters are clipped to their union with basin
+                       (type: list)
+        """
+        import arcpy
+        import arcpy.sa
+
+        self.arcpy = arcpy
+        self.sa = arcpy.sa
+        arcpy.CheckOutExtension("Spatial")
+        self.data = data
+        self.basins = list(basins or [])
+        if self.basins:
+            # Batch mode: the rasters are clipped to the union of all basins, the basins are simulated together
+            basin = arcpy.management.Merge(self.basins + ([basin] if basin else []), r"memory\swm_basins")[0]
+        self.basin = basin
+        self.s_init = self.sa.ExtractByMask(s_init, basin)
+        self.raster_suffix = ".tif"
+        # arcpy is not thread-safe, the rasters saved by the writer threads (AsyncRasterWriter) are written one by one
+        self._lock = threading.Lock()
+
+        # Set main settings
+        arcpy.env.overwriteOutput = True  # Allow overwriting of outputs
+        arcpy.env.extent = self.s_init  # Set the working extent to the initial soil water storage raster
+        arcpy.env.snapRaster = self.s_init  # Align all rasters (e.g. the IDW output) to the grid of s_init
+        arcpy.env.compression = "LZW"  # Write the GeoTIFFs compressed
+
+        # Define the grid of the model by the initial soil water storage raster
+        self.cellsize = self.s_init.meanCellHeight
+        self.lower_left = arcpy.Point(self.s_init.extent.XMin, self.s_init.extent.YMin)
+        self.spatial_reference = self.s_init.spatialReference
+        self.grid = Grid(self.s_init.extent.XMin, self.s_init.extent.YMax, self.cellsize, self.s_init.height,
+                         self.s_init.width)
+
+    def use_scratch(self, path):
+        """
+        :param path: scratch directory (type: string)
+        """
+        self.arcpy.env.scratchWorkspace = path  # Set the scratch workspace
+
+    def raster_to_array(self, raster, out=None):
+        """
+        Converts a raster into a numpy array on the grid of the initial soilwater storage. NoData becomes NaN.
+        :param raster: raster object (type: raster)
+        :param out: array to fill block by block, e.g. a memory-mapped grid in tiled mode (type: array)
+        :return: array of the raster values (type: array)
+        """
+        arcpy = self.arcpy
+        nrows, ncols = self.grid.shape
+        # Convert the raster to float to allow NaN as NoData value
+        raster = self.sa.Float(raster)
+        if out is None:
+            return arcpy.RasterToNumPyArray(raster, self.lower_left, ncols, nrows,
+                                            nodata_to_value=np.nan).astype(np.float64)
+        for rows, cols in tile_windows((nrows, ncols), 1024):
+            block_lower_left = arcpy.Point(self.lower_left.X + cols.start * self.cellsize,
+                                           self.lower_left.Y + (nrows - rows.stop) * self.cellsize)
+            out[rows, cols] = arcpy.RasterToNumPyArray(raster, block_lower_left, cols.stop - cols.start,
+                                                       rows.stop - rows.start, nodata_to_value=np.nan)
+        return out
+
+    def _clipped(self, name, out=None):
+        """
+        :param name: raster name in the geodatabase (type: string)
+        :param out: array to fill, e.g. a memory-mapped grid (type: array)
+        :return: raster values clipped to the basin (type: array)
+        """
+        return self.raster_to_array(self.sa.ExtractByMask(self.sa.Raster(r'{}\{}'.format(self.data, name)),
+                                                          self.basin), out)
+
+    def static_grids(self, memmap=None):
+        """
+        Reads the static rasters, clipped to the basin.
+        :param memmap: function creating memory-mapped grids by name and number of layers, e.g. for the tiled mode
+                       (type: callable)
+        :return: static raster data (type: StaticGrids)
+        """
+        arrays = {name: self._clipped(raster_name, None if memmap is None else memmap(name))
+                  for name, raster_name in STATIC_RASTERS.items()}
+        haude = np.empty((len(MONTHS),) + self.grid.shape) if memmap is None else memmap("haude", len(MONTHS))
+        for m, month in enumerate(MONTHS):
+            self._clipped("Haude_" + month, haude[m])
+        return StaticGrids(haude=haude, cellsize=self.cellsize, **arrays)
+
+    def initial_state(self, memmap=None):
+        """
+        :param memmap: function creating memory-mapped grids by name (type: callable)
+        :return: initial soilwater content clipped to the basin (type: array)
+        """
+        return self.raster_to_array(self.s_init, None if memmap is None else memmap("s_init"))
+
+    def station_coordinates(self):
+        """
+        Reads the numbers and coordinates of the precipitation stations ("N_Messstationen").
+        :return: station numbers (type: list) and coordinates (type: array of shape (stations, 2))
+        """
+        with self.arcpy.da.SearchCursor(r'{}\N_Messstationen'.format(self.data),
+                                        ["Stationsnummer", "SHAPE@XY"]) as cursor:
+            stations = [(row[0], row[1]) for row in cursor]
+        return ([station[0] for station in stations],
+                np.array([station[1] for station in stations], dtype=np.float64).reshape(-1, 2))
+
+    def load_forcing(self, start, end):
+        """
+        Reads the climate data ("TempFeuchte_") and the precipitation timeseries ("N_Zeitreihen") of the period in one
+        pass each and checks them for gaps.
+        :param start: first daily ID (type: integer)
+        :param end: last daily ID (type: integer)
+        :return: forcing and the warnings of the check (type: tuple of Forcing and list)
+        """
+        period = "TagesID >= {0} AND TagesID <= {1}".format(start, end)
+        with self.arcpy.da.SearchCursor(r'{}\TempFeuchte_'.format(self.data), CLIMATE_FIELDS, period) as cursor:
+            climate = ClimateSeries.from_records([row for row in cursor])
+        stations, station_xy = self.station_coordinates()
+        with self.arcpy.da.SearchCursor(r'{}\N_Zeitreihen'.format(self.data), PRECIPITATION_FIELDS, period) as cursor:
+            precipitation = PrecipitationSeries.from_records(stations, station_xy, climate.tages_id,
+                                                             [row for row in cursor])
+        forcing = Forcing(climate, precipitation)
+        return forcing, forcing.check(int(start), int(end))
+
+    def basin_masks(self, name_field=None):
+        """
+        Rasterises every polygon of the basin feature classes on the grid of the initial soilwater storage.
+        :param name_field: field with the names of the basins, the OID is used if empty or missing (type: string)
+        :return: names of the basins (type: list) and their cells (type: array of shape (basins, rows, cols))
+        """
+        arcpy = self.arcpy
+        names, masks = [], []
+        cells = self.sa.Raster(r'{}\Gewaessermaske'.format(self.data))  # Covers land and water cells
+        for feature_class in self.basins:
+            description = arcpy.Describe(feature_class)
+            fields = [field.name for field in arcpy.ListFields(feature_class)]
+            label_field = name_field if name_field in fields else description.OIDFieldName
+            with arcpy.da.SearchCursor(feature_class, ["OID@", label_field]) as cursor:
+                features = [row for row in cursor]
+            for oid, label in features:
+                layer = arcpy.management.MakeFeatureLayer(feature_class, "swm_basin",
+                                                          "{} = {}".format(description.OIDFieldName, oid))
+                masks.append(np.isfinite(self.raster_to_array(self.sa.ExtractByMask(cells, layer))))
+                arcpy.management.Delete(layer)
+                names.append(str(label) if label_field == name_field else "{}_{}".format(description.baseName, oid))
+        return names, np.array(masks)
+
+    def save_raster(self, array, path):
+        """
+        Saves a numpy array as raster on the grid of the initial soilwater storage. NaN becomes NoData. The arcpy calls
+        are serialised, so the method can be used by several writer threads.
+        :param array: array of the raster values (type: array)
+        :param path: path of the output raster (type: string)
+        """
+        with self._lock:
+            raster = self.arcpy.NumPyArrayToRaster(array, self.lower_left, self.cellsize, self.cellsize, np.nan)
+            raster.save(path)
+            self.arcpy.management.DefineProjection(path, self.spatial_reference)
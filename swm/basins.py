@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Several basins in one run: the forcing is calculated once on the union of the basins and the streamflow is summed per
+basin.
+
+The model has no lateral flow and the state of a cell does not depend on the basin it belongs to, so the cells of the
+union are simulated once and the runoff is summed over the cells of every basin with a sparse membership matrix.
+Nested basins, which share most of their cells, do not repeat any calculation.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from .kernel import runoff_to_q
+
+
+class BasinSet(object):
+    def __init__(self, names, masks):
+        """
+        Basins on the model grid, which may overlap (e.g. nested gauges).
+        :param names: names of the basins, used for the output folders (type: list of strings)
+        :param masks: cells of every basin (type: boolean array of shape (basins, rows, cols))
+        """
+        self.names = [str(name) for name in names]
+        self.masks = np.asarray(masks, dtype=bool)
+        if len(self.names) != len(self.masks):
+            raise ValueError("Anzahl der Namen und Masken der Einzugsgebiete unterscheidet sich.")
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Namen der Einzugsgebiete sind nicht eindeutig.")
+        self.shape = self.masks.shape[1:]
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def union(self):
+        """
+        :return: cells belonging to any basin (type: boolean array)
+        """
+        return self.masks.any(axis=0)
+
+    def cell_counts(self):
+        """
+        :return: number of cells per basin (type: array)
+        """
+        return self.masks.reshape(len(self), -1).sum(axis=1)
+
+    def membership(self, cells=None):
+        """
+        Creates the matrix that sums the values of the simulated cells per basin.
+        :param cells: index of the active cells in compact mode, all cells of the grid if None (type: CellIndex)
+        :return: membership (type: sparse matrix of shape (basins, cells))
+        """
+        flat = self.masks.reshape(len(self), -1)
+        if cells is not None:
+            flat = flat[:, cells.cells]
+        basin, cell = np.nonzero(flat)
+        return sparse.csr_matrix((np.ones(len(basin)), (basin, cell)), shape=flat.shape)
+
+
+def run_basins(sweep, basins, pet, precipitation, n_days, log=None):
+    """
+    Simulates all combinations on the union of the basins and sums up the streamflow of every basin.
+    :param sweep: parameter sweep on the union of the basins (type: ParameterSweep)
+    :param basins: basins on the grid of the sweep (type: BasinSet)
+    :param pet: function returning the PET of day i (type: callable)
+    :param precipitation: function returning the precipitation fields of day i (type: callable)
+    :param n_days: number of days (type: integer)
+    :param log: function for messages (type: callable)
+    :return: streamflow per day, basin and combination (type: array of shape (days, basins, combinations))
+    """
+    matrix = basins.membership(sweep.cells)
+    q = np.empty((n_days, len(basins), len(sweep)))
+    for i in range(n_days):
+        fluxes, _ = sweep.step(precipitation(i), pet(i))
+        runoff = np.nan_to_num(fluxes["R"].reshape(len(sweep), -1), nan=0.0)
+        q[i] = runoff_to_q(matrix @ runoff.T, sweep.grids.cellsize, axis=())
+        if log and (i + 1) % 365 == 0:
+            log("Einzugsgebiete: {} von {} Tagen berechnet.".format(i + 1, n_days))
+    return q
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of the daily forcing (PET and IDW precipitation) as memory-mapped day x row x col cubes.
+
+An entry is identified by a hash of the static inputs (Haude-factors clipped to the basin, grid, station coordinates,
+IDW exponents and search settings) and holds a hash of the input data of every day. A run reuses an entry if all its
+days are contained with identical input data, so a changed table, basin, cellsize or exponent invalidates the entry
+automatically. The forcing of a cell does not depend on the extent of the grid, so an entry written block by block
+(tile_size) equals an entry of the whole grid and the block size is not part of the hash. The cache is limited in size, least recently used entries are removed first (DiskCache, which is
+shared with the result store).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .idw import IDW_MIN_POINTS, IDW_RADIUS, clear_cache, interpolate_precipitation
+from .tiles import tile_windows
+
+
+META_FILE = "meta.json"
+# Changes of the forcing calculation (e.g. the IDW of days with missing readings) must raise the version, which
+# invalidates all cache entries
+FORCING_VERSION = 2
+
+
+def _hash_arrays(*arrays):
+    """
+    Calculates a hash over the content of arrays.
+    :param arrays: arrays or values (type: array or float)
+    :return: hash (type: string)
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.asarray(array)
+        digest.update(str(array.dtype).encode())
+        digest.update(str(array.shape).encode())
+        # Large (e.g. memory-mapped) arrays are hashed in blocks of rows, which yields the same hash
+        if array.ndim == 0:
+            digest.update(np.ascontiguousarray(array).tobytes())
+        for start in range(0, len(array) if array.ndim else 0, 256):
+            digest.update(np.ascontiguousarray(array[start:start + 256]).tobytes())
+    return digest.hexdigest()
+
+
+def static_key(grids, grid, station_xy, idw_exponent, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS, dtype=np.float64):
+    """
+    Calculates the hash of the inputs that do not change from day to day.
+    :param grids: static raster data of the basin (type: StaticGrids)
+    :param grid: model grid (type: Grid)
+    :param station_xy: coordinates of the stations (type: array)
+    :param idw_exponent: IDW exponents (type: list)
+    :param radius: IDW search radius (type: float)
+    :param min_points: minimum number of stations per cell (type: integer)
+    :param dtype: data type of the cubes (type: numpy dtype)
+    :return: hash (type: string)
+    """
+    return _hash_arrays(np.array(FORCING_VERSION), grids.haude, np.array(grid.key()), np.asarray(station_xy, dtype=np.float64),
+                        np.asarray(idw_exponent, dtype=np.float64), np.array([radius, min_points]),
+                        np.array(np.dtype(dtype).str))
+
+
+def day_keys(forcing):
+    """
+    Calculates the hash of the input data of every day (climate data and station precipitation).
+    :param forcing: climate and precipitation data (type: Forcing)
+    :return: hashes (type: list)
+    """
+    climate = forcing.climate
+    precipitation = forcing.precipitation.values
+    return [_hash_arrays(climate.tages_id[i], climate.month[i], climate.temperature[i], climate.humidity[i],
+                         precipitation[i]) for i in range(len(forcing))]
+
+
+class ForcingCube(object):
+    def __init__(self, path, meta, rows):
+        """
+        Read access to the cached forcing of a run.
+        :param path: directory of the cache entry (type: string)
+        :param meta: metadata of the entry (type: dict)
+        :param rows: row of every day of the run in the cubes (type: array)
+        """
+        self.path = path
+        self.meta = meta
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self._pet = np.load(os.path.join(path, "pet.npy"), mmap_mode="r")
+        self._precipitation = np.load(os.path.join(path, "p.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def pet(self, i, window=None):
+        """
+        :param i: index of the day in the run (type: integer)
+        :param window: rows and columns of a block, the whole grid if None (type: tuple of slices)
+        :return: PET of the day (type: array)
+        """
+        pet = self._pet[self.rows[i]]
+        return np.asarray(pet if window is None else pet[window], dtype=np.float64)
+
+    def precipitation(self, i, window=None):
+        """
+        :param i: index of the day in the run (type: integer)
+        :param window: rows and columns of a block, the whole grid if None (type: tuple of slices)
+        :return: precipitation of the day, one field per IDW exponent (type: array)
+        """
+        precipitation = self._precipitation[self.rows[i]]
+        return np.asarray(precipitation if window is None else precipitation[(slice(None),) + tuple(window)],
+                          dtype=np.float64)
+
+    def close(self):
+        """Releases the memory maps."""
+        self._pet = self._precipitation = None
+
+
+class DiskCache(object):
+    def __init__(self, root, max_bytes=None):
+        """
+        Cache directory with one subdirectory per entry, each holding its metadata (including its size in bytes and
+        the time of its last use) in META_FILE.
+        :param root: directory of the cache (type: string)
+        :param max_bytes: maximum size of all entries, unlimited if None (type: integer)
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def entries(self):
+        """
+        :return: metadata of all complete entries keyed by their directory (type: dict)
+        """
+        entries = {}
+        for name in os.listdir(self.root):
+            meta_path = os.path.join(self.root, name, META_FILE)
+            if os.path.isfile(meta_path):
+                with open(meta_path, encoding="utf-8") as meta_file:
+                    entries[os.path.join(self.root, name)] = json.load(meta_file)
+        return entries
+
+    def _touch(self, path, meta):
+        """
+        Marks an entry as used.
+        :param path: directory of the entry (type: string)
+        :param meta: metadata of the entry (type: dict)
+        """
+        meta["last_used"] = time.time()
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+
+    def size(self):
+        """
+        :return: size of all entries in bytes (type: integer)
+        """
+        return sum(meta["bytes"] for meta in self.entries().values())
+
+    def evict(self, keep=()):
+        """
+        Removes the least recently used entries until the cache fits into the size limit.
+        :param keep: directories of entries that must not be removed, e.g. those of the current run (type: list)
+        :return: removed directories (type: list)
+        """
+        removed = []
+        if self.max_bytes is None:
+            return removed
+        entries = sorted(self.entries().items(), key=lambda item: item[1]["last_used"])
+        total = sum(meta["bytes"] for _, meta in entries)
+        for path, meta in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= meta["bytes"]
+            removed.append(path)
+        return removed
+
+    def clear(self):
+        """Removes all entries."""
+        for path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class ForcingCache(DiskCache):
+    def __init__(self, root, max_bytes=None, dtype=np.float64, tile_size=None):
+        """
+        Cache of the daily forcing.
+        :param root: directory of the cache (type: string)
+        :param max_bytes: maximum size of all entries, unlimited if None (type: integer)
+        :param dtype: data type of the cubes (type: numpy dtype)
+        :param tile_size: edge length in cells of the blocks new entries are calculated in, the whole grid at once if
+                          None (type: integer)
+        """
+        super(ForcingCache, self).__init__(root, max_bytes)
+        self.dtype = np.dtype(dtype)
+        self.tile_size = tile_size
+
+    def open(self, grids, grid, forcing, idw_exponent, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS, log=None):
+        """
+        Returns the forcing of a run from the cache. If no entry contains all days with identical input data, the
+        forcing is calculated and stored as new entry.
+        :param grids: static raster data of the basin (type: StaticGrids)
+        :param grid: model grid (type: Grid)
+        :param forcing: climate and precipitation data of the run (type: Forcing)
+        :param idw_exponent: IDW exponents (type: list)
+        :param radius: IDW search radius (type: float)
+        :param min_points: minimum number of stations per cell (type: integer)
+        :param log: function for messages (type: callable)
+        :return: forcing of the run (type: ForcingCube)
+        """
+        key = static_key(grids, grid, forcing.precipitation.station_xy, idw_exponent, radius, min_points, self.dtype)
+        days = day_keys(forcing)
+        for path, meta in self.entries().items():
+            if meta["static_key"] != key:
+                continue
+            row_of_day = {day: row for row, day in enumerate(meta["day_keys"])}
+            if all(day in row_of_day for day in days):
+                self._touch(path, meta)
+                if log:
+                    log("Forcing aus dem Cache gelesen: {}".format(path))
+                return ForcingCube(path, meta, [row_of_day[day] for day in days])
+
+        path = self._create(key, days, grids, grid, forcing, idw_exponent, radius, min_points)
+        if log:
+            log("Forcing berechnet und im Cache gespeichert: {}".format(path))
+        self.evict(keep=[path])
+        meta = self.entries()[path]
+        return ForcingCube(path, meta, np.arange(len(days)))
+
+    def _create(self, key, days, grids, grid, forcing, idw_exponent, radius, min_points):
+        """
+        Calculates the forcing of all days and writes a new entry. The entry is written to a temporary directory first
+        and only becomes visible when it is complete.
+        :return: directory of the entry (type: string)
+        """
+        entry = hashlib.sha256((key + "".join(days)).encode()).hexdigest()[:24]
+        path = os.path.join(self.root, entry)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        climate, precipitation = forcing.climate, forcing.precipitation
+        n_days = len(forcing)
+        pet_cube = np.lib.format.open_memmap(os.path.join(tmp_path, "pet.npy"), mode="w+", dtype=self.dtype,
+                                             shape=(n_days,) + grid.shape)
+        p_cube = np.lib.format.open_memmap(os.path.join(tmp_path, "p.npy"), mode="w+", dtype=self.dtype,
+                                           shape=(n_days, len(idw_exponent)) + grid.shape)
+        # The forcing is calculated block by block, so only the fields of one block are held in memory
+        for rows, cols in tile_windows(grid.shape, self.tile_size):
+            block_grids = grids if self.tile_size is None else grids.window(rows, cols)
+            block_grid = grid.window(rows, cols)
+            for i in range(n_days):
+                pet_cube[i, rows, cols] = block_grids.pet(int(climate.month[i]), climate.temperature[i],
+                                                          climate.humidity[i])
+                p_cube[i, :, rows, cols] = interpolate_precipitation(precipitation.station_xy, precipitation.values[i],
+                                                                     block_grid, list(idw_exponent), radius, min_points)
+            if self.tile_size is not None:
+                clear_cache()  # The IDW weights of a block are not needed again
+        pet_cube.flush()
+        p_cube.flush()
+        del pet_cube, p_cube
+
+        meta = {"static_key": key, "day_keys": days, "tages_id": climate.tages_id.tolist(),
+                "idw_exponent": [float(value) for value in idw_exponent], "dtype": self.dtype.str,
+                "bytes": _directory_size(tmp_path), "last_used": time.time()}
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return path
+
+
+def _directory_size(path):
+    """
+    :param path: directory (type: string)
+    :return: size of all files in the directory in bytes (type: integer)
+    """
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
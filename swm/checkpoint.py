@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshots of a running sweep: the soilwater content of every combination after a day, the position in the period and
+the accumulators of the open aggregation windows.
+
+A snapshot is a single .npz file holding only the cells with a soilwater content. It allows to resume an interrupted
+run, and its soilwater grids can be used as initial state of a later run (warm start), so a spin-up period does not
+have to be simulated again.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .sweep import combination_name
+
+
+class Snapshot(object):
+    def __init__(self, tages_id, day_index, combinations, state, aggregation=None, meta=None):
+        """
+        State of a sweep at the end of a day.
+        :param tages_id: daily ID of the last simulated day (type: integer)
+        :param day_index: index of the last simulated day in the period of the run (type: integer)
+        :param combinations: (rp, c, idw) combinations (type: list of tuples)
+        :param state: soilwater content of every combination (type: array of shape (combinations, rows, cols))
+        :param aggregation: accumulators of the open aggregation windows (type: dict)
+        :param meta: further information of the run, e.g. its period (type: dict)
+        """
+        self.tages_id = int(tages_id)
+        self.day_index = int(day_index)
+        self.combinations = [tuple(float(value) for value in combination) for combination in combinations]
+        self.names = [combination_name(*combination) for combination in self.combinations]
+        self.state = np.asarray(state, dtype=np.float64)
+        self.aggregation = aggregation or {}
+        self.meta = meta or {}
+
+    def state_of(self, combination):
+        """
+        :param combination: (rp, c, idw) combination (type: tuple)
+        :return: soilwater content of the combination, None if the snapshot does not contain it (type: array)
+        """
+        name = combination_name(*combination)
+        if name not in self.names:
+            return None
+        return self.state[self.names.index(name)]
+
+    def initial_state(self, combinations, s_init):
+        """
+        Creates the initial soilwater content of a run from the snapshot (warm start).
+        :param combinations: (rp, c, idw) combinations of the run (type: list of tuples)
+        :param s_init: initial soilwater content of combinations not contained in the snapshot (type: array)
+        :return: soilwater content per combination and combinations taken from s_init (type: tuple of array and list)
+        """
+        states, missing = [], []
+        for combination in combinations:
+            state = self.state_of(combination)
+            if state is None:
+                missing.append(combination)
+                state = s_init
+            states.append(np.asarray(state, dtype=np.float64))
+        return np.stack(states), missing
+
+    def save(self, path):
+        """
+        Writes the snapshot. The file is replaced only when it is complete.
+        :param path: path of the .npz file (type: string)
+        """
+        shape = self.state.shape[1:]
+        flat = self.state.reshape(len(self.state), -1)
+        cells = np.flatnonzero(np.isfinite(flat).any(axis=0))
+        arrays = {"cells": cells, "s": flat[:, cells]}
+        aggregation_keys = []
+        for window, accumulators in self.aggregation.items():
+            for name, acc in accumulators.items():
+                for key, array in acc.items():
+                    arrays["agg{}".format(len(aggregation_keys))] = array
+                    aggregation_keys.append([window, name, key])
+        meta = {"tages_id": self.tages_id, "day_index": self.day_index, "combinations": self.combinations,
+                "shape": list(shape), "aggregation": aggregation_keys, "meta": self.meta}
+        arrays["meta"] = np.array(json.dumps(meta))
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a snapshot.
+        :param path: path of the .npz file (type: string)
+        :return: snapshot (type: Snapshot)
+        """
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            shape = tuple(meta["shape"])
+            n = len(meta["combinations"])
+            state = np.full((n, int(np.prod(shape))), np.nan)
+            state[:, data["cells"]] = data["s"]
+            aggregation = {}
+            for k, (window, name, key) in enumerate(meta["aggregation"]):
+                aggregation.setdefault(window, {}).setdefault(name, {})[key] = data["agg{}".format(k)]
+        return cls(meta["tages_id"], meta["day_index"], meta["combinations"], state.reshape((n,) + shape),
+                   aggregation, meta["meta"])
+
+
+def snapshot_path(directory, tages_id):
+    """
+    :param directory: directory of the snapshots of a run (type: string)
+    :param tages_id: daily ID of the snapshot (type: integer)
+    :return: path of the snapshot file (type: string)
+    """
+    return os.path.join(directory, "S_{}.npz".format(int(tages_id)))
+
+
+def latest_snapshot(directory, combinations=None, start=None, end=None):
+    """
+    Searches for the latest snapshot of a run.
+    :param directory: directory of the snapshots (type: string)
+    :param combinations: combinations the snapshot has to contain in the same order (type: list of tuples)
+    :param start: first daily ID of the run (type: integer)
+    :param end: last daily ID of the run (type: integer)
+    :return: latest matching snapshot or None (type: Snapshot)
+    """
+    if not os.path.isdir(directory):
+        return None
+    names = None if combinations is None else [combination_name(*combination) for combination in combinations]
+    days = sorted((int(name[2:-4]) for name in os.listdir(directory)
+                   if name.startswith("S_") and name.endswith(".npz") and name[2:-4].isdigit()), reverse=True)
+    for tages_id in days:
+        if (start is not None and tages_id < int(start)) or (end is not None and tages_id > int(end)):
+            continue
+        snapshot = Snapshot.load(snapshot_path(directory, tages_id))
+        if names is None or snapshot.names == names:
+            return snapshot
+    return None
+
+
+def save_checkpoint(directory, sweep, tages_id, day_index, aggregator=None, meta=None):
+    """
+    Writes a snapshot of a sweep.
+    :param directory: directory of the snapshots of a run (type: string)
+    :param sweep: parameter sweep (type: ParameterSweep)
+    :param tages_id: daily ID of the last simulated day (type: integer)
+    :param day_index: index of the last simulated day in the period of the run (type: integer)
+    :param aggregator: aggregation of the run (type: Aggregator)
+    :param meta: further information of the run (type: dict)
+    :return: path of the snapshot (type: string)
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, tages_id)
+    Snapshot(tages_id, day_index, sweep.combinations, sweep.state(),
+             None if aggregator is None else aggregator.state(), meta).save(path)
+    return path
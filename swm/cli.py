@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Command line of the model engine, e.g. for batch jobs on compute nodes without ArcGIS:
+
+    python -m swm template lauf.json
+    python -m swm run lauf.json --set c_max=300 --set workers=4
+    python -m swm invalidate lauf.json --c 300
+
+The configuration file is a JSON object with the settings of swm.engine.DEFAULTS, relative paths are taken relative to
+the file. Values given with --set are read as JSON and fall back to text, e.g. --set name=Lauf_2 or --set
+save_rasters='["S"]'. invalidate removes entries of the result store of a configuration (or of a store directory).
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from .engine import DEFAULTS, ModelRun, RunConfig, open_source
+from .results import ResultStore
+
+
+def parse_setting(text):
+    """
+    :param text: setting as key=value (type: string)
+    :return: key and value (type: tuple)
+    """
+    key, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError("Einstellung {} ist nicht in der Form name=wert.".format(text))
+    try:
+        return key.strip(), json.loads(value)
+    except ValueError:
+        return key.strip(), value
+
+
+def main(argv=None):
+    """
+    :param argv: command line arguments, sys.argv if None (type: list)
+    :return: exit code (type: integer)
+    """
+    parser = argparse.ArgumentParser(prog="python -m swm", description="Bodenwasser-Modell (SWM) ohne ArcGIS.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Modelllauf nach einer Konfigurationsdatei")
+    run.add_argument("config", help="JSON-Datei mit den Einstellungen des Laufs")
+    run.add_argument("--set", dest="settings", action="append", type=parse_setting, default=[],
+                     metavar="NAME=WERT", help="Einstellung der Datei ersetzen (mehrfach moeglich)")
+    template = commands.add_parser("template", help="Konfigurationsdatei mit allen Einstellungen anlegen")
+    template.add_argument("config", help="Pfad der neuen JSON-Datei")
+    invalidate = commands.add_parser("invalidate", help="Eintraege des Ergebnisspeichers entfernen (ohne Angaben alle)")
+    invalidate.add_argument("store", help="Konfigurationsdatei (Speicher im Ordner 'folder') oder Speicherverzeichnis")
+    invalidate.add_argument("--rp", type=float, help="nur Eintraege mit diesem RP-Faktor")
+    invalidate.add_argument("--c", type=float, help="nur Eintraege mit diesem c-Parameter")
+    invalidate.add_argument("--idw", type=float, help="nur Eintraege mit diesem IDW-Exponenten")
+    invalidate.add_argument("--older-than", type=float, metavar="TAGE", help="nur Eintraege, die so lange nicht "
+                            "verwendet wurden")
+    args = parser.parse_args(argv)
+
+    if args.command == "template":
+        with open(args.config, "w", encoding="utf-8") as json_file:
+            json.dump(DEFAULTS, json_file, indent=2)
+        return 0
+    if args.command == "invalidate":
+        root = args.store
+        if os.path.isfile(root):
+            root = os.path.join(RunConfig.from_file(root).folder, "ResultStore")
+        if not os.path.isdir(root):
+            parser.error("Ergebnisspeicher {} nicht gefunden.".format(root))
+        store = ResultStore(root)
+        removed = store.invalidate(args.rp, args.c, args.idw, args.older_than)
+        print("{} Eintraege entfernt, {} verbleiben ({:.1f} MB).".format(len(removed), len(store.entries()),
+                                                                       store.size() / 1024 ** 2))
+        return 0
+    try:
+        config = RunConfig.from_file(args.config, **dict(args.settings))
+    except ValueError as error:
+        parser.error(str(error))
+    try:
+        q = ModelRun(config, open_source(config),
+                     warn=lambda message: print("Warnung: " + message, file=sys.stderr)).run()
+    except ValueError as error:
+        print("Fehler: {}".format(error), file=sys.stderr)
+        return 1
+    return 0 if q is not None else 1
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage of a basin: only the cells inside the basin mask are simulated.
+
+The cells are held as flat vectors with the land cells first and the water cells after them, so the land and water
+branches of the water balance run on their own cells without per-cell tests. Full grids are only rebuilt when a raster
+is actually saved.
+"""
+
+import numpy as np
+
+from .kernel import StaticGrids, land_step, runoff_to_q, water_step
+
+
+class CellIndex(object):
+    def __init__(self, grids, s_init=None):
+        """
+        Creates the flat index of the active cells of a basin. Land cells need valid static data (and a valid initial
+        soilwater content), water cells only need to be marked in the water mask.
+        :param grids: static raster data of the basin (type: StaticGrids)
+        :param s_init: initial soilwater content, one grid or one per combination (type: array)
+        """
+        self.shape = grids.shape
+        land = grids.land & np.isfinite(grids.fc) & np.isfinite(grids.wp) & np.isfinite(grids.l_m)
+        if s_init is not None:
+            land &= np.isfinite(s_init).reshape((-1,) + self.shape).all(axis=0)
+        self.land = np.flatnonzero(land)
+        self.water = np.flatnonzero(grids.water)
+        self.cells = np.concatenate([self.land, self.water])
+        self.n_land = len(self.land)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def compress(self, grid, cells=None):
+        """
+        Extracts the active cells of one or several grids.
+        :param grid: grid(s) with the raster axes last (type: array)
+        :param cells: flat indices to extract, all active cells if None (type: array)
+        :return: values with the cell axis last (type: array)
+        """
+        grid = np.asarray(grid)
+        flat = grid.reshape(grid.shape[:grid.ndim - len(self.shape)] + (-1,))
+        return flat[..., self.cells if cells is None else cells]
+
+    def expand(self, values, cells=None, fill=np.nan):
+        """
+        Rebuilds full grids from cell values.
+        :param values: values with the cell axis last (type: array)
+        :param cells: flat indices of the values, all active cells if None (type: array)
+        :param fill: value of the cells without values (type: float)
+        :return: grid(s) (type: array)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        grid = np.full(values.shape[:-1] + (int(np.prod(self.shape)),), fill)
+        grid[..., self.cells if cells is None else cells] = values
+        return grid.reshape(values.shape[:-1] + self.shape)
+
+
+class CompactSoilWaterModel(object):
+    def __init__(self, grids, rp_factor, c, s_init, cells=None):
+        """
+        Soilwater model of a basin on the active cells only, for one parameter combination or a stack of them.
+        :param grids: static raster data of the basin (type: StaticGrids)
+        :param rp_factor: RP factor(s) (type: float or array)
+        :param c: c parameter(s) (type: float or array)
+        :param s_init: initial soilwater content (type: array)
+        :param cells: index of the active cells, created from the grids if None (type: CellIndex)
+        """
+        self.grids = grids
+        self.s_init = np.asarray(s_init, dtype=np.float64)
+        self.cells = CellIndex(grids, self.s_init) if cells is None else cells
+        # Static data of the land cells as vectors, the parameter grids are calculated on them directly
+        land = self.cells.land
+        land_grids = StaticGrids(self.cells.compress(grids.fc, land), self.cells.compress(grids.wp, land),
+                                 self.cells.compress(grids.l_m, land), np.zeros(len(land)), None, grids.cellsize)
+        self.fc, self.wp = land_grids.fc, land_grids.wp
+        self.rp, self.rpwp_dif, self.lambda_param = land_grids.parameter_grids(rp_factor, c)
+        self.reset()
+
+    def reset(self):
+        """Sets the soilwater content back to the initial state."""
+        self.s = np.broadcast_to(self.cells.compress(self.s_init, self.cells.land), self.rp.shape).copy()
+
+    def step(self, p, pet):
+        """
+        Advances the model by one day.
+        :param p: precipitation of the active cells (type: array)
+        :param pet: potential evapotranspiration of the active cells (type: array)
+        :return: fluxes of the active cells keyed by raster name, the soilwater content of water cells is NaN
+                 (type: dict)
+        """
+        n_land = self.cells.n_land
+        p_land, p_water = p[..., :n_land], p[..., n_land:]
+        pet_land, pet_water = pet[..., :n_land], pet[..., n_land:]
+        aet_land, runoff_land, rsoil, roverflow, self.s = land_step(self.s, p_land, pet_land, self.fc, self.wp, self.rp,
+                                                                    self.rpwp_dif, self.lambda_param)
+        aet_water, runoff_water = water_step(p_water, pet_water)
+
+        shape = self.s.shape[:-1] + (len(self.cells),)
+        fluxes = {"PET": pet, "AET": np.empty(shape), "IDW": p, "R": np.empty(shape), "S": np.full(shape, np.nan),
+                  "Rsoil": np.zeros(shape), "Roverflow": np.zeros(shape)}
+        fluxes["AET"][..., :n_land], fluxes["AET"][..., n_land:] = aet_land, aet_water
+        fluxes["R"][..., :n_land], fluxes["R"][..., n_land:] = runoff_land, runoff_water
+        fluxes["S"][..., :n_land] = self.s
+        fluxes["Rsoil"][..., :n_land] = rsoil
+        fluxes["Roverflow"][..., :n_land] = roverflow
+        return fluxes
+
+    def q(self, runoff):
+        """
+        Calculates the streamflow of the basin in m^3 s^{-1}.
+        :param runoff: total runoff of the active cells (type: array)
+        :return: streamflow (type: float or array)
+        """
+        return runoff_to_q(runoff, self.grids.cellsize, axis=-1)
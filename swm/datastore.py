@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+File based stand-in for the geodatabase of the toolbox, which allows to run the model without arcpy.
+
+A directory holds the rasters as ESRI ASCII grids or GeoTIFFs (FK, WP, L_in_metern, Gewaessermaske, Haude_Jan ...
+Haude_Dez and optionally basin masks) and the tables as semicolon separated CSV files with the field names of the
+geodatabase (N_Messstationen.csv with Stationsnummer, X, Y; N_Zeitreihen.csv with Stationsnummer, TagesID,
+Tagessumme_mm; TempFeuchte.csv with TagesID, Jahr, Monat, Tag, RelFeu, Temp_). GeoTIFFs need rasterio, which is only
+imported when such a file is read or written.
+"""
+
+import csv
+import importlib.util
+import os
+
+import numpy as np
+
+from .forcing import ClimateSeries, Forcing, PrecipitationSeries
+from .grid import Grid
+from .kernel import MONTHS, StaticGrids
+from .tiles import tile_windows
+
+
+ASCII_HEADER = ["ncols", "nrows", "xllcorner", "yllcorner", "cellsize", "NODATA_value"]
+STATIC_RASTERS = {"fc": "FK", "wp": "WP", "l_m": "L_in_metern", "water": "Gewaessermaske"}
+CLIMATE_FIELDS = ["TagesID", "Jahr", "Monat", "Tag", "RelFeu", "Temp_"]
+STATION_FIELDS = ["Stationsnummer", "X", "Y"]
+PRECIPITATION_FIELDS = ["Stationsnummer", "TagesID", "Tagessumme_mm"]
+RASTER_SUFFIXES = {"asc": ".asc", "tif": ".tif"}
+
+
+def default_raster_format():
+    """
+    :return: "tif" for LZW compressed GeoTIFFs if rasterio is installed, otherwise "asc" for uncompressed ESRI ASCII
+             rasters (type: string)
+    """
+    return "tif" if importlib.util.find_spec("rasterio") is not None else "asc"
+
+
+def write_ascii_grid(path, array, grid, nodata=-9999.0):
+    """
+    Writes a grid as ESRI ASCII raster. NaN becomes NoData.
+    :param path: path of the .asc file (type: string)
+    :param array: raster values (type: array of shape (rows, cols))
+    :param grid: grid of the raster (type: Grid)
+    :param nodata: NoData value of the file (type: float)
+    """
+    array = np.asarray(array, dtype=np.float64)
+    with open(path, "w", encoding="ascii") as asc_file:
+        for key, value in zip(ASCII_HEADER, [grid.ncols, grid.nrows, repr(grid.x_min), repr(grid.y_min),
+                                             repr(grid.cellsize), repr(float(nodata))]):
+            asc_file.write("{} {}\n".format(key, value))
+        np.savetxt(asc_file, np.where(np.isnan(array), nodata, array), fmt="%.10g")
+
+
+def read_ascii_grid(path):
+    """
+    Reads an ESRI ASCII raster. NoData becomes NaN.
+    :param path: path of the .asc file (type: string)
+    :return: raster values and grid (type: tuple of array and Grid)
+    """
+    header = {}
+    with open(path, encoding="ascii") as asc_file:
+        for _ in range(len(ASCII_HEADER)):
+            key, value = asc_file.readline().split()
+            header[key.lower()] = float(value)
+        array = np.loadtxt(asc_file, dtype=np.float64, ndmin=2)
+    nrows, ncols, cellsize = int(header["nrows"]), int(header["ncols"]), header["cellsize"]
+    if array.shape != (nrows, ncols):
+        raise ValueError("Raster {} hat {} Werte statt {} x {}.".format(path, array.size, nrows, ncols))
+    array[array == header.get("nodata_value", np.nan)] = np.nan
+    grid = Grid(header["xllcorner"], header["yllcorner"] + nrows * cellsize, cellsize, nrows, ncols)
+    return array, grid
+
+
+def _rasterio():
+    """
+    :return: the rasterio module, which is only needed for GeoTIFFs (type: module)
+    """
+    try:
+        import rasterio
+    except ImportError:
+        raise ImportError("Fuer GeoTIFF-Raster wird das Paket rasterio benoetigt, alternativ ESRI-ASCII-Raster verwenden.")
+    return rasterio
+
+
+def read_geotiff(path, out=None):
+    """
+    Reads the first band of a GeoTIFF. NoData becomes NaN.
+    :param path: path of the .tif file (type: string)
+    :param out: array to fill block by block, e.g. a memory-mapped grid (type: array)
+    :return: raster values and grid (type: tuple of array and Grid)
+    """
+    rasterio = _rasterio()
+    with rasterio.open(path) as dataset:
+        transform = dataset.transform
+        grid = Grid(transform.c, transform.f, transform.a, dataset.height, dataset.width)
+        if out is None:
+            out = np.empty(grid.shape, dtype=np.float64)
+        for rows, cols in tile_windows(grid.shape, 1024):
+            block = dataset.read(1, window=((rows.start, rows.stop), (cols.start, cols.stop))).astype(np.float64)
+            if dataset.nodata is not None:
+                block[block == dataset.nodata] = np.nan
+            out[rows, cols] = block
+    return out, grid
+
+
+def write_geotiff(path, array, grid, nodata=-9999.0):
+    """
+    Writes a grid as LZW compressed GeoTIFF. NaN becomes NoData.
+    :param path: path of the .tif file (type: string)
+    :param array: raster values (type: array of shape (rows, cols))
+    :param grid: grid of the raster (type: Grid)
+    :param nodata: NoData value of the file (type: float)
+    """
+    rasterio = _rasterio()
+    array = np.asarray(array)
+    transform = rasterio.transform.from_origin(grid.x_min, grid.y_max, grid.cellsize, grid.cellsize)
+    with rasterio.open(path, "w", driver="GTiff", height=grid.nrows, width=grid.ncols, count=1, dtype=array.dtype,
+                       nodata=nodata, transform=transform, compress="lzw") as dataset:
+        dataset.write(np.where(np.isnan(array), nodata, array).astype(array.dtype), 1)
+
+
+def read_raster(path, out=None):
+    """
+    Reads an ESRI ASCII raster or a GeoTIFF, depending on the suffix of the path.
+    :param path: path of the raster (type: string)
+    :param out: array to fill, e.g. a memory-mapped grid (type: array)
+    :return: raster values and grid (type: tuple of array and Grid)
+    """
+    if os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        return read_geotiff(path, out)
+    array, grid = read_ascii_grid(path)
+    if out is None:
+        return array, grid
+    out[...] = array
+    return out, grid
+
+
+def write_raster(path, array, grid):
+    """
+    Writes an ESRI ASCII raster or a GeoTIFF, depending on the suffix of the path.
+    :param path: path of the raster (type: string)
+    :param array: raster values (type: array)
+    :param grid: grid of the raster (type: Grid)
+    """
+    if os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        write_geotiff(path, array, grid)
+    else:
+        write_ascii_grid(path, array, grid)
+
+
+class FileDataStore(object):
+    def __init__(self, directory, basin=None, s_init="FK", basins=None, raster_format="asc"):
+        """
+        Base data of a basin in a directory of ASCII rasters or GeoTIFFs and CSV tables.
+        :param directory: directory of the base data (type: string)
+        :param basin: raster whose NoData cells lie outside the basin, no clipping if None (type: string)
+        :param s_init: raster of the initial soilwater content (type: string)
+        :param basins: rasters of several basins, the rasters are clipped to their union with basin (type: list)
+        :param raster_format: format of written rasters, "asc", "tif" or "auto" for GeoTIFFs if rasterio is installed
+                              (type: string)
+        """
+        if raster_format == "auto":
+            raster_format = default_raster_format()
+        if raster_format not in RASTER_SUFFIXES:
+            raise ValueError("Unbekanntes Rasterformat: {}".format(raster_format))
+        self.directory = directory
+        self.basin = basin
+        self.s_init = s_init
+        self.basins = list(basins or [])
+        self.raster_suffix = RASTER_SUFFIXES[raster_format]
+        self._grid = None
+        self._outside = None
+
+    def path(self, name, suffix):
+        """
+        :return: path of a raster (suffix .asc or .tif) or table (suffix .csv) (type: string)
+        """
+        return os.path.join(self.directory, name + suffix)
+
+    def raster_path(self, name):
+        """
+        :param name: raster name, e.g. FK, or path of a raster file (type: string)
+        :return: path of the raster, a GeoTIFF is preferred to an ASCII raster of the same name (type: string)
+        """
+        if os.path.isfile(name):
+            return name
+        for suffix in [".tif", ".asc"]:
+            if os.path.isfile(self.path(name, suffix)):
+                return self.path(name, suffix)
+        raise FileNotFoundError("Raster {} nicht gefunden in {}.".format(name, self.directory))
+
+    def raster(self, name, out=None):
+        """
+        :param name: raster name, e.g. FK (type: string)
+        :param out: array to fill, e.g. a memory-mapped grid (type: array)
+        :return: raster values and grid (type: tuple of array and Grid)
+        """
+        return read_raster(self.raster_path(name), out)
+
+    def write_raster(self, name, array, grid):
+        """
+        :param name: raster name (type: string)
+        :param array: raster values (type: array)
+        :param grid: grid of the raster (type: Grid)
+        """
+        write_raster(self.path(name, self.raster_suffix), array, grid)
+
+    @property
+    def grid(self):
+        """The grid of the initial soilwater content, which is the grid of the model."""
+        if self._grid is None:
+            self._grid = self.raster(self.s_init)[1]
+        return self._grid
+
+    def use_scratch(self, path):
+        """
+        Sets the scratch directory, the files are read directly and need none.
+        :param path: scratch directory (type: string)
+        """
+        self.scratch = path
+
+    def outside(self):
+        """
+        :return: cells outside the union of basin and basins, None if not clipped (type: array of booleans)
+        """
+        if self._outside is None and (self.basin or self.basins):
+            masks = [self.raster(name)[0] for name in ([self.basin] if self.basin else []) + self.basins]
+            self._outside = np.all([np.isnan(mask) for mask in masks], axis=0)
+        return self._outside
+
+    def _clipped(self, name, out=None):
+        """
+        Reads a raster clipped to the basin as ExtractByMask does.
+        :return: raster values (type: array)
+        """
+        array, grid = self.raster(name, out)
+        if grid.shape != self.grid.shape:
+            raise ValueError("Raster {} hat {} x {} Zellen statt {} x {}.".format(name, *grid.shape, *self.grid.shape))
+        outside = self.outside()
+        if outside is not None:
+            array[outside] = np.nan
+        return array
+
+    def rows(self, name, fields, start=None, end=None):
+        """
+        Reads the rows of a table, like a SearchCursor with a TagesID period as where clause.
+        :param name: table name (type: string)
+        :param fields: field names (type: list)
+        :param start: first daily ID (type: integer)
+        :param end: last daily ID (type: integer)
+        :return: rows as tuples of numbers (type: list)
+        """
+        rows = []
+        with open(self.path(name, ".csv"), newline="", encoding="utf-8") as csv_file:
+            for row in csv.DictReader(csv_file, delimiter=";"):
+                if start is not None and int(row["TagesID"]) < int(start):
+                    continue
+                if end is not None and int(row["TagesID"]) > int(end):
+                    continue
+                rows.append(tuple(_number(row[field]) for field in fields))
+        return rows
+
+    def write_table(self, name, fields, rows):
+        """
+        :param name: table name (type: string)
+        :param fields: field names (type: list)
+        :param rows: rows in the order of the fields (type: iterable)
+        """
+        with open(self.path(name, ".csv"), "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file, delimiter=";")
+            writer.writerow(fields)
+            writer.writerows(rows)
+
+    def station_coordinates(self):
+        """
+        :return: station numbers (type: list) and coordinates (type: array of shape (stations, 2))
+        """
+        rows = self.rows("N_Messstationen", STATION_FIELDS)
+        return [int(row[0]) for row in rows], np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 2)
+
+    def load_forcing(self, start, end):
+        """
+        Reads the climate data and the precipitation timeseries of a period and checks them for gaps.
+        :param start: first daily ID (type: integer)
+        :param end: last daily ID (type: integer)
+        :return: forcing and the warnings of the check (type: tuple of Forcing and list)
+        """
+        climate = ClimateSeries.from_records(self.rows("TempFeuchte", CLIMATE_FIELDS, start, end))
+        stations, station_xy = self.station_coordinates()
+        precipitation = PrecipitationSeries.from_records(stations, station_xy, climate.tages_id,
+                                                         self.rows("N_Zeitreihen", PRECIPITATION_FIELDS, start, end))
+        forcing = Forcing(climate, precipitation)
+        return forcing, forcing.check(int(start), int(end))
+
+    def static_grids(self, memmap=None):
+        """
+        Reads the static rasters, clipped to the basin.
+        :param memmap: function creating memory-mapped grids by name and number of layers, e.g. for the tiled mode
+                       (type: callable)
+        :return: static raster data (type: StaticGrids)
+        """
+        arrays = {name: self._clipped(raster_name, None if memmap is None else memmap(name))
+                  for name, raster_name in STATIC_RASTERS.items()}
+        haude = np.empty((len(MONTHS),) + self.grid.shape) if memmap is None else memmap("haude", len(MONTHS))
+        for m, month in enumerate(MONTHS):
+            haude[m] = self._clipped("Haude_" + month)
+        return StaticGrids(haude=haude, cellsize=self.grid.cellsize, **arrays)
+
+    def initial_state(self, memmap=None):
+        """
+        :param memmap: function creating memory-mapped grids by name (type: callable)
+        :return: initial soilwater content clipped to the basin (type: array)
+        """
+        return self._clipped(self.s_init, None if memmap is None else memmap("s_init"))
+
+    def basin_masks(self, name_field=None):
+        """
+        Cells of the basin rasters, the names of the rasters are the names of the basins.
+        :param name_field: not used, the basins of the files are named by their rasters (type: string)
+        :return: names of the basins (type: list) and their cells (type: array of shape (basins, rows, cols))
+        """
+        cells = np.isfinite(self._clipped(STATIC_RASTERS["water"]))  # Covers land and water cells
+        names = [os.path.splitext(os.path.basename(name))[0] for name in self.basins]
+        return names, np.array([cells & np.isfinite(self.raster(name)[0]) for name in self.basins])
+
+    def save_raster(self, array, path):
+        """
+        Saves a model raster on the grid of the model. NaN becomes NoData.
+        :param array: raster values (type: array)
+        :param path: path of the raster, the suffix sets the format (type: string)
+        """
+        write_raster(path, array, self.grid)
+
+
+def _number(text):
+    """
+    :return: value of a table field as integer or float, None if empty (type: number)
+    """
+    text = text.strip().replace(",", ".")
+    if not text or text.upper() == "NA":
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
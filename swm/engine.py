@@ -0,0 +1,728 @@
+# -*- coding: utf-8 -*-
+"""
+Headless model run: the whole workflow of the toolbox (static data, forcing, parameter sweep, the run modes and all
+outputs) on a data source, without arcpy unless the geodatabase is used.
+
+A run is described by a RunConfig, which can be read from a JSON file (see the command line in swm.cli). The input is
+read from a data source: FileDataStore for exported rasters (ASCII grid, GeoTIFF) and CSV tables, or ArcpyDataStore
+for the geodatabase, which is the only part importing arcpy. The toolbox translates its parameters into a RunConfig.
+
+A data source provides the model grid (grid), the static grids and the initial soilwater content clipped to the basin
+(static_grids, initial_state), the forcing of a period (load_forcing), the cells of several basins (basin_masks), the
+raster output (save_raster, raster_suffix) and the scratch directory setting (use_scratch).
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .aggregate import Aggregator, hydrological_year_windows, monthly_windows, period_window
+from .basins import BasinSet, run_basins
+from .cache import ForcingCache
+from .checkpoint import Snapshot, latest_snapshot, save_checkpoint
+from .compact import CellIndex
+from .datastore import FileDataStore
+from .ensemble import EnsembleForcing, Perturbation, run_ensemble
+from .evaluate import RANKING, ObservedSeries, evaluate, observed_on, write_skill_table
+from .forcing import daily_ids
+from .idw import interpolate_precipitation
+from .kernel import RASTER_NAMES
+from .optimize import GridRefinement
+from .output import QResultWriter, read_q_csv, write_q_csv, write_q_long_csv, write_q_quantile_csv
+from .parallel import run_parallel
+from .profiling import Profiler
+from .results import ResultStore, forcing_mode, input_key
+from .sweep import ParameterSweep, parameter_range
+from .tiles import run_tiled, tile_windows
+from .writer import AsyncRasterWriter
+
+
+# Settings of a run and their defaults, which are the defaults of the toolbox
+DEFAULTS = {
+    "source": "auto", "data": None, "basin": None, "s_init": "FK", "raster_format": "auto",
+    "start": None, "end": None, "folder": None, "name": None,
+    "rp_factor_min": 0.85, "rp_factor_max": 0.85, "rp_factor_step": 0.05,
+    "c_min": 150, "c_max": 150, "c_step": 50,
+    "idw_exponent_min": 1.0, "idw_exponent_max": 1.0, "idw_exponent_step": 0.5,
+    "save_rasters": [], "sum_start": None, "sum_end": None, "sum_monthly": False, "sum_hydrological": False,
+    "statistics": None,
+    "forcing_cache": False, "cache_size": 2048, "workers": 1, "compact": True, "buffer_days": 0, "long_table": False,
+    "raster_writers": 2, "result_store": False, "store_size": 2048,
+    "checkpoint_days": [], "checkpoint_interval": 0, "resume": False, "warm_start": None,
+    "observed": None, "evaluation_start": None, "evaluation_end": None, "ranking": "KGE",
+    "optimize": False, "objective": "NSE", "iterations": 4, "points": 5,
+    "tile_size": 0,
+    "members": 0, "precipitation_noise": 0.2, "temperature_offset": 0.5, "humidity_offset": 5.0, "dropout": 0.1,
+    "seed": 1, "quantiles": [5, 50, 95],
+    "basins": [], "basin_name_field": "Name",
+    "progress_days": 30, "day_messages": False, "trace": None,
+}
+REQUIRED = ["data", "start", "end", "folder", "name"]
+# Settings holding paths, which are relative to the directory of a configuration file
+PATH_SETTINGS = ["data", "folder", "warm_start", "observed", "trace"]
+
+
+class RunConfig(object):
+    def __init__(self, **settings):
+        """
+        Settings of a model run, see DEFAULTS for the names. Settings that are not given keep their default.
+        :param settings: settings keyed by name (type: dict)
+        """
+        unknown = set(settings) - set(DEFAULTS)
+        if unknown:
+            raise ValueError("Unbekannte Einstellung: {}".format(", ".join(sorted(unknown))))
+        values = json.loads(json.dumps(DEFAULTS))  # Copies of the default lists
+        values.update(settings)
+        missing = [key for key in REQUIRED if values[key] in (None, "")]
+        if missing:
+            raise ValueError("Fehlende Einstellung: {}".format(", ".join(missing)))
+        unknown = set(values["save_rasters"]) - set(RASTER_NAMES)
+        if unknown:
+            raise ValueError("Unbekannter Rastername: {}".format(", ".join(sorted(unknown))))
+        for name in ["ranking", "objective"]:
+            if values[name] not in RANKING:
+                raise ValueError("Unbekanntes Guetemass: {}".format(values[name]))
+        if values["optimize"] and not values["observed"]:
+            raise ValueError("Fuer die Optimierung wird eine Datei mit gemessenem Abfluss benoetigt.")
+        if (values["evaluation_start"] and values["evaluation_end"] and
+                int(values["evaluation_start"]) > int(values["evaluation_end"])):
+            raise ValueError("Der Bewertungszeitraum endet vor seinem Beginn.")
+        self.__dict__.update(values)
+
+    @classmethod
+    def from_file(cls, path, **overrides):
+        """
+        Reads the settings from a JSON file. Relative paths of the file are taken relative to its directory.
+        :param path: path of the JSON file (type: string)
+        :param overrides: settings replacing those of the file (type: dict)
+        :return: settings (type: RunConfig)
+        """
+        with open(path, encoding="utf-8") as json_file:
+            settings = json.load(json_file)
+        directory = os.path.dirname(os.path.abspath(path))
+        for key in PATH_SETTINGS:
+            if settings.get(key):
+                settings[key] = os.path.join(directory, settings[key])
+        settings.update(overrides)
+        return cls(**settings)
+
+    def to_dict(self):
+        """
+        :return: all settings (type: dict)
+        """
+        return {key: getattr(self, key) for key in DEFAULTS}
+
+    def save(self, path):
+        """
+        Writes the settings as JSON file, e.g. to document a run next to its results.
+        :param path: path of the JSON file (type: string)
+        """
+        with open(path, "w", encoding="utf-8") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+
+def open_source(config):
+    """
+    Opens the data source of a run. The geodatabase (a .gdb directory or source "arcpy") needs arcpy, which is only
+    imported here.
+    :param config: settings of the run (type: RunConfig)
+    :return: data source (type: FileDataStore or ArcpyDataStore)
+    """
+    kind = config.source
+    if kind == "auto":
+        kind = "arcpy" if config.data.rstrip("\\/").lower().endswith(".gdb") else "files"
+    if kind == "arcpy":
+        from .arcgis import ArcpyDataStore
+        return ArcpyDataStore(config.data, config.basin, config.s_init, config.basins)
+    if kind == "files":
+        return FileDataStore(config.data, config.basin, config.s_init, config.basins, config.raster_format)
+    raise ValueError("Unbekannte Datenquelle: {}".format(kind))
+
+
+class ModelRun(object):
+    def __init__(self, config, source, log=None, warn=None):
+        """
+        Model run of a parameter sweep with all run modes of the toolbox.
+        :param config: settings of the run (type: RunConfig)
+        :param source: data source (type: FileDataStore or ArcpyDataStore)
+        :param log: function for messages, print if None (type: callable)
+        :param warn: function for warnings, log if None (type: callable)
+        """
+        self.config = config
+        self.source = source
+        self.log = print if log is None else log
+        self.warn = warn or (lambda message: self.log("Warnung: " + message))
+        # Time and calls per stage, progress is reported every progress_days days instead of per day
+        self.profiler = Profiler(log=self.message, interval=config.progress_days)
+
+    def message(self, text):
+        """Emits a message with the time of day."""
+        self.log(time.strftime("%H:%M:%S: ") + text)
+
+    def run(self):
+        """
+        Runs the model.
+        :return: streamflow of the run mode, None if there is no valid combination (type: array)
+        """
+        config = self.config
+        self.save_flags = [name in config.save_rasters for name in RASTER_NAMES]
+        self.checkpointing = bool(config.checkpoint_days or config.checkpoint_interval)
+        # The long table and the skill scores cover all combinations, also those taken from the result store
+        self.tables = True
+        self.aggregated = None
+        # Time windows of the aggregated rasters, all windows are accumulated in the same run
+        self.windows = []
+        if config.sum_start and config.sum_end:
+            self.windows.append(period_window(config.sum_start, config.sum_end))
+        if config.sum_monthly:
+            self.windows += monthly_windows(config.start, config.end)
+        if config.sum_hydrological:
+            self.windows += hydrological_year_windows(config.start, config.end)
+
+        self._read_observed()
+        self._prepare_folders()
+        self._read_data()
+        if not self._create_sweep():
+            return None
+
+        outnames = ["Q_rp{}_c{}_idw{}".format(*parameter_day) for parameter_day in self.sweep.names]
+        self.outname2 = "_s{}_e{}".format(int(config.start), int(config.end))
+        self.outnames = outnames
+        self.csv_paths = [os.path.join(self.workpath, outname1 + self.outname2 + ".csv") for outname1 in outnames]
+        self.long_path = os.path.join(self.workpath, "Q_alle" + self.outname2 + ".csv") if config.long_table else None
+        self.evaluation_path = os.path.join(self.workpath, "Guetemasse" + self.outname2 + ".csv")
+        # Outside the output folder, which is set up anew
+        self.checkpoint_path = os.path.join(config.folder, "Snapshots", config.name)
+
+        # Reuse PET and precipitation of earlier runs from the forcing cache next to the output folder
+        self.cube = None
+        if config.forcing_cache:
+            cache = ForcingCache(os.path.join(config.folder, "ForcingCache"), max_bytes=config.cache_size * 1024 ** 2,
+                                 tile_size=config.tile_size or None)
+            self.cube = cache.open(self.grids, self.grid, self.forcing, self.idw_exponent, log=self.log)
+
+        raster_output = any(self.save_flags) or self.windows or self.checkpointing or config.resume
+        if config.basins:
+            if (config.optimize or config.members or config.tile_size or config.workers > 1 or config.observed or
+                    raster_output):
+                self.warn("Mit mehreren Einzugsgebieten werden nur die Abflusstabellen je Einzugsgebiet geschrieben. "
+                          "Optimierung, Ensemble, Kacheln, parallele Berechnung, Guetemasse, Rasterdateien und "
+                          "Snapshots werden nicht verwendet.")
+            self._store_unused()
+            q = self._run_basins()
+        elif config.optimize:
+            self._store_unused()
+            q = self._run_optimisation()
+        elif config.members and raster_output or config.members and config.tile_size:
+            self.warn("Das Speichern oder Aufsummieren von Rasterdateien, Snapshots und Kacheln sind nur ohne Ensemble "
+                      "moeglich. Die Berechnung erfolgt ohne Ensemble.")
+            q = self._run_mode_without_ensemble(raster_output)
+        elif config.members:
+            self._store_unused()
+            q = self._run_ensemble()
+        else:
+            q = self._run_mode_without_ensemble(raster_output)
+        self._finish()
+        return q
+
+    def _run_mode_without_ensemble(self, raster_output):
+        """
+        Runs the tiled, parallel or serial mode, with the result store only for the combinations not yet stored.
+        :return: streamflow per day and combination (type: array)
+        """
+        config = self.config
+        if config.result_store and (any(self.save_flags) or self.checkpointing or config.resume or config.warm_start):
+            self.warn("Der Ergebnisspeicher wird nur ohne taegliche Rasterdateien, Snapshots und Warmstart verwendet.")
+        elif config.result_store:
+            return self._run_with_store(raster_output)
+        return self._run_mode(raster_output)
+
+    def _store_unused(self):
+        """Warns that the chosen mode does not use the result store."""
+        if self.config.result_store:
+            self.warn("Der Ergebnisspeicher wird mit mehreren Einzugsgebieten, Optimierung und Ensemble nicht "
+                      "verwendet.")
+
+    def _run_mode(self, raster_output):
+        """
+        Runs the tiled, parallel or serial mode, the first two only without raster output and snapshots.
+        :return: streamflow per day and combination (type: array)
+        """
+        config = self.config
+        if config.tile_size and raster_output:
+            self.warn("Das Speichern oder Aufsummieren von Rasterdateien sowie Snapshots sind nur ohne Kacheln "
+                      "moeglich. Die Berechnung erfolgt ohne Kacheln.")
+        elif config.tile_size:
+            return self._run_tiled()
+        if config.workers > 1 and raster_output:
+            self.warn("Das Speichern oder Aufsummieren von Rasterdateien sowie Snapshots sind nur ohne parallele "
+                      "Berechnung moeglich. Die Berechnung erfolgt seriell.")
+        elif config.workers > 1:
+            return self._run_parallel()
+        return self._run_serial()
+
+    def _read_observed(self):
+        """
+        Reads the observed streamflow before the simulation and checks that the evaluation window of the period holds
+        at least two days with observation, which the skill scores need.
+        """
+        config = self.config
+        self.observed = None
+        if not config.observed or config.basins:
+            return
+        self.observed = ObservedSeries.from_csv(config.observed)
+        observed = observed_on(daily_ids(config.start, config.end), self.observed, config.evaluation_start,
+                               config.evaluation_end)
+        if np.count_nonzero(np.isfinite(observed)) < 2:
+            raise ValueError("Weniger als zwei Tage mit Beobachtung im Bewertungszeitraum.")
+
+    def _prepare_folders(self):
+        """Creates the output folder (kept when a run is resumed) and the scratch folder."""
+        config = self.config
+        self.workpath = os.path.join(config.folder, config.name)
+        self.scratchpath = os.path.join(config.folder, "Scratch")
+
+        # Check if the working directory exists; if not, create it
+        if not os.path.exists(self.workpath):
+            os.makedirs(self.workpath)  # Create the main working directory
+            self.log("Ausgabeordner erstellt: {}".format(self.workpath))
+        elif config.resume:
+            self.log("Ausgabeordner existiert bereits und wird fuer die Fortsetzung beibehalten.")
+        else:
+            # If the directory exists, delete it and create a new one
+            shutil.rmtree(self.workpath)
+            os.makedirs(self.workpath)
+            self.log("Ausgabeordner existiert bereits und wird neu aufgesetzt.")
+
+        # Check if the scratch directory exists; if not, create it
+        if not os.path.exists(self.scratchpath):
+            os.makedirs(self.scratchpath)  # Create the scratch directory
+            self.log("Scratchordner erstellt: {}".format(self.scratchpath))
+        else:
+            # If the directory exists, delete it and create a new one
+            shutil.rmtree(self.scratchpath)
+            os.makedirs(self.scratchpath)
+            self.log("Scratchordner existiert bereits und wird neu aufgesetzt.")
+        self.source.use_scratch(self.scratchpath)
+        config.save(os.path.join(self.workpath, "Konfiguration.json"))  # Documents the settings of the run
+        self.message("Die Ergebnisdatenbank wurde im Verzeichnis {} erstellt.".format(self.workpath))
+
+    def _memmap(self, name, layers=None):
+        """
+        Creates a memory-mapped grid in the scratch directory for the tiled mode.
+        :param name: name of the grid (type: string)
+        :param layers: number of layers, a single grid if None (type: integer)
+        :return: memory-mapped array (type: array)
+        """
+        shape = self.grid.shape if layers is None else (layers,) + self.grid.shape
+        return np.lib.format.open_memmap(os.path.join(self.scratchpath, name + ".npy"), mode="w+", dtype=np.float64,
+                                         shape=shape)
+
+    def _read_data(self):
+        """Reads the static grids, the initial soilwater content and the forcing once."""
+        config = self.config
+        self.grid = self.source.grid  # The grid of the initial soil water storage raster
+        self.message("cellsize={}".format(self.grid.cellsize))
+        # Large domains: the rasters are read block by block into memory-mapped grids in the scratch directory
+        memmap = self._memmap if config.tile_size else None
+        with self.profiler.stage("static"):
+            self.grids = self.source.static_grids(memmap)
+            self.s_init = self.source.initial_state(memmap)
+        self.rp_control = self.grids.rp_control()  # Maximum value of the wp/fc quotient
+        with self.profiler.stage("forcing_load"):
+            self.forcing, warnings = self.source.load_forcing(config.start, config.end)
+        for warning in warnings:
+            self.warn(warning)
+        self.message("Klima- und Niederschlagsdaten geladen ({} Tage).".format(len(self.forcing)))
+
+    def _create_sweep(self):
+        """
+        Creates the parameter sweep, with the soil water states of a snapshot for a warm start.
+        :return: False if there is no valid combination (type: boolean)
+        """
+        config = self.config
+        # Create lists of RP and c parameters based on the provided range and step values
+        rp_factor = parameter_range(float(config.rp_factor_min), float(config.rp_factor_max),
+                                    float(config.rp_factor_step))
+        c = parameter_range(int(config.c_min), int(config.c_max), int(config.c_step))
+        self.idw_exponent = parameter_range(float(config.idw_exponent_min), float(config.idw_exponent_max),
+                                            float(config.idw_exponent_step))
+        self.message("Berechnung der Rasterdatensaetze war erfolgreich.")
+        self.message("Anzahl RP-Parameter={}".format(len(rp_factor)))
+        self.message("Anzahl c-Parameter={}".format(len(c)))
+        self.message("Anzahl IDW-Exponenten={}".format(len(self.idw_exponent)))
+        self.log("Maximalwert von WP/FK={}".format(self.rp_control))
+
+        # One soil water state per combination, RP factors smaller than the wp/fc quotient are skipped. In compact
+        # mode only the land and water cells of the basin are held, tiles hold their own index
+        compact = config.compact and not config.tile_size
+        cells = CellIndex(self.grids, self.s_init) if compact else None
+        sweep = ParameterSweep(self.grids, rp_factor, c, self.s_init, self.rp_control, self.idw_exponent, cells=cells,
+                               profiler=self.profiler)
+        for rp_skipped in sweep.skipped:
+            self.log("RP-Parameter ist kleiner als der Maximalwert von WP/FK. RP-Parameter = {} wird uebersprungen."
+                     .format(rp_skipped))
+        if not len(sweep):
+            self.warn("Keine gueltige Parameterkombination vorhanden.")
+            return False
+
+        # Start every combination from its soil water state in a stored snapshot instead of s_init
+        if config.warm_start:
+            snapshot = Snapshot.load(config.warm_start)
+            s_start, missing = snapshot.initial_state(sweep.combinations, self.s_init)
+            self.message("Warmstart mit dem Bodenwasserspeicher vom {}.".format(snapshot.tages_id))
+            for combination in missing:
+                self.warn("Kombination {} ist nicht im Snapshot enthalten und startet mit s_init.".format(combination))
+            cells = CellIndex(self.grids, s_start) if compact else None
+            sweep = ParameterSweep(self.grids, [], [], s_start, self.rp_control, self.idw_exponent, sweep.combinations,
+                                   cells, self.profiler)
+        self.message("Anzahl Parameterkombinationen={}".format(len(sweep)))
+        if cells is not None:
+            self.message("Berechnete Zellen={} von {} (Land={}, Gewaesser={})".format(
+                len(cells), self.grid.nrows * self.grid.ncols, cells.n_land, len(cells) - cells.n_land))
+        self.sweep = sweep
+        return True
+
+    def _scratch_cube(self, tile_size=None):
+        """
+        :return: the forcing cache of the run, a cache in the scratch directory if none is used (type: ForcingCube)
+        """
+        if self.cube is None:
+            self.cube = ForcingCache(os.path.join(self.scratchpath, "Forcing"), tile_size=tile_size).open(
+                self.grids, self.grid, self.forcing, self.idw_exponent)
+        return self.cube
+
+    def _write_tables(self, q):
+        """
+        Writes the long table and the skill scores of the streamflow of all combinations.
+        :param q: streamflow per day and combination (type: array)
+        """
+        if not self.tables:
+            return
+        if self.long_path:
+            write_q_long_csv(self.long_path, self.sweep.combinations, self.forcing.climate.tages_id, q)
+        if self.config.observed:
+            self._write_evaluation(q)
+
+    def _write_evaluation(self, q):
+        """
+        Evaluates the streamflow of all combinations against the observed streamflow and writes the ranked skill scores.
+        :param q: streamflow per day and combination (type: array)
+        """
+        config = self.config
+        combinations = self.sweep.combinations
+        scores, n_days = evaluate(self.forcing.climate.tages_id, q, self.observed, config.evaluation_start,
+                                  config.evaluation_end)
+        order = write_skill_table(self.evaluation_path, combinations, scores, n_days, config.ranking)
+        self.message("Guetemasse ueber {} Tage geschrieben: {}".format(n_days, self.evaluation_path))
+        for k in order[:5]:
+            self.log("rp={} c={} idw={}: NSE={:.3f} KGE={:.3f} PBIAS={:.1f} RMSE={:.4f}".format(
+                *combinations[k], scores["NSE"][k], scores["KGE"][k], scores["PBIAS"][k], scores["RMSE"][k]))
+
+    def _run_basins(self):
+        """
+        Simulates the union of several basins once and sums up the streamflow of every basin, nested basins share
+        their cells.
+        :return: streamflow per day, basin and combination (type: array)
+        """
+        config = self.config
+        basins = BasinSet(*self.source.basin_masks(config.basin_name_field))
+        for basin_name, count in zip(basins.names, basins.cell_counts()):
+            self.message("Einzugsgebiet {}: {} Zellen.".format(basin_name, count))
+        cube = self._scratch_cube()
+        q = run_basins(self.sweep, basins, cube.pet, cube.precipitation, len(self.forcing), log=self.message)
+        cube.close()
+        tages_id = self.forcing.climate.tages_id
+        for b, basin_name in enumerate(basins.names):
+            basin_path = os.path.join(self.workpath, basin_name)
+            os.makedirs(basin_path, exist_ok=True)
+            for k, outname1 in enumerate(self.outnames):
+                write_q_csv(os.path.join(basin_path, outname1 + self.outname2 + ".csv"), tages_id, q[:, b, k])
+            if config.long_table:
+                write_q_long_csv(os.path.join(basin_path, "Q_alle" + self.outname2 + ".csv"), self.sweep.combinations,
+                                 tages_id, q[:, b])
+        return q
+
+    def _run_optimisation(self):
+        """
+        Searches the parameters by successive grid refinement inside the ranges of rp, c and idw instead of running
+        all combinations.
+        :return: streamflow of the best combination, None if no combination could be scored (type: array)
+        """
+        config = self.config
+        cube = self._scratch_cube()
+        tages_id = self.forcing.climate.tages_id
+        observed = observed_on(tages_id, self.observed, config.evaluation_start, config.evaluation_end)
+        optimizer = GridRefinement(self.grids, self.s_init, observed, tages_id, cube.pet, cube.precipitation,
+                                   (float(config.rp_factor_min), float(config.rp_factor_max)),
+                                   (int(config.c_min), int(config.c_max)), self.idw_exponent, config.objective,
+                                   config.points, config.iterations, rp_control=self.rp_control, cells=self.sweep.cells,
+                                   log=self.message)
+        best = optimizer.run()
+        cube.close()
+        optimizer.write_table(os.path.join(self.workpath, "Optimierung" + self.outname2 + ".csv"))
+        if best is None:
+            self.warn("Die Optimierung hat keine bewertbare Kombination gefunden.")
+            return None
+        write_q_csv(os.path.join(self.workpath, "Q_rp{}_c{}_idw{}".format(*best.name) + self.outname2 + ".csv"),
+                    tages_id, best.q)
+        self.message("Beste Kombination rp={} c={} idw={}: NSE={:.3f} KGE={:.3f} PBIAS={:.1f} RMSE={:.4f}".format(
+            *best.combination, best.scores["NSE"], best.scores["KGE"], best.scores["PBIAS"], best.scores["RMSE"]))
+        self.message("{} Kandidaten mit {} simulierten Kandidatentagen ({} abgebrochen).".format(
+            len(optimizer.candidates), optimizer.simulated_days(),
+            sum(candidate.abandoned for candidate in optimizer.candidates.values())))
+        return best.q
+
+    def _run_ensemble(self):
+        """
+        Runs the combinations for an ensemble of perturbed forcings and writes the quantiles of the streamflow over
+        the members.
+        :return: streamflow quantiles per day, quantile and combination (type: array)
+        """
+        config = self.config
+        if self.cube is not None:
+            self.cube.close()  # The perturbed forcing is calculated per day
+        perturbation = Perturbation(float(config.precipitation_noise), float(config.temperature_offset),
+                                    float(config.humidity_offset), float(config.dropout))
+        quantiles = [float(value) / 100 for value in config.quantiles or [5, 50, 95]]
+        self.message("Ensemble mit {} Mitgliedern (Startwert {}).".format(config.members, config.seed))
+        ensemble = EnsembleForcing(self.forcing, self.grids, self.grid, self.idw_exponent, int(config.members),
+                                   perturbation, int(config.seed))
+        q = run_ensemble(self.sweep, ensemble, quantiles, log=self.message)
+        for k, outname1 in enumerate(self.outnames):
+            write_q_quantile_csv(os.path.join(self.workpath, outname1 + "_Ensemble" + self.outname2 + ".csv"),
+                                 self.forcing.climate.tages_id, quantiles, q[:, :, k])
+        return q
+
+    def _run_tiled(self):
+        """
+        Simulates large domains block by block, the streamflow of the blocks is summed up.
+        :return: streamflow per day and combination (type: array)
+        """
+        tile_size = int(self.config.tile_size)
+        cube = self._scratch_cube(tile_size)
+        self.message("Berechnung in {} Kacheln mit {} x {} Zellen.".format(
+            len(tile_windows(self.grid.shape, tile_size)), tile_size, tile_size))
+        q = run_tiled(self.sweep, cube, len(self.forcing), tile_size, self.config.compact, log=self.log)
+        cube.close()
+        for k, csv_path in enumerate(self.csv_paths):
+            write_q_csv(csv_path, self.forcing.climate.tages_id, q[:, k])
+        self._write_tables(q)
+        return q
+
+    def _run_parallel(self):
+        """
+        Distributes the parameter combinations over worker processes, each worker writes its own result tables.
+        :return: streamflow per day and combination (type: array)
+        """
+        workers = int(self.config.workers)
+        cube = self._scratch_cube()
+        self.message("Parallele Berechnung mit {} Prozessen.".format(workers))
+        q = run_parallel(self.sweep, cube, self.forcing.climate.tages_id, self.csv_paths,
+                         os.path.join(self.scratchpath, "Shared"), workers, log=self.log)
+        cube.close()
+        self._write_tables(q)
+        return q
+
+    def _save_rasters(self, writer, rasters, parameter_safe, date, save_flags):
+        """
+        Queues the rasters for writing if the corresponding flags are set to True, rasters without flag are not
+        written at all.
+        :param writer: background raster writer (type: AsyncRasterWriter)
+        :param rasters: dictionary of arrays to save (type: dict)
+        :param parameter_safe: values of the variable combination (type: tuple)
+        :param date: daily ID or name of an aggregation window (type: integer or string)
+        :param save_flags: list of booleans indicating which rasters to save (type: list)
+        """
+        for (name, raster), save_flag in zip(rasters.items(), save_flags):
+            if save_flag:
+                writer.submit(raster, os.path.join(self.workpath, "{}_rp{}_c{}_idw{}_{}{}".format(
+                    name, parameter_safe[0], parameter_safe[1], parameter_safe[2], date, self.source.raster_suffix)))
+
+    def _run_serial(self):
+        """
+        Simulates all combinations day by day with raster output, aggregation and snapshots.
+        :return: streamflow per day and combination (type: array)
+        """
+        config = self.config
+        sweep, forcing, profiler, cube = self.sweep, self.forcing, self.profiler, self.cube
+        save_flags = self.save_flags
+        checkpoint_days = set(int(value) for value in config.checkpoint_days or [])
+        # Collect the daily streamflow of all combinations and write the CSV result tables in bulk
+        results = QResultWriter(self.csv_paths, sweep.combinations, config.buffer_days, self.long_path)
+        aggregator = Aggregator(self.windows, config.statistics or None) if self.windows else None
+        # Rasters are written by background threads while the next day is calculated, the queue is limited to two days
+        raster_writer = None
+        if any(save_flags) or self.windows:
+            raster_writer = AsyncRasterWriter(profiler.timed("raster_io", self.source.save_raster),
+                                              config.raster_writers, max_pending=2 * len(RASTER_NAMES) * len(sweep))
+
+        # Continue an interrupted run from its latest snapshot, the result tables are cut back to the snapshot
+        first_day = 0
+        if config.resume:
+            snapshot = latest_snapshot(self.checkpoint_path, sweep.combinations, config.start, config.end)
+            if (snapshot is None or snapshot.meta.get("start") != int(config.start) or
+                    snapshot.meta.get("compact") != bool(config.compact)):
+                self.warn("Kein passender Snapshot in {} gefunden, die Berechnung beginnt am Startdatum.".format(
+                    self.checkpoint_path))
+            else:
+                sweep.set_state(snapshot.state)
+                if aggregator is not None:
+                    aggregator.set_state(snapshot.aggregation)
+                results.resume(snapshot.day_index + 1)
+                first_day = snapshot.day_index + 1
+                self.message("Fortsetzung nach dem Snapshot vom {}.".format(snapshot.tages_id))
+
+        # Streamflow of all days and combinations for the skill scores, days before a snapshot are read from the tables
+        q_all = np.full((len(forcing), len(sweep)), np.nan)
+        if config.observed and first_day:
+            for k, csv_path in enumerate(self.csv_paths):
+                q_all[:first_day, k] = read_q_csv(csv_path)[1][:first_day]
+
+        # Iterate over each day of the period, the forcing (PET and the precipitation of all IDW exponents) is
+        # calculated once for all combinations
+        climate = forcing.climate
+        for i in range(first_day, len(forcing)):
+            id_day = int(climate.tages_id[i])
+            month = int(climate.month[i])
+            if cube is not None:
+                with profiler.stage("forcing_cache"):
+                    pet = cube.pet(i)  # Read PET and precipitation from the memory-mapped cache
+                    precipitation = cube.precipitation(i)
+            else:
+                with profiler.stage("pet"):
+                    pet = self.grids.pet(month, climate.temperature[i], climate.humidity[i])  # Calculate PET
+                if config.day_messages:
+                    self.message("PET berechnet.")
+                # Interpolate the precipitation of all IDW exponents
+                with profiler.stage("idw"):
+                    precipitation = interpolate_precipitation(forcing.precipitation.station_xy,
+                                                              forcing.precipitation.values[i], self.grid,
+                                                              self.idw_exponent)
+                if config.day_messages:
+                    self.message("Niederschlag interpoliert.")
+
+            # Calculate AET, runoff components and soil water storage of all combinations in one step
+            rasters, runoff_m3 = sweep.step(precipitation, pet)
+            if config.day_messages:
+                self.message("Wasserbilanz und Q in m3 s-1 berechnet.")
+            with profiler.stage("tables"):
+                results.add(id_day, runoff_m3)  # Buffer the daily runoff of all combinations
+            q_all[i] = runoff_m3
+            for k, parameter_day in enumerate(sweep.names if any(save_flags) else []):
+                self._save_rasters(raster_writer, sweep.select(rasters, k), parameter_day, id_day, save_flags)
+
+            # Add the day to all aggregation windows and save the windows ending with this day
+            if aggregator is not None:
+                with profiler.stage("aggregation"):
+                    closed = aggregator.add(id_day, rasters)
+                for window, aggregated in closed:
+                    for k, parameter_day in enumerate(sweep.names):
+                        selected = sweep.select(aggregated, k)
+                        self._save_rasters(raster_writer, selected, parameter_day, window.name, [True] * len(selected))
+                        if self.aggregated is not None:
+                            # Kept for the result store in the precision of the written rasters
+                            self.aggregated.setdefault(k, {})[window.name] = {
+                                name: array.astype(np.float32) for name, array in selected.items()}
+                    self.message("Aggregierte Raster {} geschrieben.".format(window.name))
+
+            # Save the soil water state at the chosen days and at the end of the run, the result tables are written up
+            # to the snapshot
+            if self.checkpointing and (id_day in checkpoint_days or i == len(forcing) - 1 or
+                                       (config.checkpoint_interval and (i + 1) % config.checkpoint_interval == 0)):
+                with profiler.stage("tables"):
+                    results.flush()
+                with profiler.stage("snapshot"):
+                    snapshot_file = save_checkpoint(self.checkpoint_path, sweep, id_day, i, aggregator,
+                                                    {"start": int(config.start), "end": int(config.end),
+                                                     "compact": bool(config.compact)})
+                self.message("Snapshot gespeichert: {}".format(snapshot_file))
+
+            if config.day_messages:
+                self.message("Fertig mit der Berechnung des {0}.{1}.{2}".format(
+                    int(climate.day[i]), month, int(climate.year[i])))
+            profiler.progress(i + 1, len(forcing), id_day)
+
+        if cube is not None:
+            cube.close()
+        with profiler.stage("tables"):
+            results.close()  # Write the remaining days to the CSV result tables
+        if aggregator is not None and aggregator.pending():
+            self.warn("Aggregationszeitraum nicht vollstaendig berechnet, keine Raster geschrieben: {}".format(
+                ", ".join(aggregator.pending())))
+        if raster_writer is not None:
+            raster_writer.close()  # Wait for the rasters still in the queue
+            self.message("{} Rasterdateien geschrieben.".format(raster_writer.written))
+        if config.observed and self.tables:
+            self._write_evaluation(q_all)
+        return q_all
+
+    def _run_with_store(self, raster_output):
+        """
+        Takes the combinations already calculated on the same inputs from the result store and simulates only the
+        others, which are added to the store. The result tables are the same as without the store.
+        :return: streamflow per day and combination (type: array)
+        """
+        config = self.config
+        sweep, tages_id = self.sweep, self.forcing.climate.tages_id
+        store = ResultStore(os.path.join(config.folder, "ResultStore"), max_bytes=config.store_size * 1024 ** 2)
+        mode = forcing_mode(tile_size=config.tile_size, cached=config.forcing_cache or bool(config.tile_size))
+        run_key = input_key(self.grids, self.grid, self.s_init, self.forcing, mode)
+        stored = {}
+        for k, combination in enumerate(sweep.combinations):
+            result = store.get(run_key, combination, self.windows, config.statistics)
+            if result is not None:
+                stored[k] = result
+        missing = [k for k in range(len(sweep)) if k not in stored]
+        self.message("Ergebnisspeicher: {} von {} Kombinationen vorhanden, {} werden berechnet.".format(
+            len(stored), len(sweep), len(missing)))
+
+        q = np.full((len(self.forcing), len(sweep)), np.nan)
+        if missing:
+            # Only the tables of the simulated combinations are written by the mode, the rest follows below
+            csv_paths, long_path = self.csv_paths, self.long_path
+            self.sweep = ParameterSweep(self.grids, [], [], self.s_init, self.rp_control, self.idw_exponent,
+                                        [sweep.combinations[k] for k in missing], sweep.cells, self.profiler)
+            self.csv_paths, self.long_path, self.tables = [csv_paths[k] for k in missing], None, False
+            self.aggregated = {} if self.windows else None
+            try:
+                q[:, missing] = self._run_mode(raster_output)
+            finally:
+                self.sweep, self.csv_paths, self.long_path, self.tables = sweep, csv_paths, long_path, True
+            for j, k in enumerate(missing):
+                store.put(run_key, sweep.combinations[k], tages_id, q[:, k], (self.aggregated or {}).get(j),
+                          self.windows, config.statistics)
+        elif self.cube is not None:
+            self.cube.close()
+
+        raster_writer = None
+        if self.windows and stored:
+            raster_writer = AsyncRasterWriter(self.profiler.timed("raster_io", self.source.save_raster),
+                                              config.raster_writers)
+        with self.profiler.stage("tables"):
+            for k, result in stored.items():
+                q[:, k] = result.q
+                write_q_csv(self.csv_paths[k], tages_id, result.q)
+        for k, result in stored.items():
+            for window_name, rasters in result.aggregated(self.windows).items():
+                self._save_rasters(raster_writer, rasters, sweep.names[k], window_name, [True] * len(rasters))
+        if raster_writer is not None:
+            raster_writer.close()
+            self.message("{} Rasterdateien aus dem Ergebnisspeicher geschrieben.".format(raster_writer.written))
+        self._write_tables(q)
+        removed = store.evict(keep=[store.path(run_key, combination) for combination in sweep.combinations])
+        if removed:
+            self.message("{} Eintraege aus dem Ergebnisspeicher entfernt.".format(len(removed)))
+        return q
+
+    def _finish(self):
+        """Reports the time and calls per stage and the peak memory and writes the trace file if chosen."""
+        for line in self.profiler.summary():
+            self.log(line)
+        if self.config.trace:
+            self.profiler.write_trace(self.config.trace)
+            self.message("Laufzeitprotokoll geschrieben: {}".format(self.config.trace))
+        self.message("Modellierung abgeschlossen.")
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Forcing ensemble for uncertainty runs: N members with perturbed forcing advance together through the same daily step.
+
+Every member gets multiplicative noise on the station precipitation, a temperature and a humidity offset and a random
+dropout of stations before the IDW interpolation. The members form an extra leading axis in front of the combinations,
+so all members and combinations are calculated in one vectorised step, and only the quantiles of the streamflow over
+the members are kept per day. The random numbers of a day are drawn from a generator seeded with (seed, TagesID), so an
+ensemble is reproducible and a day gets the same perturbations in every run that contains it.
+"""
+
+import numpy as np
+
+from .idw import idw_ranking, idw_weights
+from .kernel import haude_pet
+
+
+DEFAULT_QUANTILES = [0.05, 0.5, 0.95]
+
+
+class Perturbation(object):
+    def __init__(self, precipitation=0.0, temperature=0.0, humidity=0.0, dropout=0.0):
+        """
+        Perturbations of the forcing of the ensemble members.
+        :param precipitation: standard deviation of the logarithm of the multiplicative precipitation noise, drawn per
+                              station, member and day with a mean factor of 1 (type: float)
+        :param temperature: standard deviation of the temperature offset of a member in degrees Celsius (type: float)
+        :param humidity: standard deviation of the humidity offset of a member in % (type: float)
+        :param dropout: probability that a station reading is left out of the IDW of a member on a day (type: float)
+        """
+        if not 0.0 <= dropout < 1.0:
+            raise ValueError("Die Ausfallwahrscheinlichkeit muss zwischen 0 und 1 liegen: {}".format(dropout))
+        self.precipitation = float(precipitation)
+        self.temperature = float(temperature)
+        self.humidity = float(humidity)
+        self.dropout = float(dropout)
+
+
+class EnsembleForcing(object):
+    def __init__(self, forcing, grids, grid, idw_exponent, members, perturbation, seed=0):
+        """
+        Perturbed daily forcing of all members.
+        :param forcing: climate and precipitation data of the run (type: Forcing)
+        :param grids: static raster data with the Haude-factors (type: StaticGrids)
+        :param grid: model grid (type: Grid)
+        :param idw_exponent: IDW exponents (type: list)
+        :param members: number of members (type: integer)
+        :param perturbation: perturbations of the forcing (type: Perturbation)
+        :param seed: seed of the random numbers (type: integer)
+        """
+        self.forcing = forcing
+        self.grids = grids
+        self.grid = grid
+        self.idw_exponent = [float(value) for value in idw_exponent]
+        self.members = int(members)
+        self.perturbation = perturbation
+        self.seed = int(seed)
+        # The offsets are systematic errors of a member and hold for the whole run
+        offsets = np.random.default_rng([self.seed]).standard_normal((2, self.members))
+        self.temperature_offset = offsets[0] * perturbation.temperature
+        self.humidity_offset = offsets[1] * perturbation.humidity
+
+    def __len__(self):
+        return len(self.forcing)
+
+    def station_values(self, i):
+        """
+        Perturbs the station precipitation of a day. Missing readings stay NaN, dropped readings become NaN. If all
+        readings of a member would be dropped, the member keeps them.
+        :param i: index of the day (type: integer)
+        :return: precipitation per member and station (type: array of shape (members, stations))
+        """
+        values = self.forcing.precipitation.values[i]
+        rng = np.random.default_rng([self.seed, int(self.forcing.climate.tages_id[i])])
+        noise = rng.standard_normal((self.members, len(values)))
+        drop = rng.random((self.members, len(values))) < self.perturbation.dropout
+        sd = self.perturbation.precipitation
+        perturbed = values * np.exp(sd * noise - sd ** 2 / 2)
+        drop &= ~(drop | np.isnan(values)).all(axis=1, keepdims=True)
+        return np.where(drop, np.nan, perturbed)
+
+    def precipitation(self, i):
+        """
+        Interpolates the perturbed precipitation of a day for all members at once. Without missing or dropped readings
+        this is one sparse product; otherwise every member uses the neighbours among its reporting stations, as in
+        interpolate_precipitation, selected from one ranking of the stations by distance (IdwRanking).
+        :param i: index of the day (type: integer)
+        :return: precipitation (type: array of shape (members, exponents, rows, cols))
+        """
+        values = self.station_values(i)
+        station_xy = self.forcing.precipitation.station_xy
+        if not np.isnan(values).any():
+            return idw_weights(station_xy, self.grid, self.idw_exponent).interpolate(values.T)
+        return idw_ranking(station_xy, self.grid).interpolate(values, self.idw_exponent)
+
+    def pet(self, i):
+        """
+        Calculates the PET of a day with the temperature and humidity offsets of all members.
+        :param i: index of the day (type: integer)
+        :return: PET (type: array of shape (members, rows, cols))
+        """
+        climate = self.forcing.climate
+        shape = (self.members,) + (1,) * self.grids.fc.ndim
+        temperature = (climate.temperature[i] + self.temperature_offset).reshape(shape)
+        humidity = np.clip(climate.humidity[i] + self.humidity_offset, 0.0, 100.0).reshape(shape)
+        return haude_pet(self.grids.haude[int(climate.month[i]) - 1], temperature, humidity)
+
+
+class EnsembleSweep(object):
+    def __init__(self, sweep, members):
+        """
+        Runs all combinations of a sweep for every member, the soilwater content gets a leading member axis.
+        :param sweep: parameter sweep (type: ParameterSweep)
+        :param members: number of members (type: integer)
+        """
+        self.sweep = sweep
+        self.members = int(members)
+        self.reset()
+
+    def __len__(self):
+        return len(self.sweep)
+
+    def reset(self):
+        """Sets the soilwater content of all members and combinations back to the initial state."""
+        self.sweep.reset()
+        model = self.sweep.model
+        model.s = np.broadcast_to(model.s, (self.members,) + model.s.shape).copy()
+
+    def step(self, p, pet):
+        """
+        Advances all members and combinations by one day.
+        :param p: precipitation per member and IDW exponent (type: array of shape (members, exponents, rows, cols))
+        :param pet: potential evapotranspiration per member (type: array of shape (members, rows, cols))
+        :return: fluxes keyed by raster name with leading member and combination axes, and the streamflow in
+                 m^3 s^{-1} (type: tuple of dict and array of shape (members, combinations))
+        """
+        sweep = self.sweep
+        if sweep.cells is not None:
+            p, pet = sweep.cells.compress(p), sweep.cells.compress(pet)
+        fluxes = sweep.model.step(p[:, sweep.idw_index], pet[:, np.newaxis])
+        return fluxes, sweep.model.q(fluxes["R"])
+
+
+def run_ensemble(sweep, ensemble, quantiles=None, log=None):
+    """
+    Simulates all members and combinations over the period and keeps the quantiles of the streamflow per day.
+    :param sweep: parameter sweep (type: ParameterSweep)
+    :param ensemble: perturbed forcing (type: EnsembleForcing)
+    :param quantiles: quantiles between 0 and 1 (type: list)
+    :param log: function for messages (type: callable)
+    :return: quantiles of the streamflow (type: array of shape (days, quantiles, combinations))
+    """
+    quantiles = DEFAULT_QUANTILES if quantiles is None else [float(value) for value in quantiles]
+    members = EnsembleSweep(sweep, ensemble.members)
+    q = np.empty((len(ensemble), len(quantiles), len(sweep)))
+    for i in range(len(ensemble)):
+        _, q_members = members.step(ensemble.precipitation(i), ensemble.pet(i))
+        q[i] = np.quantile(q_members, quantiles, axis=0)
+        if log and (i + 1) % 365 == 0:
+            log("Ensemble: {} von {} Tagen berechnet.".format(i + 1, len(ensemble)))
+    return q
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Skill scores of all combinations of a sweep against observed streamflow, calculated in one pass over the
+day x combination matrix of the simulated streamflow.
+
+The scores follow hydroGOF as used in eval_SWM_parameter_variations.R: NSE, KGE (Kling et al. 2012) with its
+components r, beta and gamma, PBIAS in % and RMSE. Days without observation are excluded, as with na.rm=TRUE.
+"""
+
+import csv
+
+import numpy as np
+
+
+SKILL_SCORES = ["NSE", "KGE", "KGE_r", "KGE_beta", "KGE_gamma", "PBIAS", "RMSE"]
+# Ranking direction: higher is better for NSE and KGE, for PBIAS the absolute value counts, for RMSE lower is better
+RANKING = {"NSE": lambda values: -values, "KGE": lambda values: -values, "PBIAS": np.abs, "RMSE": lambda values: values}
+
+
+class ObservedSeries(object):
+    def __init__(self, tages_id, values):
+        """
+        Observed daily streamflow.
+        :param tages_id: daily IDs (type: array)
+        :param values: streamflow in m^3 s^{-1}, NaN for missing values (type: array)
+        """
+        self.tages_id = np.asarray(tages_id, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_csv(cls, path, date_field="Datum", value_field="Messwert"):
+        """
+        Reads observed streamflow in the format of Eichelsachsen_Messwerte.csv (semicolon separated, date as
+        TT.MM.JJJJ, decimal point or comma).
+        :param path: path of the CSV file (type: string)
+        :param date_field: name of the date column (type: string)
+        :param value_field: name of the value column (type: string)
+        :return: observed series (type: ObservedSeries)
+        """
+        tages_id, values = [], []
+        with open(path, newline="", encoding="utf-8-sig") as csv_file:
+            for row in csv.DictReader(csv_file, delimiter=";"):
+                day, month, year = (int(part) for part in row[date_field].strip().split("."))
+                tages_id.append(year * 10000 + month * 100 + day)
+                value = (row[value_field] or "").strip().replace(",", ".")
+                values.append(float(value) if value and value.upper() != "NA" else np.nan)
+        return cls(tages_id, values)
+
+    def __len__(self):
+        return len(self.tages_id)
+
+
+def align(tages_id, q, observed, start=None, end=None):
+    """
+    Selects the days of the evaluation window with simulated and observed streamflow.
+    :param tages_id: daily IDs of the simulation (type: array)
+    :param q: simulated streamflow per day and combination (type: array of shape (days, combinations))
+    :param observed: observed streamflow (type: ObservedSeries)
+    :param start: first daily ID of the evaluation, e.g. the end of the spin-up period (type: integer)
+    :param end: last daily ID of the evaluation (type: integer)
+    :return: daily IDs, simulated and observed streamflow of the common days (type: tuple of arrays)
+    """
+    tages_id = np.asarray(tages_id, dtype=np.int64)
+    q = np.asarray(q, dtype=np.float64).reshape(len(tages_id), -1)
+    common, sim_index, obs_index = np.intersect1d(tages_id, observed.tages_id, return_indices=True)
+    keep = np.isfinite(observed.values[obs_index])
+    if start is not None:
+        keep &= common >= int(start)
+    if end is not None:
+        keep &= common <= int(end)
+    return common[keep], q[sim_index[keep]], observed.values[obs_index[keep]]
+
+
+def observed_on(tages_id, observed, start=None, end=None):
+    """
+    Assigns the observed streamflow to the days of a run.
+    :param tages_id: daily IDs of the run (type: array)
+    :param observed: observed streamflow (type: ObservedSeries)
+    :param start: first daily ID of the evaluation (type: integer)
+    :param end: last daily ID of the evaluation (type: integer)
+    :return: observed streamflow per day, NaN on days without observation or outside the window (type: array)
+    """
+    tages_id = np.asarray(tages_id, dtype=np.int64)
+    days, _, values = align(tages_id, np.zeros(len(tages_id)), observed, start, end)
+    result = np.full(len(tages_id), np.nan)
+    result[np.searchsorted(tages_id, days)] = values
+    return result
+
+
+def skill_scores(sim, obs):
+    """
+    Calculates the skill scores of all combinations at once.
+    :param sim: simulated streamflow (type: array of shape (days, combinations))
+    :param obs: observed streamflow (type: array of shape (days,))
+    :return: scores keyed by name, one value per combination (type: dict)
+    """
+    sim = np.asarray(sim, dtype=np.float64)
+    obs = np.asarray(obs, dtype=np.float64)[:, np.newaxis]
+    error = sim - obs
+    obs_mean, sim_mean = obs.mean(axis=0), sim.mean(axis=0)
+    obs_sd, sim_sd = obs.std(axis=0, ddof=1), sim.std(axis=0, ddof=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nse = 1.0 - (error ** 2).sum(axis=0) / ((obs - obs_mean) ** 2).sum(axis=0)
+        r = ((sim - sim_mean) * (obs - obs_mean)).sum(axis=0) / (len(obs) - 1) / (sim_sd * obs_sd)
+        beta = sim_mean / obs_mean
+        gamma = (sim_sd / sim_mean) / (obs_sd / obs_mean)
+        kge = 1.0 - np.sqrt((r - 1.0) ** 2 + (beta - 1.0) ** 2 + (gamma - 1.0) ** 2)
+        pbias = 100.0 * error.sum(axis=0) / obs.sum(axis=0)
+    rmse = np.sqrt((error ** 2).mean(axis=0))
+    return {"NSE": nse, "KGE": kge, "KGE_r": r, "KGE_beta": beta, "KGE_gamma": gamma, "PBIAS": pbias, "RMSE": rmse}
+
+
+def rank(scores, by="KGE"):
+    """
+    Orders the combinations by a score, combinations without a valid score come last.
+    :param scores: scores as returned by skill_scores (type: dict)
+    :param by: name of the score (NSE, KGE, PBIAS or RMSE) (type: string)
+    :return: indices of the combinations from best to worst (type: array)
+    """
+    if by not in RANKING:
+        raise ValueError("Unbekanntes Guetemass: {}".format(by))
+    key = RANKING[by](np.asarray(scores[by], dtype=np.float64))
+    return np.argsort(np.where(np.isnan(key), np.inf, key), kind="stable")
+
+
+def evaluate(tages_id, q, observed, start=None, end=None):
+    """
+    Calculates the skill scores of all combinations in the evaluation window.
+    :param tages_id: daily IDs of the simulation (type: array)
+    :param q: simulated streamflow per day and combination (type: array of shape (days, combinations))
+    :param observed: observed streamflow (type: ObservedSeries)
+    :param start: first daily ID of the evaluation (type: integer)
+    :param end: last daily ID of the evaluation (type: integer)
+    :return: scores keyed by name and the number of evaluated days (type: tuple of dict and integer)
+    """
+    days, sim, obs = align(tages_id, q, observed, start, end)
+    if len(days) < 2:
+        raise ValueError("Weniger als zwei Tage mit Beobachtung im Bewertungszeitraum.")
+    return skill_scores(sim, obs), len(days)
+
+
+def write_skill_table(path, combinations, scores, n_days, by="KGE"):
+    """
+    Writes the ranked skill scores of all combinations.
+    :param path: path of the CSV file (type: string)
+    :param combinations: (rp, c, idw) combinations in the order of the scores (type: list of tuples)
+    :param scores: scores as returned by skill_scores (type: dict)
+    :param n_days: number of evaluated days (type: integer)
+    :param by: name of the score used for the ranking (type: string)
+    :return: indices of the combinations from best to worst (type: array)
+    """
+    order = rank(scores, by)
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Rang", "rp", "c", "idw"] + SKILL_SCORES + ["Tage"])
+        for position, k in enumerate(order, start=1):
+            rp, c, idw = combinations[k]
+            writer.writerow([position, rp, c, idw] + [repr(float(scores[name][k])) for name in SKILL_SCORES] +
+                            [n_days])
+    return order
+
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Climate and precipitation forcing of a model run held as contiguous arrays indexed by day.
+
+The tables "TempFeuchte" (TagesID, Jahr, Monat, Tag, RelFeu, Temp_) and "N_Zeitreihen" (Stationsnummer, TagesID,
+Tagessumme_mm) are read once per run. Gaps in the TagesID series and missing station readings are detected when the
+forcing is loaded instead of inside the simulation loop.
+"""
+
+import datetime
+
+import numpy as np
+
+
+def tages_id_to_date(tages_id):
+    """
+    Converts a daily ID (JJJJMMTT) into a date.
+    :param tages_id: daily ID (type: integer)
+    :return: date (type: datetime.date)
+    """
+    tages_id = int(tages_id)
+    return datetime.date(tages_id // 10000, tages_id // 100 % 100, tages_id % 100)
+
+
+def date_to_tages_id(date):
+    """
+    Converts a date into a daily ID (JJJJMMTT).
+    :param date: date (type: datetime.date)
+    :return: daily ID (type: integer)
+    """
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def daily_ids(start, end):
+    """
+    Creates all daily IDs from start to end (both included).
+    :param start: first daily ID (type: integer)
+    :param end: last daily ID (type: integer)
+    :return: daily IDs (type: list)
+    """
+    first, last = tages_id_to_date(start), tages_id_to_date(end)
+    return [date_to_tages_id(first + datetime.timedelta(days=i)) for i in range((last - first).days + 1)]
+
+
+class ClimateSeries(object):
+    def __init__(self, tages_id, year, month, day, humidity, temperature):
+        """
+        Daily climate data sorted by daily ID.
+        :param tages_id: daily IDs (type: array)
+        :param year: years (type: array)
+        :param month: months (type: array)
+        :param day: days of the month (type: array)
+        :param humidity: relative humidity in % (type: array)
+        :param temperature: temperature in degrees Celsius (type: array)
+        """
+        order = np.argsort(np.asarray(tages_id, dtype=np.int64), kind="stable")
+        self.tages_id = np.asarray(tages_id, dtype=np.int64)[order]
+        self.year = np.asarray(year, dtype=np.int64)[order]
+        self.month = np.asarray(month, dtype=np.int64)[order]
+        self.day = np.asarray(day, dtype=np.int64)[order]
+        self.humidity = np.asarray(humidity, dtype=np.float64)[order]
+        self.temperature = np.asarray(temperature, dtype=np.float64)[order]
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Creates the series from table rows.
+        :param records: rows of (TagesID, Jahr, Monat, Tag, RelFeu, Temp_) (type: iterable)
+        :return: climate series (type: ClimateSeries)
+        """
+        columns = list(zip(*records)) or [[]] * 6
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.tages_id)
+
+    def missing_days(self, start=None, end=None):
+        """
+        Searches for days without climate data between start and end.
+        :param start: first daily ID, the first day of the series if None (type: integer)
+        :param end: last daily ID, the last day of the series if None (type: integer)
+        :return: missing daily IDs (type: list)
+        """
+        if not len(self) and (start is None or end is None):
+            return []
+        start = self.tages_id[0] if start is None else start
+        end = self.tages_id[-1] if end is None else end
+        return sorted(set(daily_ids(start, end)) - set(self.tages_id.tolist()))
+
+    def duplicate_days(self):
+        """
+        :return: daily IDs that occur more than once (type: list)
+        """
+        ids, counts = np.unique(self.tages_id, return_counts=True)
+        return ids[counts > 1].tolist()
+
+
+class PrecipitationSeries(object):
+    def __init__(self, stations, station_xy, tages_id, values):
+        """
+        Daily precipitation per station as a day x station matrix, NaN for missing readings.
+        :param stations: station numbers (type: list)
+        :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+        :param tages_id: daily IDs of the rows (type: array)
+        :param values: precipitation in mm (type: array of shape (days, stations))
+        """
+        self.stations = list(stations)
+        self.station_xy = np.asarray(station_xy, dtype=np.float64).reshape(-1, 2)
+        self.tages_id = np.asarray(tages_id, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.tages_id), len(self.stations))
+
+    @classmethod
+    def from_records(cls, stations, station_xy, tages_id, records):
+        """
+        Creates the day x station matrix from the rows of the timeseries table.
+        :param stations: station numbers (type: list)
+        :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+        :param tages_id: daily IDs of the matrix rows, e.g. those of the climate series (type: array)
+        :param records: rows of (Stationsnummer, TagesID, Tagessumme_mm) (type: iterable)
+        :return: precipitation series (type: PrecipitationSeries)
+        """
+        tages_id = np.asarray(tages_id, dtype=np.int64)
+        row_of_day = {int(day): i for i, day in enumerate(tages_id)}
+        column_of_station = {station: j for j, station in enumerate(stations)}
+        values = np.full((len(tages_id), len(column_of_station)), np.nan)
+        for station, day, value in records:
+            i = row_of_day.get(int(day))
+            j = column_of_station.get(station)
+            if i is not None and j is not None and value is not None:
+                values[i, j] = value
+        return cls(stations, station_xy, tages_id, values)
+
+    def __len__(self):
+        return len(self.tages_id)
+
+    def missing_readings(self):
+        """
+        :return: number of missing readings per station (type: dict)
+        """
+        counts = np.isnan(self.values).sum(axis=0)
+        return {station: int(count) for station, count in zip(self.stations, counts) if count}
+
+    def days_without_readings(self):
+        """
+        :return: daily IDs without any station reading (type: list)
+        """
+        return self.tages_id[np.isnan(self.values).all(axis=1)].tolist()
+
+
+class Forcing(object):
+    def __init__(self, climate, precipitation):
+        """
+        Climate and precipitation data of a model run on the same daily index.
+        :param climate: climate series (type: ClimateSeries)
+        :param precipitation: precipitation series with one row per day of the climate series (type: PrecipitationSeries)
+        """
+        self.climate = climate
+        self.precipitation = precipitation
+
+    def __len__(self):
+        return len(self.climate)
+
+    def check(self, start=None, end=None):
+        """
+        Checks the forcing for gaps. Days without climate data or without any precipitation reading cannot be
+        simulated and raise an error, missing readings of single stations are compensated by the IDW interpolation and
+        reported as warnings.
+        :param start: first daily ID of the run (type: integer)
+        :param end: last daily ID of the run (type: integer)
+        :return: warnings (type: list of strings)
+        """
+        errors = []
+        duplicates = self.climate.duplicate_days()
+        if duplicates:
+            errors.append("Mehrfach vorhandene TagesID in TempFeuchte: {}".format(_short_list(duplicates)))
+        missing = self.climate.missing_days(start, end)
+        if missing:
+            errors.append("Fehlende Tage in TempFeuchte: {}".format(_short_list(missing)))
+        empty = self.precipitation.days_without_readings()
+        if empty:
+            errors.append("Tage ohne Niederschlagsmesswert in N_Zeitreihen: {}".format(_short_list(empty)))
+        if errors:
+            raise ValueError(" ".join(errors))
+        return ["Station {}: {} fehlende Tageswerte".format(station, count)
+                for station, count in self.precipitation.missing_readings().items()]
+
+
+def _short_list(values, limit=10):
+    """
+    Formats a list for a message, long lists are shortened.
+    :param values: values (type: list)
+    :param limit: maximum number of listed values (type: integer)
+    :return: text (type: string)
+    """
+    text = ", ".join(str(value) for value in values[:limit])
+    if len(values) > limit:
+        text += " ... ({} insgesamt)".format(len(values))
+    return text
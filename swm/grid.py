@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Geometry of the model grid (the grid of the initial soilwater storage raster).
+"""
+
+import numpy as np
+
+
+class Grid(object):
+    def __init__(self, x_min, y_max, cellsize, nrows, ncols):
+        """
+        Regular raster grid with north-up orientation, row 0 is the northern edge.
+        :param x_min: x coordinate of the western edge (type: float)
+        :param y_max: y coordinate of the northern edge (type: float)
+        :param cellsize: raster cellsize (type: float)
+        :param nrows: number of rows (type: integer)
+        :param ncols: number of columns (type: integer)
+        """
+        self.x_min = float(x_min)
+        self.y_max = float(y_max)
+        self.cellsize = float(cellsize)
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+
+    @property
+    def shape(self):
+        return self.nrows, self.ncols
+
+    @property
+    def y_min(self):
+        return self.y_max - self.nrows * self.cellsize
+
+    @property
+    def x_max(self):
+        return self.x_min + self.ncols * self.cellsize
+
+    def key(self):
+        """
+        :return: hashable description of the grid (type: tuple)
+        """
+        return self.x_min, self.y_max, self.cellsize, self.nrows, self.ncols
+
+    def window(self, rows, cols):
+        """
+        Returns the part of the grid covered by a block of rows and columns.
+        :param rows: rows of the block (type: slice)
+        :param cols: columns of the block (type: slice)
+        :return: grid of the block (type: Grid)
+        """
+        rows = range(self.nrows)[rows]
+        cols = range(self.ncols)[cols]
+        return Grid(self.x_min + cols.start * self.cellsize, self.y_max - rows.start * self.cellsize, self.cellsize,
+                    len(rows), len(cols))
+
+    def cell_centres(self):
+        """
+        Calculates the coordinates of all cell centres in row-major order.
+        :return: x and y coordinates (type: array of shape (rows * cols, 2))
+        """
+        x = self.x_min + (np.arange(self.ncols) + 0.5) * self.cellsize
+        y = self.y_max - (np.arange(self.nrows) + 0.5) * self.cellsize
+        xx, yy = np.meshgrid(x, y)
+        return np.column_stack([xx.ravel(), yy.ravel()])
+
+    def __repr__(self):
+        return "Grid(x_min={}, y_max={}, cellsize={}, nrows={}, ncols={})".format(*self.key())
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Inverse Distance Weighting (IDW) of the daily station precipitation as a sparse matrix-vector product.
+
+The neighbour search follows the "Idw" tool of the Spatial Analyst with RadiusFixed(radius, min_points): all stations
+within the radius are used, and if there are fewer than min_points of them, the nearest min_points stations. Since the
+station geometry does not change, the neighbour search is done once per (station set, grid, radius) and the weights
+once per exponent(s). As the query table of a day only contains the stations with a reading, days with missing readings
+are interpolated with the neighbour search of the reporting stations. Searches and weights are held in small least
+recently used caches, so the station sets of days with gaps do not accumulate over a run. For many station subsets of
+the same day (ensemble members with dropped stations) the stations are ranked by distance once per cell
+(IdwRanking), and the neighbours of every subset are selected by masking the ranking.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+
+IDW_RADIUS = 20000.0
+IDW_MIN_POINTS = 5
+# Number of station sets (and grids) whose neighbour searches and weights are kept
+CACHE_SIZE = 8
+# Number of array elements (members x cells x ranked stations) interpolated at once by IdwRanking
+RANKING_BLOCK = 2 ** 22
+
+_neighbours_cache = OrderedDict()
+_weights_cache = OrderedDict()
+_ranking_cache = OrderedDict()
+
+
+class IdwNeighbours(object):
+    def __init__(self, station_xy, grid, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+        """
+        Searches the neighbour stations of every cell. The distances do not depend on the IDW power and are shared by
+        the weights of all exponents.
+        :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+        :param grid: model grid (type: Grid)
+        :param radius: search radius (type: float)
+        :param min_points: minimum number of stations per cell (type: integer)
+        """
+        self.station_xy = np.asarray(station_xy, dtype=np.float64).reshape(-1, 2)
+        self.grid = grid
+        self.radius = float(radius)
+        self.min_points = int(min_points)
+
+        cells = grid.cell_centres()
+        n_stations = len(self.station_xy)
+        tree = cKDTree(self.station_xy)
+        counts = tree.query_ball_point(cells, self.radius, return_length=True)
+        k = min(max(int(counts.max()) if len(counts) else 0, self.min_points), n_stations)
+        distances, stations = tree.query(cells, k=k)
+        distances = distances.reshape(len(cells), k)
+        stations = stations.reshape(len(cells), k)
+        # Stations within the radius, and the nearest min_points stations if the radius contains fewer of them
+        rank = np.arange(k)[np.newaxis, :]
+        use = (distances <= self.radius) | (rank < self.min_points)
+        rows = np.broadcast_to(np.arange(len(cells))[:, np.newaxis], use.shape)[use]
+        stations, distances = stations[use], distances[use]
+
+        # Cells located exactly on a station get the value of that station only
+        exact = distances == 0
+        keep = ~np.isin(rows, np.unique(rows[exact])) | exact
+        self.rows, self.stations, self.distances = rows[keep], stations[keep], distances[keep]
+
+    @property
+    def shape(self):
+        return self.grid.nrows * self.grid.ncols, len(self.station_xy)
+
+    def weights(self, power):
+        """
+        Calculates the inverse distance weights of all neighbour pairs.
+        :param power: IDW power (type: float)
+        :return: weights (type: array)
+        """
+        with np.errstate(divide='ignore'):
+            return np.where(self.distances == 0, 1.0, 1.0 / self.distances ** float(power))
+
+
+class IdwWeights(object):
+    def __init__(self, station_xy, grid, power, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+        """
+        Builds the sparse weight matrix (cells x stations) of the IDW interpolation. For a sequence of powers the
+        matrices of all exponents are stacked, so all precipitation fields of a day result from one product.
+        :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+        :param grid: model grid (type: Grid)
+        :param power: IDW power(s) (type: float or list)
+        :param radius: search radius (type: float)
+        :param min_points: minimum number of stations per cell (type: integer)
+        """
+        self.grid = grid
+        self.batched = np.ndim(power) > 0
+        self.powers = [float(value) for value in np.atleast_1d(power)]
+        self.neighbours = idw_neighbours(station_xy, grid, radius, min_points)
+        n_cells, n_stations = self.neighbours.shape
+        rows = np.concatenate([self.neighbours.rows + i * n_cells for i in range(len(self.powers))])
+        cols = np.tile(self.neighbours.stations, len(self.powers))
+        weights = np.concatenate([self.neighbours.weights(value) for value in self.powers])
+        self.matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(len(self.powers) * n_cells, n_stations))
+
+    def interpolate(self, values):
+        """
+        Interpolates the station values of one or several days. The result equals the IDW of the Spatial Analyst for
+        complete days only: stations without a reading (NaN) are left out and the weights of the remaining neighbours
+        are normalised again, while a day with missing readings has to search the neighbours among its reporting
+        stations (interpolate_precipitation, IdwRanking).
+        :param values: station values (type: array of shape (stations,) or (stations, days))
+        :return: interpolated grid(s) of shape ([days,] [powers,] rows, cols), the power axis only exists if the weights
+                 were built for a sequence of powers; NaN if no neighbour of a cell has a reading (type: array)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        numerator = self.matrix @ np.where(valid, values, 0.0)
+        denominator = self.matrix @ valid.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = np.where(denominator > 0, numerator / denominator, np.nan)
+        shape = (len(self.powers),) + self.grid.shape
+        if result.ndim == 2:
+            result = np.moveaxis(result, -1, 0)
+            shape = (len(result),) + shape
+        result = result.reshape(shape)
+        return result if self.batched else result[..., 0, :, :]
+
+
+class IdwRanking(object):
+    def __init__(self, station_xy, grid, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+        """
+        IDW of many subsets of the stations at once, e.g. ensemble members with dropped stations. A subset uses its
+        stations within the radius, or the nearest min_points of them if the radius contains fewer, as the neighbour
+        search on the subset alone would. Where at least min_points neighbours of the complete station set have a
+        reading, this equals the normalised product of the cached weights (IdwWeights), which interpolates all
+        subsets at once. The remaining cells of a subset select their neighbours from a ranking of the nearest
+        stations by distance, which is searched once and only as deep as the subsets need.
+        :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+        :param grid: model grid (type: Grid)
+        :param radius: search radius (type: float)
+        :param min_points: minimum number of stations per cell (type: integer)
+        """
+        self.station_xy = np.asarray(station_xy, dtype=np.float64).reshape(-1, 2)
+        self.grid = grid
+        self.radius = float(radius)
+        self.min_points = int(min_points)
+        neighbours = idw_neighbours(self.station_xy, grid, radius, min_points)
+        self._neighbours = sparse.csr_matrix((np.ones(len(neighbours.rows)), (neighbours.rows, neighbours.stations)),
+                                             shape=neighbours.shape)
+        self._cells = grid.cell_centres()
+        self._tree = cKDTree(self.station_xy)
+        self.k = 0
+        self.extend(0)
+
+    def extend(self, missing):
+        """
+        Ranks enough stations for subsets without up to missing stations: a cell needing the ranking has fewer than
+        min_points neighbours with a reading, so its neighbours are among the nearest min_points + missing stations.
+        :param missing: number of stations missing from a subset (type: integer)
+        """
+        k = min(self.min_points + int(missing), len(self.station_xy))
+        if k <= self.k:
+            return
+        distances, stations = self._tree.query(self._cells, k=k)
+        self.distances = distances.reshape(len(self._cells), k)
+        self.stations = stations.reshape(len(self._cells), k)
+        self.k = k
+        self._in_radius = self.distances <= self.radius
+        self._on_station = self.distances[:, 0] == 0
+        self._ranked_weights = {}
+
+    def interpolate(self, values, power):
+        """
+        Interpolates the station values of several subsets, each with the neighbours among its stations with a reading.
+        :param values: station values of every subset, NaN for stations not in the subset
+                       (type: array of shape (subsets, stations))
+        :param power: IDW power(s) (type: float or list)
+        :return: interpolated grids of shape (subsets, [powers,] rows, cols), the power axis only exists for a sequence
+                 of powers; NaN if a subset has no reading (type: array)
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        powers = [float(value) for value in np.atleast_1d(power)]
+        fields = idw_weights(self.station_xy, self.grid, powers, self.radius, self.min_points).interpolate(values.T)
+        result = fields.reshape(len(values), len(powers), -1)
+
+        # Cells with fewer than min_points neighbours with a reading search their neighbours in the ranking
+        valid = ~np.isnan(values)
+        subsets, cells = np.nonzero((self._neighbours @ valid.T.astype(np.float64)).T < self.min_points)
+        if len(cells):
+            missing = (~valid).sum(axis=1)
+            self.extend(int(missing.max()))
+            # Every subset only needs the ranking down to min_points + its number of missing stations
+            depths = np.minimum(self.min_points + missing, self.k)[subsets]
+            for depth in np.unique(depths):
+                subset, cell = subsets[depths == depth], cells[depths == depth]
+                size = max(RANKING_BLOCK // int(depth), 1)
+                for start in range(0, len(cell), size):
+                    block = slice(start, start + size)
+                    result[subset[block], :, cell[block]] = self._nearest(values, subset[block], cell[block], powers,
+                                                                          int(depth))
+        return fields if np.ndim(power) > 0 else fields[:, 0]
+
+    def _nearest(self, values, subsets, cells, powers, depth):
+        """
+        Interpolates single cells of subsets with the neighbours selected from the ranking.
+        :param values: station values of every subset (type: array of shape (subsets, stations))
+        :param subsets: index of the subset of every cell (type: array)
+        :param cells: indices of the cells (type: array)
+        :param powers: IDW powers (type: list)
+        :param depth: number of ranked stations to search (type: integer)
+        :return: precipitation per cell and power, NaN without any reading (type: array of shape (cells, powers))
+        """
+        ranked = values[subsets[:, np.newaxis], self.stations[cells, :depth]]  # Station values by rank
+        valid = ~np.isnan(ranked)
+        use = valid & (self._in_radius[cells, :depth] | (np.cumsum(valid, axis=1, dtype=np.int16) <= self.min_points))
+        exact = None
+        if self._on_station[cells].any():
+            # Cells located exactly on a station with a reading get the value of that station only
+            exact = use & (self.distances[cells, :depth] == 0)
+            use &= ~exact.any(axis=1, keepdims=True) | exact
+        ranked[~use] = 0.0
+        result = np.empty((len(cells), len(powers)))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for j, value in enumerate(powers):
+                weights = self._weights(value)[cells, :depth] * use
+                if exact is not None:
+                    weights[exact] = 1.0
+                result[:, j] = (weights * ranked).sum(axis=1) / weights.sum(axis=1)
+        return result
+
+    def _weights(self, power):
+        """
+        :param power: IDW power (type: float)
+        :return: inverse distance weights of the ranked stations, 0 for stations on the cell (type: array)
+        """
+        if power not in self._ranked_weights:
+            with np.errstate(divide='ignore'):
+                self._ranked_weights[power] = np.where(self.distances == 0, 0.0, 1.0 / self.distances ** power)
+        return self._ranked_weights[power]
+
+
+def station_key(station_xy):
+    """
+    Creates a hash of the station coordinates for the weight cache.
+    :param station_xy: coordinates of the stations (type: array)
+    :return: hash (type: string)
+    """
+    return hashlib.sha1(np.ascontiguousarray(station_xy, dtype=np.float64).tobytes()).hexdigest()
+
+
+def idw_neighbours(station_xy, grid, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+    """
+    Returns the cached neighbour search for the station set, grid and radius or runs it.
+    :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+    :param grid: model grid (type: Grid)
+    :param radius: search radius (type: float)
+    :param min_points: minimum number of stations per cell (type: integer)
+    :return: neighbour stations and distances (type: IdwNeighbours)
+    """
+    key = (station_key(station_xy), grid.key(), float(radius), int(min_points))
+    return _cached(_neighbours_cache, key, lambda: IdwNeighbours(station_xy, grid, radius, min_points))
+
+
+def idw_weights(station_xy, grid, power, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+    """
+    Returns the cached IDW weights for the station set, grid, exponent(s) and radius or builds them.
+    :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+    :param grid: model grid (type: Grid)
+    :param power: IDW power(s) (type: float or list)
+    :param radius: search radius (type: float)
+    :param min_points: minimum number of stations per cell (type: integer)
+    :return: IDW weights (type: IdwWeights)
+    """
+    powers = tuple(float(value) for value in np.atleast_1d(power))
+    key = (station_key(station_xy), grid.key(), powers if np.ndim(power) > 0 else powers[0], float(radius), int(min_points))
+    return _cached(_weights_cache, key, lambda: IdwWeights(station_xy, grid, power, radius, min_points))
+
+
+def idw_ranking(station_xy, grid, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+    """
+    Returns the cached station ranking for the station set, grid and radius or builds it.
+    :param station_xy: coordinates of the stations (type: array of shape (stations, 2))
+    :param grid: model grid (type: Grid)
+    :param radius: search radius (type: float)
+    :param min_points: minimum number of stations per cell (type: integer)
+    :return: stations ranked by distance (type: IdwRanking)
+    """
+    key = (station_key(station_xy), grid.key(), float(radius), int(min_points))
+    return _cached(_ranking_cache, key, lambda: IdwRanking(station_xy, grid, radius, min_points))
+
+
+def interpolate_precipitation(station_xy, values, grid, power, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+    """
+    Interpolates the precipitation of a day with the stations that have a reading, as the Spatial Analyst does on the
+    query table of the day. The neighbours of a cell are searched among the reporting stations only, so the value of a
+    cell depends neither on other cells nor on the extent of the grid (e.g. a tile).
+    :param station_xy: coordinates of all stations (type: array of shape (stations, 2))
+    :param values: precipitation per station, NaN for missing readings (type: array of shape (stations,))
+    :param grid: model grid (type: Grid)
+    :param power: IDW power(s), a sequence adds a leading axis with one field per power (type: float or list)
+    :param radius: search radius (type: float)
+    :param min_points: minimum number of stations per cell (type: integer)
+    :return: precipitation (type: array)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if valid.all() or not valid.any():
+        return idw_weights(station_xy, grid, power, radius, min_points).interpolate(values)  # NaN without any reading
+    station_xy = np.asarray(station_xy, dtype=np.float64)[valid]
+    return idw_weights(station_xy, grid, power, radius, min_points).interpolate(values[valid])
+
+
+def _cached(cache, key, create):
+    """
+    Returns an entry of a least recently used cache or creates it, the oldest entries beyond CACHE_SIZE are removed.
+    :param cache: cache (type: OrderedDict)
+    :param key: key of the entry (type: tuple)
+    :param create: function creating the entry (type: callable)
+    :return: entry
+    """
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = cache[key] = create()
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+def clear_cache():
+    """Removes all cached neighbour searches, IDW weights and station rankings."""
+    _neighbours_cache.clear()
+    _weights_cache.clear()
+    _ranking_cache.clear()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Fused daily water balance of the soil water model (SWM) on NumPy arrays.
+
+The functions reproduce the Map Algebra chain of the ArcGIS toolbox (PET by Haude, AET, total runoff, overflow runoff,
+soil runoff according to Glugla (1969) and the soilwater content) cell by cell. NoData cells are represented by NaN,
+so the static grids have to be masked to the basin before they are passed to the model.
+"""
+
+import numpy as np
+
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'Mai', 'Jun', 'Jul', 'Aug', 'Sep', 'Okt', 'Nov', 'Dez']
+RASTER_NAMES = ["PET", "AET", "IDW", "R", "S", "Rsoil", "Roverflow"]
+
+
+def haude_pet(haude_factor, temperature, humidity):
+    """
+    Calculates the potential evapotranspiration (PET) by Haude.
+    :param haude_factor: Haude-factor of the current month (type: array)
+    :param temperature: temperature of the day in degrees Celsius (type: float or array)
+    :param humidity: relative humidity (type: float or array)
+    :return: PET (type: array)
+    """
+    vapour_pressure = 6.1 * 10 ** ((7.5 * temperature) / (temperature + 237.2))
+    return haude_factor * vapour_pressure * (1.0 - humidity / 100.0)
+
+
+def runoff_to_q(runoff, cellsize, axis=(-2, -1)):
+    """
+    Calculates the streamflow of the basin in m^3 s^{-1} by summing up the runoff of all cells. NoData cells count as 0.
+    :param runoff: total runoff in mm per cell (type: array)
+    :param cellsize: raster cellsize (type: float)
+    :param axis: axes of the cells, leading axes are kept e.g. for parameter combinations (type: tuple or int)
+    :return: streamflow by basin in m^3 s^{-1} (type: float or array)
+    """
+    r_sum = np.nansum(runoff, axis=axis)
+    return r_sum * 0.001 * cellsize ** 2 / 24 / 60 / 60
+
+
+def land_step(s_pre, p, pet, fc, wp, rp, rpwp_dif, lambda_param):
+    """
+    Advances the soilwater content of land cells by one day.
+    :param s_pre: soilwater content of the previous day (type: array)
+    :param p: precipitation (type: array)
+    :param pet: potential evapotranspiration (type: array)
+    :param fc: field capacity (fc) (type: array)
+    :param wp: wilting point (wp) (type: array)
+    :param rp: reduction point (rp) (type: array)
+    :param rpwp_dif: difference between reduction point (rp) and wilting point (wp) (type: array)
+    :param lambda_param: Lambda value (type: array)
+    :return: AET, total runoff, soil runoff, overflow runoff and soilwater content (type: tuple of arrays)
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # AET equals PET above the reduction point, is 0 if rp equals wp and is reduced linearly otherwise
+        reduction = np.where(rpwp_dif == 0, 0.0, (s_pre - wp) / rpwp_dif)
+        aet = np.where(s_pre >= rp, pet, reduction * pet)
+
+        # Land runoff is the sum of the soil runoff (Glugla 1969) and the overflow above the field capacity
+        rsoil = lambda_param * (s_pre - wp) ** 2
+        roverflow = np.maximum(p + s_pre - fc, 0.0)
+        runoff = rsoil + roverflow
+
+        soilwater = s_pre + p - aet - runoff
+        soilwater[soilwater < 0] = 0.0  # Ensure soil water content is not negative
+    return aet, runoff, rsoil, roverflow, soilwater
+
+
+def water_step(p, pet):
+    """
+    Calculates the fluxes of water cells. The AET equals the PET, the runoff is the precipitation surplus or the whole
+    precipitation if it does not exceed the PET.
+    :param p: precipitation (type: array)
+    :param pet: potential evapotranspiration (type: array)
+    :return: AET and total runoff (type: tuple of arrays)
+    """
+    return pet, np.where(p > pet, p - pet, p)
+
+
+def water_balance_step(s_pre, p, pet, fc, wp, rp, rpwp_dif, lambda_param, water, land):
+    """
+    Advances the soilwater content by one day and returns all fluxes of the day in one vectorised pass. The arrays are
+    broadcast against each other, so leading axes (e.g. parameter combinations) can be added to s_pre, rp, rpwp_dif
+    and lambda_param.
+    :param s_pre: soilwater content of the previous day (type: array)
+    :param p: precipitation (type: array)
+    :param pet: potential evapotranspiration (type: array)
+    :param fc: field capacity (fc) (type: array)
+    :param wp: wilting point (wp) (type: array)
+    :param rp: reduction point (rp) (type: array)
+    :param rpwp_dif: difference between reduction point (rp) and wilting point (wp) (type: array)
+    :param lambda_param: Lambda value (type: array)
+    :param water: mask of water cells (type: boolean array)
+    :param land: mask of land cells (type: boolean array)
+    :return: AET, total runoff, soil runoff, overflow runoff and soilwater content (type: tuple of arrays)
+    """
+    aet_land, runoff_land, rsoil_land, roverflow_land, soilwater = land_step(s_pre, p, pet, fc, wp, rp, rpwp_dif,
+                                                                             lambda_param)
+    aet_water, runoff_water = water_step(p, pet)
+    aet = np.where(water, aet_water, aet_land)
+    runoff = np.where(water, runoff_water, runoff_land)
+    rsoil = np.where(water, 0.0, rsoil_land)
+    roverflow = np.where(water, 0.0, roverflow_land)
+    # Water cells have no soilwater storage
+    soilwater = np.where(land, soilwater, np.nan)
+    return aet, runoff, rsoil, roverflow, soilwater
+
+
+class StaticGrids(object):
+    def __init__(self, fc, wp, l_m, water, haude, cellsize):
+        """
+        Holds the static raster data of a basin as arrays.
+        :param fc: field capacity (fc) (type: array)
+        :param wp: wilting point (wp) (type: array)
+        :param l_m: effective root zone in m (type: array)
+        :param water: mask of water cells with water = 1 and land = 0 (type: array)
+        :param haude: Haude-factors from January to December, may be None if the PET is not calculated from the grids
+                      (type: array of shape (12, rows, cols))
+        :param cellsize: raster cellsize (type: float)
+        """
+        self.fc = np.asarray(fc, dtype=np.float64)
+        self.wp = np.asarray(wp, dtype=np.float64)
+        self.l_m = np.asarray(l_m, dtype=np.float64)
+        water = np.asarray(water, dtype=np.float64)
+        self.water = water == 1
+        self.land = water == 0
+        self.haude = None if haude is None else np.asarray(haude, dtype=np.float64)
+        self.cellsize = float(cellsize)
+
+    @property
+    def shape(self):
+        return self.fc.shape
+
+    def water_mask(self):
+        """
+        :return: mask of water cells with water = 1, land = 0 and NaN outside the basin (type: array)
+        """
+        return np.where(self.water, 1.0, np.where(self.land, 0.0, np.nan))
+
+    def window(self, rows, cols):
+        """
+        Returns the static data of a block of the grid. The arrays are views, memory-mapped grids stay on disk.
+        :param rows: rows of the block (type: slice)
+        :param cols: columns of the block (type: slice)
+        :return: static raster data of the block (type: StaticGrids)
+        """
+        water = np.where(self.water[rows, cols], 1.0, np.where(self.land[rows, cols], 0.0, np.nan))
+        haude = None if self.haude is None else self.haude[:, rows, cols]
+        return StaticGrids(self.fc[rows, cols], self.wp[rows, cols], self.l_m[rows, cols], water, haude, self.cellsize)
+
+    def rp_control(self):
+        """
+        Calculates the maximum quotient of wilting point and field capacity. NoData cells and cells with a field
+        capacity of 0 count as 0.
+        :return: maximum value of wp/fc (type: float)
+        """
+        maximum = 0.0
+        # Calculated in blocks of rows, so memory-mapped grids are not loaded at once
+        for start in range(0, max(len(self.fc), 1), 1024):
+            fc = np.nan_to_num(self.fc[start:start + 1024], nan=0.0)
+            wp = np.nan_to_num(self.wp[start:start + 1024], nan=0.0)
+            quotient = np.divide(wp, fc, out=np.zeros_like(wp), where=fc != 0)
+            maximum = max(maximum, float(quotient.max(initial=0.0)))
+        return maximum
+
+    def pet(self, month, temperature, humidity):
+        """
+        Calculates the PET grid of a day.
+        :param month: month of the day (type: integer)
+        :param temperature: temperature of the day in degrees Celsius (type: float)
+        :param humidity: relative humidity (type: float)
+        :return: PET (type: array)
+        """
+        return haude_pet(self.haude[month - 1], temperature, humidity)
+
+    def parameter_grids(self, rp_factor, c):
+        """
+        Calculates the parameter dependent grids. If rp_factor and c are sequences, the grids get a leading axis with
+        one entry per parameter combination.
+        :param rp_factor: RP factor(s) (type: float or array)
+        :param c: c parameter(s) (type: float or array)
+        :return: reduction point, difference between reduction point and wilting point, Lambda (type: tuple of arrays)
+        """
+        rp_factor = np.asarray(rp_factor, dtype=np.float64)
+        c = np.asarray(c, dtype=np.float64)
+        rp_factor = rp_factor.reshape(rp_factor.shape + (1,) * self.fc.ndim)
+        c = c.reshape(c.shape + (1,) * self.fc.ndim)
+        rp = self.fc * rp_factor
+        rpwp_dif = rp - self.wp
+        lambda_param = c / (self.l_m * 1000) ** 2
+        return rp, rpwp_dif, lambda_param
+
+
+class SoilWaterModel(object):
+    def __init__(self, grids, rp_factor, c, s_init):
+        """
+        Soilwater model of a basin for one parameter combination (or a stack of them, see StaticGrids.parameter_grids).
+        :param grids: static raster data of the basin (type: StaticGrids)
+        :param rp_factor: RP factor(s) (type: float or array)
+        :param c: c parameter(s) (type: float or array)
+        :param s_init: initial soilwater content (type: array)
+        """
+        self.grids = grids
+        self.rp, self.rpwp_dif, self.lambda_param = grids.parameter_grids(rp_factor, c)
+        self.s_init = np.asarray(s_init, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        """Sets the soilwater content back to the initial state."""
+        self.s = np.broadcast_to(self.s_init, self.rp.shape).copy()
+
+    def step(self, p, pet):
+        """
+        Advances the model by one day.
+        :param p: precipitation (type: array)
+        :param pet: potential evapotranspiration (type: array)
+        :return: fluxes and soilwater content of the day keyed by raster name (type: dict)
+        """
+        g = self.grids
+        aet, runoff, rsoil, roverflow, self.s = water_balance_step(self.s, p, pet, g.fc, g.wp, self.rp, self.rpwp_dif,
+                                                                   self.lambda_param, g.water, g.land)
+        return {"PET": pet, "AET": aet, "IDW": p, "R": runoff, "S": self.s, "Rsoil": rsoil, "Roverflow": roverflow}
+
+    def q(self, runoff):
+        """
+        Calculates the streamflow of the basin in m^3 s^{-1}.
+        :param runoff: total runoff of the day (type: array)
+        :return: streamflow (type: float or array)
+        """
+        return runoff_to_q(runoff, self.grids.cellsize, axis=tuple(range(-self.grids.fc.ndim, 0)))
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Calibration by successive grid refinement instead of an exhaustive parameter grid.
+
+Every iteration evaluates a coarse grid of (rp, c, idw) candidates inside the current bounds as one batched sweep, then
+shrinks the bounds around the best candidate. The RP factor is bounded below by rp_control (maximum of WP/FK), IDW
+exponents are taken from the list of exponents of the precomputed forcing. For NSE and RMSE the sum of squared errors
+only grows during the evaluation window, so a candidate whose running error exceeds that of the best candidate found
+so far cannot win any more and is abandoned before the end of the period.
+"""
+
+import csv
+
+import numpy as np
+
+from .evaluate import RANKING, skill_scores
+from .sweep import ParameterSweep, combination_name
+
+
+# Objectives whose score only depends on the sum of squared errors, which allows to abandon candidates early
+SSE_OBJECTIVES = ["NSE", "RMSE"]
+
+
+class Candidate(object):
+    def __init__(self, combination, iteration):
+        """
+        Evaluated parameter combination of the optimisation.
+        :param combination: (rp, c, idw) combination (type: tuple)
+        :param iteration: iteration of the evaluation (type: integer)
+        """
+        self.combination = combination
+        self.name = combination_name(*combination)
+        self.iteration = iteration
+        self.scores = None
+        self.sse = np.inf
+        self.days = 0
+        self.abandoned = False
+        self.q = None
+
+
+class GridRefinement(object):
+    def __init__(self, grids, s_init, observed, tages_id, pet, precipitation, rp_bounds, c_bounds, idw_exponent,
+                 objective="NSE", points=5, iterations=4, shrink=0.5, rp_control=None, cells=None, check_every=5,
+                 log=None):
+        """
+        Optimiser of the parameters rp, c and idw.
+        :param grids: static raster data of the basin (type: StaticGrids)
+        :param s_init: initial soilwater content (type: array)
+        :param observed: observed streamflow on the days of the run, NaN outside the evaluation window (type: array)
+        :param tages_id: daily IDs of the run (type: array)
+        :param pet: function returning the PET of day i (type: callable)
+        :param precipitation: function returning the precipitation fields of day i, one per IDW exponent (type: callable)
+        :param rp_bounds: smallest and largest RP factor (type: tuple)
+        :param c_bounds: smallest and largest c parameter (type: tuple)
+        :param idw_exponent: IDW exponents in the order of the precipitation fields (type: list)
+        :param objective: score to optimise (KGE, NSE, PBIAS or RMSE) (type: string)
+        :param points: number of grid points per parameter and iteration (type: integer)
+        :param iterations: maximum number of iterations (type: integer)
+        :param shrink: factor by which the bounds shrink per iteration (type: float)
+        :param rp_control: maximum value of wp/fc, RP factors must exceed it, calculated from the grids if None
+                           (type: float)
+        :param cells: index of the active cells for the compact mode (type: CellIndex)
+        :param check_every: number of days between two checks for abandoning candidates (type: integer)
+        :param log: function for messages (type: callable)
+        """
+        if objective not in RANKING:
+            raise ValueError("Unbekanntes Guetemass: {}".format(objective))
+        self.grids = grids
+        self.s_init = s_init
+        self.observed = np.asarray(observed, dtype=np.float64)
+        self.tages_id = np.asarray(tages_id, dtype=np.int64)
+        self.pet = pet
+        self.precipitation = precipitation
+        self.rp_control = grids.rp_control() if rp_control is None else rp_control
+        # The RP factor has to exceed rp_control, the factors are used with two decimals
+        rp_min = max(float(rp_bounds[0]), (np.floor(round(self.rp_control * 100, 6)) + 1) / 100)
+        self.bounds = {"rp": (rp_min, max(rp_min, float(rp_bounds[1]))),
+                       "c": (float(c_bounds[0]), max(float(c_bounds[0]), float(c_bounds[1]))),
+                       "idw": (min(idw_exponent), max(idw_exponent))}
+        self.idw_exponent = list(idw_exponent)
+        self.objective = objective
+        self.points = max(int(points), 2)
+        self.iterations = max(int(iterations), 1)
+        self.shrink = shrink
+        self.cells = cells
+        self.check_every = max(int(check_every), 1)
+        self.log = log
+        self.evaluation = np.isfinite(self.observed)
+        self.candidates = {}
+        self.best = None
+
+    def candidates_in(self, bounds):
+        """
+        Creates the grid of candidates inside bounds.
+        :param bounds: bounds of rp, c and idw (type: dict)
+        :return: (rp, c, idw) combinations (type: list of tuples)
+        """
+        rp_values = sorted(set(round(float(value), 2) for value in np.linspace(*bounds["rp"], self.points)))
+        c_values = sorted(set(int(round(float(value))) for value in np.linspace(*bounds["c"], self.points)))
+        idw_values = [idw for idw in self.idw_exponent if bounds["idw"][0] <= idw <= bounds["idw"][1]]
+        if self.best is not None and self.best.combination[2] not in idw_values:
+            idw_values.append(self.best.combination[2])
+        return [(rp, c, idw) for rp in rp_values for c in c_values for idw in idw_values]
+
+    def run(self):
+        """
+        Runs the optimisation.
+        :return: best candidate (type: Candidate)
+        """
+        bounds = dict(self.bounds)
+        if self.log and self.objective not in SSE_OBJECTIVES:
+            self.log("Fuer {} ist kein vorzeitiger Abbruch von Kandidaten moeglich, alle Kandidaten werden ueber den "
+                     "ganzen Zeitraum gerechnet".format(self.objective))
+        for iteration in range(1, self.iterations + 1):
+            combinations = [combination for combination in self.candidates_in(bounds)
+                            if combination_name(*combination) not in self.candidates]
+            if not combinations:
+                break
+            self.evaluate(combinations, iteration)
+            if self.best is None:
+                break
+            if self.log:
+                scores = self.best.scores
+                self.log("Iteration {}: {} Kandidaten, bester rp={} c={} idw={} mit {}={:.4f}".format(
+                    iteration, len(combinations), *self.best.combination, self.objective, scores[self.objective]))
+            bounds = self._refine(bounds)
+        return self.best
+
+    def _refine(self, bounds):
+        """
+        Shrinks the bounds around the best candidate, inside the initial bounds.
+        :param bounds: current bounds (type: dict)
+        :return: new bounds (type: dict)
+        """
+        refined = {}
+        for axis, value in zip(["rp", "c", "idw"], self.best.combination):
+            low, high = bounds[axis]
+            half_width = (high - low) * self.shrink / 2
+            initial_low, initial_high = self.bounds[axis]
+            refined[axis] = (max(initial_low, value - half_width), min(initial_high, value + half_width))
+        return refined
+
+    def evaluate(self, combinations, iteration):
+        """
+        Simulates a batch of candidates together and scores them. Candidates that cannot beat the best candidate any
+        more are removed from the batch during the run.
+        :param combinations: (rp, c, idw) combinations (type: list of tuples)
+        :param iteration: number of the iteration (type: integer)
+        :return: candidates of the batch (type: list)
+        """
+        batch = [Candidate(combination, iteration) for combination in combinations]
+        for candidate in batch:
+            self.candidates[candidate.name] = candidate
+        active = list(range(len(batch)))
+        sweep = self._sweep([batch[k].combination for k in active], self.s_init)
+        q = np.full((len(self.tages_id), len(batch)), np.nan)
+        sse = np.zeros(len(batch))
+        prune = self.objective in SSE_OBJECTIVES and self.best is not None
+        for i in range(len(self.tages_id)):
+            _, q_day = sweep.step(self.precipitation(i), self.pet(i))
+            q[i, active] = q_day
+            if self.evaluation[i]:
+                sse[active] += (q_day - self.observed[i]) ** 2
+            if prune and (i + 1) % self.check_every == 0:
+                keep = [position for position, k in enumerate(active) if sse[k] <= self.best.sse]
+                if len(keep) < len(active):
+                    for position, k in enumerate(active):
+                        if position not in keep:
+                            batch[k].abandoned = True
+                            batch[k].days = i + 1
+                    active = [active[position] for position in keep]
+                    if not active:
+                        break
+                    state = sweep.state()[keep]
+                    sweep = self._sweep([batch[k].combination for k in active], state)
+
+        for k in active:
+            candidate = batch[k]
+            candidate.days = len(self.tages_id)
+            candidate.q = q[:, k]
+            candidate.sse = sse[k]
+            scores = skill_scores(q[self.evaluation][:, [k]], self.observed[self.evaluation])
+            candidate.scores = {name: float(values[0]) for name, values in scores.items()}
+            if self._better(candidate):
+                self.best = candidate
+        return batch
+
+    def _sweep(self, combinations, s_init):
+        """
+        :return: sweep of the given combinations (type: ParameterSweep)
+        """
+        return ParameterSweep(self.grids, [], [], s_init, -np.inf, self.idw_exponent, combinations, self.cells)
+
+    def _better(self, candidate):
+        """
+        :param candidate: completely evaluated candidate (type: Candidate)
+        :return: True if the candidate is better than the best candidate so far (type: boolean)
+        """
+        key = RANKING[self.objective](np.array([candidate.scores[self.objective]]))[0]
+        if np.isnan(key):
+            return False
+        if self.best is None:
+            return True
+        return key < RANKING[self.objective](np.array([self.best.scores[self.objective]]))[0]
+
+    def simulated_days(self):
+        """
+        :return: number of simulated candidate days of the optimisation (type: integer)
+        """
+        return sum(candidate.days for candidate in self.candidates.values())
+
+    def write_table(self, path):
+        """
+        Writes all evaluated candidates, ordered by the objective.
+        :param path: path of the CSV file (type: string)
+        """
+        scored = [candidate for candidate in self.candidates.values() if candidate.scores is not None]
+        scored.sort(key=lambda candidate: RANKING[self.objective](np.array([candidate.scores[self.objective]]))[0])
+        abandoned = [candidate for candidate in self.candidates.values() if candidate.abandoned]
+        with open(path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["Iteration", "rp", "c", "idw", "NSE", "KGE", "PBIAS", "RMSE", "Tage", "Status"])
+            for candidate in scored:
+                writer.writerow([candidate.iteration, *candidate.combination] +
+                                [repr(candidate.scores[name]) for name in ["NSE", "KGE", "PBIAS", "RMSE"]] +
+                                [candidate.days, "vollstaendig"])
+            for candidate in abandoned:
+                writer.writerow([candidate.iteration, *candidate.combination, "", "", "", "", candidate.days,
+                                 "abgebrochen"])
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Output of the model results: daily streamflow tables as CSV.
+
+The streamflow of all combinations is collected per day in a buffer and written in bulk, either at the end of the run
+or whenever the buffer is full, instead of inserting every value into a table with its own cursor.
+"""
+
+import csv
+
+import numpy as np
+
+from .forcing import tages_id_to_date
+
+
+Q_CSV_FIELDS = ["OID", "Datum", "Q"]
+Q_LONG_FIELDS = ["rp", "c", "idw", "Datum", "Q"]
+
+
+def format_date(tages_id):
+    """
+    Formats a daily ID (JJJJMMTT) as date of the result tables (TT.MM.JJJJ).
+    :param tages_id: daily ID (type: integer)
+    :return: date (type: string)
+    """
+    return tages_id_to_date(tages_id).strftime("%d.%m.%Y")
+
+
+def _q_rows(tages_id, q, first_oid=1):
+    """
+    Creates the rows of a streamflow table.
+    :param tages_id: daily IDs (type: array)
+    :param q: streamflow in m^3 s^{-1} per day (type: array)
+    :param first_oid: OID of the first row (type: integer)
+    :return: rows of (OID, Datum, Q) (type: generator)
+    """
+    for oid, (day, value) in enumerate(zip(tages_id, q), start=first_oid):
+        yield [oid, format_date(day), repr(float(value))]
+
+
+def write_q_csv(path, tages_id, q):
+    """
+    Writes the daily streamflow of a parameter combination in the layout of the CSV export of the result tables
+    (OID, Datum, Q), which is read by eval_SWM_parameter_variations.R.
+    :param path: path of the CSV file (type: string)
+    :param tages_id: daily IDs (type: array)
+    :param q: streamflow in m^3 s^{-1} per day (type: array)
+    """
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(Q_CSV_FIELDS)
+        writer.writerows(_q_rows(tages_id, q))
+
+
+def read_q_csv(path):
+    """
+    Reads a streamflow table written by write_q_csv or QResultWriter.
+    :param path: path of the CSV file (type: string)
+    :return: daily IDs and streamflow (type: tuple of arrays)
+    """
+    tages_id, q = [], []
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        for row in csv.DictReader(csv_file):
+            day, month, year = (int(part) for part in row["Datum"].split("."))
+            tages_id.append(year * 10000 + month * 100 + day)
+            q.append(float(row["Q"]))
+    return np.array(tages_id, dtype=np.int64), np.array(q, dtype=np.float64)
+
+
+def write_q_long_csv(path, combinations, tages_id, q, append=False):
+    """
+    Writes the daily streamflow of several combinations into one table in long format (rp, c, idw, Datum, Q).
+    :param path: path of the CSV file (type: string)
+    :param combinations: (rp, c, idw) combinations (type: list of tuples)
+    :param tages_id: daily IDs (type: array)
+    :param q: streamflow per day and combination (type: array of shape (days, combinations))
+    :param append: append the rows to an existing file without header (type: boolean)
+    """
+    dates = [format_date(day) for day in tages_id]
+    with open(path, "a" if append else "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        if not append:
+            writer.writerow(Q_LONG_FIELDS)
+        for k, (rp, c, idw) in enumerate(combinations):
+            writer.writerows([rp, c, idw, date, repr(float(value))] for date, value in zip(dates, q[:, k]))
+
+
+def quantile_field(quantile):
+    """
+    :param quantile: quantile between 0 and 1 (type: float)
+    :return: column name of the quantile in percent, e.g. Q5 or Q50 (type: string)
+    """
+    return "Q{:g}".format(round(float(quantile) * 100, 6))
+
+
+def write_q_quantile_csv(path, tages_id, quantiles, q):
+    """
+    Writes the daily streamflow quantiles of an ensemble for one parameter combination (OID, Datum, Q5, Q50, ...).
+    :param path: path of the CSV file (type: string)
+    :param tages_id: daily IDs (type: array)
+    :param quantiles: quantiles between 0 and 1 (type: list)
+    :param q: streamflow quantiles per day (type: array of shape (days, quantiles))
+    """
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["OID", "Datum"] + [quantile_field(quantile) for quantile in quantiles])
+        for oid, (day, values) in enumerate(zip(tages_id, q), start=1):
+            writer.writerow([oid, format_date(day)] + [repr(float(value)) for value in values])
+
+
+class QResultWriter(object):
+    def __init__(self, paths, combinations, buffer_days=None, long_path=None):
+        """
+        Collects the daily streamflow of all combinations and writes the result tables in bulk.
+        :param paths: path of the CSV file of each combination (type: list)
+        :param combinations: (rp, c, idw) combinations in the order of the streamflow values (type: list of tuples)
+        :param buffer_days: number of days held in memory before the tables are written, the whole run if None or 0
+                            (type: integer)
+        :param long_path: path of an additional table of all combinations in long format (type: string)
+        """
+        self.paths = list(paths)
+        self.combinations = list(combinations)
+        self.buffer_days = buffer_days or None
+        self.long_path = long_path
+        self._tages_id = []
+        self._q = []
+        self._rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def resume(self, rows):
+        """
+        Continues tables of an interrupted run. Rows after the given number of days, e.g. written after the snapshot the
+        run is resumed from, are removed.
+        :param rows: number of days already contained in the tables (type: integer)
+        """
+        for path in self.paths:
+            _truncate_lines(path, 1 + rows)
+        if self.long_path:
+            _truncate_lines(self.long_path, 1 + rows * len(self.combinations))
+        self._tages_id, self._q = [], []
+        self._rows_written = rows
+
+    def add(self, tages_id, q):
+        """
+        Adds the streamflow of one day.
+        :param tages_id: daily ID (type: integer)
+        :param q: streamflow of every combination in m^3 s^{-1} (type: array)
+        """
+        self._tages_id.append(int(tages_id))
+        self._q.append(np.array(q, dtype=np.float64).reshape(len(self.paths)))
+        if self.buffer_days and len(self._tages_id) >= self.buffer_days:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered days to the tables and empties the buffer."""
+        if not self._tages_id and self._rows_written:
+            return
+        q = np.array(self._q).reshape(len(self._tages_id), len(self.paths))
+        append = self._rows_written > 0
+        for k, path in enumerate(self.paths):
+            with open(path, "a" if append else "w", newline="", encoding="utf-8") as csv_file:
+                writer = csv.writer(csv_file)
+                if not append:
+                    writer.writerow(Q_CSV_FIELDS)
+                writer.writerows(_q_rows(self._tages_id, q[:, k], self._rows_written + 1))
+        if self.long_path:
+            write_q_long_csv(self.long_path, self.combinations, self._tages_id, q, append)
+        self._rows_written += len(self._tages_id)
+        self._tages_id, self._q = [], []
+
+    def close(self):
+        """Writes the remaining days."""
+        self.flush()
+
+
+def _truncate_lines(path, lines):
+    """
+    Shortens a text file to its first lines.
+    :param path: path of the file (type: string)
+    :param lines: number of lines to keep (type: integer)
+    """
+    with open(path, newline="", encoding="utf-8") as text_file:
+        content = text_file.readlines()[:lines]
+    if len(content) < lines:
+        raise ValueError("Ergebnistabelle {} enthaelt weniger als {} Zeilen.".format(path, lines))
+    with open(path, "w", newline="", encoding="utf-8") as text_file:
+        text_file.writelines(content)
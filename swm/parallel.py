@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel execution of a parameter sweep on a process pool.
+
+The combinations are split into chunks that are simulated by worker processes. The static grids, the initial
+soilwater content and the precomputed forcing cubes are shared as memory-mapped .npy files instead of being pickled per
+task, and every worker writes the result tables of its combinations itself. Since the combinations of a sweep do not
+interact, the results are identical to a serial run.
+"""
+
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .compact import CellIndex
+from .kernel import StaticGrids
+from .output import write_q_csv
+from .sweep import ParameterSweep
+
+
+SHARED_GRIDS = ["fc", "wp", "l_m", "water", "s_init"]
+
+_shared = {}
+
+
+def share_static(directory, grids, s_init):
+    """
+    Writes the static grids and the initial soilwater content as .npy files for the workers.
+    :param directory: directory of the shared files (type: string)
+    :param grids: static raster data of the basin (type: StaticGrids)
+    :param s_init: initial soilwater content, one grid or one per combination (type: array)
+    :return: paths of the files keyed by grid name (type: dict)
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {"fc": grids.fc, "wp": grids.wp, "l_m": grids.l_m, "water": grids.water_mask(), "s_init": s_init}
+    paths = {}
+    for name in SHARED_GRIDS:
+        paths[name] = os.path.join(directory, name + ".npy")
+        np.save(paths[name], np.asarray(arrays[name], dtype=np.float64))
+    return paths
+
+
+def _init_worker(static_paths, cube_path, rows, cellsize):
+    """
+    Maps the shared files into the worker process once.
+    :param static_paths: paths of the static grids (type: dict)
+    :param cube_path: directory of the forcing cubes (pet.npy, p.npy) (type: string)
+    :param rows: row of every simulated day in the cubes (type: array)
+    :param cellsize: raster cellsize (type: float)
+    """
+    arrays = {name: np.load(path, mmap_mode="r") for name, path in static_paths.items()}
+    _shared["grids"] = StaticGrids(arrays["fc"], arrays["wp"], arrays["l_m"], arrays["water"], None, cellsize)
+    _shared["s_init"] = arrays["s_init"]
+    _shared["pet"] = np.load(os.path.join(cube_path, "pet.npy"), mmap_mode="r")
+    _shared["p"] = np.load(os.path.join(cube_path, "p.npy"), mmap_mode="r")
+    _shared["rows"] = np.asarray(rows, dtype=np.intp)
+
+
+def _run_chunk(combinations, indices, idw_exponent, tages_id, output_paths, compact=False):
+    """
+    Simulates a chunk of combinations over the whole period and writes their result tables.
+    :param combinations: (rp, c, idw) combinations (type: list of tuples)
+    :param indices: indices of the combinations in the sweep (type: list)
+    :param idw_exponent: IDW exponents in the order of the precipitation cube (type: list)
+    :param tages_id: daily IDs (type: array)
+    :param output_paths: path of the result table of each combination (type: list)
+    :param compact: simulate the active cells only, as the serial run does (type: boolean)
+    :return: streamflow per day and combination (type: array of shape (days, combinations))
+    """
+    if compact and "cells" not in _shared:
+        _shared["cells"] = CellIndex(_shared["grids"], _shared["s_init"])
+    s_init = _shared["s_init"]
+    if s_init.ndim > _shared["grids"].fc.ndim:
+        s_init = s_init[indices]  # Warm start with one initial state per combination
+    sweep = ParameterSweep(_shared["grids"], [], [], s_init, rp_control=-np.inf,
+                           idw_exponent=idw_exponent, combinations=combinations,
+                           cells=_shared["cells"] if compact else None)
+    q = simulate_q(sweep, lambda i: _shared["pet"][_shared["rows"][i]], lambda i: _shared["p"][_shared["rows"][i]],
+                   len(tages_id))
+    for k, path in enumerate(output_paths):
+        write_q_csv(path, tages_id, q[:, k])
+    return q
+
+
+def simulate_q(sweep, pet, precipitation, n_days):
+    """
+    Runs a sweep over the period and collects the streamflow.
+    :param sweep: parameter sweep (type: ParameterSweep)
+    :param pet: function returning the PET of day i (type: callable)
+    :param precipitation: function returning the precipitation fields of day i (type: callable)
+    :param n_days: number of days (type: integer)
+    :return: streamflow per day and combination (type: array of shape (days, combinations))
+    """
+    q = np.empty((n_days, len(sweep)))
+    for i in range(n_days):
+        _, q[i] = sweep.step(np.asarray(precipitation(i), dtype=np.float64), np.asarray(pet(i), dtype=np.float64))
+    return q
+
+
+def chunk_combinations(combinations, workers, chunk_size=None):
+    """
+    Splits the combinations into chunks.
+    :param combinations: (rp, c, idw) combinations (type: list of tuples)
+    :param workers: number of worker processes (type: integer)
+    :param chunk_size: number of combinations per chunk, an even split over the workers if None (type: integer)
+    :return: lists of indices into combinations (type: list)
+    """
+    if not chunk_size:
+        chunk_size = -(-len(combinations) // max(workers, 1))
+    chunk_size = max(int(chunk_size), 1)
+    return [list(range(i, min(i + chunk_size, len(combinations)))) for i in range(0, len(combinations), chunk_size)]
+
+
+def _process_context():
+    """
+    Creates the multiprocessing context. Inside ArcGIS Pro sys.executable is ArcGISPro.exe, so the workers are started
+    with the Python interpreter of the active environment.
+    :return: multiprocessing context (type: multiprocessing.context.BaseContext)
+    """
+    context = multiprocessing.get_context("spawn")
+    executable = os.path.basename(sys.executable).lower()
+    if sys.platform == "win32" and not executable.startswith("python"):
+        context.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+    return context
+
+
+def run_parallel(sweep, cube, tages_id, output_paths, shared_directory, workers, chunk_size=None, log=None):
+    """
+    Simulates the combinations of a sweep on a process pool. Every worker writes the result tables of its
+    combinations.
+    :param sweep: parameter sweep defining grids, initial soilwater content and combinations (type: ParameterSweep)
+    :param cube: precomputed forcing of the period (type: ForcingCube)
+    :param tages_id: daily IDs (type: array)
+    :param output_paths: path of the result table of each combination of the sweep (type: list)
+    :param shared_directory: directory for the shared static grids (type: string)
+    :param workers: number of worker processes (type: integer)
+    :param chunk_size: number of combinations per task (type: integer)
+    :param log: function for messages (type: callable)
+    :return: streamflow per day and combination (type: array of shape (days, combinations))
+    """
+    static_paths = share_static(shared_directory, sweep.grids, sweep.s_init)
+    chunks = chunk_combinations(sweep.combinations, workers, chunk_size)
+    q = np.empty((len(tages_id), len(sweep)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_process_context(), initializer=_init_worker,
+                             initargs=(static_paths, cube.path, cube.rows, sweep.grids.cellsize)) as executor:
+        futures = [executor.submit(_run_chunk, [sweep.combinations[k] for k in chunk], chunk, sweep.idw_exponent,
+                                   tages_id, [output_paths[k] for k in chunk], sweep.cells is not None)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            q[:, chunk] = future.result()
+            if log:
+                log("Parameterkombinationen fertig: {}".format(", ".join(str(sweep.names[k]) for k in chunk)))
+    return q
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Low-overhead instrumentation of a model run: cumulative wall time and number of calls per stage (forcing load, PET,
+IDW, water balance, Q reduction, table writes, raster I/O), the peak memory of the process and a progress summary at a
+configurable interval instead of a message per day. The stages can be written as JSON or CSV trace at the end.
+
+Stages may be entered from several threads (e.g. the background raster writers), their times are then summed over the
+threads and can exceed the wall time of the run.
+"""
+
+import contextlib
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+
+STAGES = ["forcing_load", "static", "pet", "idw", "forcing_cache", "water_balance", "q", "tables", "raster_io",
+          "aggregation", "snapshot"]
+
+
+def peak_memory():
+    """
+    :return: peak resident memory of the process in bytes, None if it cannot be determined (type: integer)
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(peak if sys.platform == "darwin" else peak * 1024)  # Kilobytes on Linux
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return int(counters.PeakWorkingSetSize)
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+class Profiler(object):
+    def __init__(self, log=None, interval=30):
+        """
+        Collects the time and calls per stage of a run.
+        :param log: function for the progress messages (type: callable)
+        :param interval: number of days between two progress messages, none if 0 (type: integer)
+        """
+        self.log = log
+        self.interval = int(interval or 0)
+        self.seconds = {}
+        self.calls = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._last_day = 0
+        self._last_time = self.started
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measures a stage.
+        :param name: name of the stage, see STAGES (type: string)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, calls=1):
+        """
+        Adds time to a stage, e.g. measured elsewhere.
+        :param name: name of the stage (type: string)
+        :param seconds: wall time in seconds (type: float)
+        :param calls: number of calls (type: integer)
+        """
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + calls
+
+    def timed(self, name, function):
+        """
+        :param name: name of the stage (type: string)
+        :param function: function to measure (type: callable)
+        :return: function measuring every call as the stage (type: callable)
+        """
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def elapsed(self):
+        """
+        :return: wall time since the start of the run in seconds (type: float)
+        """
+        return time.perf_counter() - self.started
+
+    def progress(self, day, n_days, tages_id=None):
+        """
+        Emits a progress message if the interval has passed or the last day is reached.
+        :param day: number of simulated days (type: integer)
+        :param n_days: number of days of the run (type: integer)
+        :param tages_id: daily ID of the last simulated day (type: integer)
+        :return: True if a message was emitted (type: boolean)
+        """
+        if not self.log or not self.interval or (day - self._last_day < self.interval and day != n_days):
+            return False
+        now = time.perf_counter()
+        rate = (day - self._last_day) / max(now - self._last_time, 1e-9)
+        remaining = (n_days - day) / rate if rate > 0 else 0.0
+        self.log("Tag {} von {}{}: {:.1f} Tage/s, Restzeit ca. {}, {}".format(
+            day, n_days, "" if tages_id is None else " ({})".format(tages_id), rate, _duration(remaining),
+            self._stage_text()))
+        self._last_day, self._last_time = day, now
+        return True
+
+    def _stage_text(self):
+        """
+        :return: share of the stages in the measured time (type: string)
+        """
+        with self._lock:
+            seconds = dict(self.seconds)
+        total = sum(seconds.values()) or 1.0
+        return ", ".join("{} {:.0%}".format(name, value / total) for name, value in
+                         sorted(seconds.items(), key=lambda item: -item[1]))
+
+    def rows(self):
+        """
+        :return: stages with calls, total and mean time in order of STAGES, then further stages (type: list of dicts)
+        """
+        with self._lock:
+            names = [name for name in STAGES if name in self.seconds] + sorted(set(self.seconds) - set(STAGES))
+            return [{"stage": name, "calls": self.calls[name], "seconds": self.seconds[name],
+                     "mean_seconds": self.seconds[name] / max(self.calls[name], 1)} for name in names]
+
+    def summary(self):
+        """
+        :return: lines of the summary of all stages and the peak memory (type: list of strings)
+        """
+        lines = ["{:<14} {:>9} {:>10} {:>12}".format("Stufe", "Aufrufe", "Sekunden", "ms je Aufruf")]
+        for row in self.rows():
+            lines.append("{:<14} {:>9} {:>10.2f} {:>12.3f}".format(row["stage"], row["calls"], row["seconds"],
+                                                                  row["mean_seconds"] * 1000))
+        lines.append("Gesamtlaufzeit {:.1f} s, Spitzenspeicher {}".format(self.elapsed(), _size(peak_memory())))
+        return lines
+
+    def write_trace(self, path):
+        """
+        Writes the stages as JSON or, for a path ending with .csv, as CSV table.
+        :param path: path of the trace file (type: string)
+        """
+        rows = self.rows()
+        if os.path.splitext(path)[1].lower() == ".csv":
+            with open(path, "w", newline="", encoding="utf-8") as csv_file:
+                writer = csv.DictWriter(csv_file, ["stage", "calls", "seconds", "mean_seconds"])
+                writer.writeheader()
+                writer.writerows(rows)
+            return
+        with open(path, "w", encoding="utf-8") as json_file:
+            json.dump({"elapsed_seconds": self.elapsed(), "peak_memory_bytes": peak_memory(), "stages": rows},
+                      json_file, indent=2)
+
+
+class NullProfiler(object):
+    """Profiler that measures nothing, the default of the library classes."""
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def add(self, name, seconds, calls=1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def _duration(seconds):
+    """
+    :return: duration as H:MM:SS (type: string)
+    """
+    seconds = int(round(seconds))
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _size(n_bytes):
+    """
+    :return: memory size in MB, "unbekannt" if None (type: string)
+    """
+    return "unbekannt" if n_bytes is None else "{:.0f} MB".format(n_bytes / 1024 ** 2)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent store of the results of single parameter combinations, which allows to extend a parameter variation without
+simulating the combinations already calculated.
+
+An entry is addressed by a hash of the model inputs (static grids clipped to the basin, initial soilwater content, grid
+and cellsize, station coordinates, climate and precipitation data of every day of the period, IDW search settings, the
+way the forcing is calculated) and of the (rp, c, idw) combination. It holds the daily streamflow and, if the run aggregated rasters, the aggregated
+rasters of the combination. Changed data, basin, s_init or period lead to other hashes, so stale entries are never
+read; they are removed as least recently used entries when the store exceeds its size limit, or explicitly with
+invalidate (python -m swm invalidate).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from .cache import FORCING_VERSION, META_FILE, DiskCache, _directory_size, _hash_arrays, day_keys
+from .idw import IDW_MIN_POINTS, IDW_RADIUS
+
+
+# Changes of the model equations must raise the version, which invalidates all stored results
+STORE_VERSION = 2
+
+
+def forcing_mode(dtype=np.float64, tile_size=None, cached=False):
+    """
+    Describes how the PET and precipitation of a run are calculated.
+    :param dtype: data type of the forcing (type: numpy dtype)
+    :param tile_size: edge length of the blocks the forcing is calculated in, the whole grid if None or 0
+                      (type: integer)
+    :param cached: the forcing is read from a forcing cache (type: boolean)
+    :return: description (type: string)
+    """
+    return "forcing{}|{}|tiles{}|{}".format(FORCING_VERSION, np.dtype(dtype).str, int(tile_size or 0),
+                                            "cache" if cached else "direct")
+
+
+def input_key(grids, grid, s_init, forcing, mode, radius=IDW_RADIUS, min_points=IDW_MIN_POINTS):
+    """
+    Calculates the hash of the model inputs shared by all combinations of a run.
+    :param grids: static raster data of the basin (type: StaticGrids)
+    :param grid: model grid (type: Grid)
+    :param s_init: initial soilwater content (type: array)
+    :param forcing: climate and precipitation data of the run (type: Forcing)
+    :param mode: calculation of the forcing, see forcing_mode (type: string)
+    :param radius: IDW search radius (type: float)
+    :param min_points: minimum number of stations per cell (type: integer)
+    :return: hash (type: string)
+    """
+    haude = np.empty(0) if grids.haude is None else grids.haude
+    return _hash_arrays(np.array(STORE_VERSION), grids.fc, grids.wp, grids.l_m, grids.water, grids.land, haude,
+                        np.asarray(s_init, dtype=np.float64), np.array(grid.key()),
+                        np.asarray(forcing.precipitation.station_xy, dtype=np.float64), np.array([radius, min_points]),
+                        np.array(day_keys(forcing)), np.array(mode))
+
+
+def window_spans(windows):
+    """
+    :param windows: time windows of an aggregation (type: list of Window)
+    :return: first and last daily ID keyed by window name (type: dict)
+    """
+    return {window.name: [window.start, window.end] for window in windows}
+
+
+class StoredResult(object):
+    def __init__(self, path, meta):
+        """
+        Result of one combination read from the store.
+        :param path: directory of the entry (type: string)
+        :param meta: metadata of the entry (type: dict)
+        """
+        self.path = path
+        self.meta = meta
+        self.q = np.load(os.path.join(path, "q.npy"))
+
+    def aggregated(self, windows):
+        """
+        :param windows: time windows to read (type: list of Window)
+        :return: aggregated rasters keyed by window name and "<raster>_<statistic>" (type: dict)
+        """
+        rasters = {window.name: {} for window in windows}
+        if not windows:
+            return rasters
+        with np.load(os.path.join(self.path, "aggregated.npz")) as archive:
+            for key in archive.files:
+                window_name, name = key.split("/", 1)
+                if window_name in rasters:
+                    rasters[window_name][name] = archive[key]
+        return rasters
+
+
+class ResultStore(DiskCache):
+    def __init__(self, root, max_bytes=None):
+        """
+        Store directory with one subdirectory per combination and input data.
+        :param root: directory of the store (type: string)
+        :param max_bytes: maximum size of all entries, unlimited if None (type: integer)
+        """
+        super(ResultStore, self).__init__(root, max_bytes)
+
+    def path(self, run_key, combination):
+        """
+        :param run_key: hash of the model inputs (type: string)
+        :param combination: (rp, c, idw) combination (type: tuple)
+        :return: directory of the entry (type: string)
+        """
+        parameters = "|".join(repr(float(value)) for value in combination)
+        return os.path.join(self.root, hashlib.sha256((run_key + parameters).encode()).hexdigest()[:24])
+
+    def get(self, run_key, combination, windows=(), statistics=None):
+        """
+        Reads the result of a combination. A result without all requested aggregation windows is not used.
+        :param run_key: hash of the model inputs (type: string)
+        :param combination: (rp, c, idw) combination (type: tuple)
+        :param windows: time windows the aggregated rasters are needed for (type: list of Window)
+        :param statistics: statistics of the aggregation, the defaults if None (type: list)
+        :return: result, None if not stored (type: StoredResult)
+        """
+        path = self.path(run_key, combination)
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        if windows:
+            spans = meta.get("windows", {})
+            if meta.get("statistics") != _statistics(statistics) or any(
+                    spans.get(name) != span for name, span in window_spans(windows).items()):
+                return None
+        self._touch(path, meta)
+        return StoredResult(path, meta)
+
+    def put(self, run_key, combination, tages_id, q, aggregated=None, windows=(), statistics=None):
+        """
+        Stores the result of a combination, an existing entry is replaced. The entry is written to a temporary
+        directory first and only becomes visible when it is complete.
+        :param run_key: hash of the model inputs (type: string)
+        :param combination: (rp, c, idw) combination (type: tuple)
+        :param tages_id: daily IDs of the run (type: array)
+        :param q: streamflow per day (type: array)
+        :param aggregated: aggregated rasters keyed by window name and "<raster>_<statistic>" (type: dict)
+        :param windows: time windows of the aggregated rasters (type: list of Window)
+        :param statistics: statistics of the aggregation, the defaults if None (type: list)
+        :return: directory of the entry (type: string)
+        """
+        path = self.path(run_key, combination)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "q.npy"), np.asarray(q, dtype=np.float64))
+        meta = {"run_key": run_key, "combination": [float(value) for value in combination],
+                "start": int(tages_id[0]), "end": int(tages_id[-1]), "n_days": len(tages_id)}
+        if aggregated:
+            np.savez(os.path.join(tmp_path, "aggregated.npz"),
+                     **{"{}/{}".format(window_name, name): array for window_name, rasters in aggregated.items()
+                        for name, array in rasters.items()})
+            meta["windows"] = window_spans(window for window in windows if window.name in aggregated)
+            meta["statistics"] = _statistics(statistics)
+        meta.update({"bytes": _directory_size(tmp_path), "last_used": time.time()})
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def invalidate(self, rp_factor=None, c=None, idw_exponent=None, older_than=None):
+        """
+        Removes entries, all entries if no condition is given. Conditions given together must all apply.
+        :param rp_factor: RP factor of the entries (type: float)
+        :param c: c parameter of the entries (type: float)
+        :param idw_exponent: IDW exponent of the entries (type: float)
+        :param older_than: only entries not used for this number of days (type: float)
+        :return: removed directories (type: list)
+        """
+        removed = []
+        for path, meta in self.entries().items():
+            matches = [value is None or np.isclose(meta["combination"][i], value)
+                       for i, value in enumerate([rp_factor, c, idw_exponent])]
+            if older_than is not None:
+                matches.append(time.time() - meta["last_used"] > older_than * 86400)
+            if all(matches):
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+        return removed
+
+
+def _statistics(statistics):
+    """
+    :return: statistics in the form stored in the metadata (type: list)
+    """
+    return None if statistics is None else sorted(statistics)
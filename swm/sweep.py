@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Batched parameter sweep: all combinations of RP factor, c parameter and IDW exponent share the daily forcing (PET and
+the precipitation fields of all exponents) and are advanced together, with one soilwater state per combination stacked
+along the leading axis.
+"""
+
+import numpy as np
+
+from .compact import CompactSoilWaterModel
+from .kernel import SoilWaterModel
+from .profiling import NULL_PROFILER
+
+
+def parameter_range(minimum, maximum, step):
+    """
+    Creates the list of parameter values from the minimum to the maximum with the given step width (as in the toolbox).
+    :param minimum: first value (type: float)
+    :param maximum: last value (type: float)
+    :param step: step width (type: float)
+    :return: parameter values rounded to two decimals (type: list)
+    """
+    if step <= 0 or maximum <= minimum:
+        return [round(minimum, 2)]
+    return [round(minimum + i * step, 2) for i in range(int((maximum - minimum) / step) + 1)]
+
+
+def combination_name(rp_factor, c, idw_exponent):
+    """
+    Returns the identifier of a parameter combination as used in file and table names.
+    :param rp_factor: RP factor (type: float)
+    :param c: c parameter (type: float)
+    :param idw_exponent: IDW exponent (type: float)
+    :return: RP factor in percent, c parameter and IDW exponent in percent (type: tuple)
+    """
+    return int(round(rp_factor * 100)), int(c), int(round(idw_exponent * 100))
+
+
+class ParameterSweep(object):
+    def __init__(self, grids, rp_factor, c, s_init, rp_control=None, idw_exponent=(1.0,), combinations=None,
+                 cells=None, profiler=None):
+        """
+        Holds one soilwater state per valid combination of RP factor, c parameter and IDW exponent. RP factors that do
+        not exceed the maximum quotient of wilting point and field capacity (rp_control) are skipped, since they would
+        lead to a negative AET.
+        :param grids: static raster data of the basin (type: StaticGrids)
+        :param rp_factor: RP factors (type: list)
+        :param c: c parameters (type: list)
+        :param s_init: initial soilwater content (type: array)
+        :param rp_control: maximum value of wp/fc, calculated from the grids if None (type: float)
+        :param idw_exponent: IDW exponents, in the order of the precipitation fields passed to step (type: list)
+        :param combinations: explicit (rp, c, idw) combinations instead of all combinations of rp_factor, c and
+                             idw_exponent, e.g. a chunk of a sweep (type: list of tuples)
+        :param cells: index of the active cells, the model only holds these cells if given (type: CellIndex)
+        :param profiler: measures the water balance and the Q reduction of every step (type: Profiler)
+        """
+        self.grids = grids
+        self.rp_control = grids.rp_control() if rp_control is None else rp_control
+        self.idw_exponent = list(idw_exponent)
+        self.cells = cells
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+        if combinations is None:
+            combinations = [(rp, c_value, idw) for rp in rp_factor for c_value in c for idw in self.idw_exponent]
+        self.skipped = sorted(set(rp for rp, _, _ in combinations if self.rp_control >= rp))
+        self.combinations = [combination for combination in combinations if combination[0] not in self.skipped]
+        self.names = [combination_name(*combination) for combination in self.combinations]
+        # Index of the precipitation field used by each combination
+        self.idw_index = np.array([self.idw_exponent.index(idw) for _, _, idw in self.combinations], dtype=np.intp)
+        self.s_init = s_init
+        self._model = None
+
+    @property
+    def model(self):
+        """
+        Soilwater model of all combinations. It is created on first use, so a sweep that only defines the combinations
+        (e.g. for a tiled run) does not allocate grids.
+        :return: model, None if there is no valid combination (type: SoilWaterModel or CompactSoilWaterModel)
+        """
+        if self._model is None and self.combinations:
+            rp_values, c_values, _ = zip(*self.combinations)
+            if self.cells is None:
+                self._model = SoilWaterModel(self.grids, list(rp_values), list(c_values), self.s_init)
+            else:
+                self._model = CompactSoilWaterModel(self.grids, list(rp_values), list(c_values), self.s_init, self.cells)
+        return self._model
+
+    def __len__(self):
+        return len(self.combinations)
+
+    def reset(self):
+        """Sets the soilwater content of all combinations back to the initial state."""
+        if self._model is not None:
+            self._model.reset()
+
+    def state(self):
+        """
+        :return: soilwater content of every combination as grids (type: array of shape (combinations, rows, cols))
+        """
+        if self.cells is not None:
+            return self.cells.expand(self.model.s, self.cells.land)
+        return self.model.s.copy()
+
+    def set_state(self, s):
+        """
+        Sets the soilwater content of all combinations, e.g. from a snapshot.
+        :param s: soilwater content as grids, one per combination or one for all (type: array)
+        """
+        s = np.asarray(s, dtype=np.float64)
+        if self.cells is not None:
+            s = self.cells.compress(s, self.cells.land)
+        self.model.s = np.broadcast_to(s, self.model.s.shape).copy()
+
+    def step(self, p, pet):
+        """
+        Advances all combinations by one day with the shared forcing.
+        :param p: precipitation, one field per IDW exponent (type: array of shape (exponents, rows, cols)) or a single
+                  field shared by all combinations (type: array of shape (rows, cols))
+        :param pet: potential evapotranspiration (type: array)
+        :return: fluxes keyed by raster name with a leading combination axis for all but PET, and the streamflow per
+                 combination in m^3 s^{-1} (type: tuple of dict and array). In compact mode the fluxes hold the active
+                 cells only, select rebuilds the grids.
+        """
+        with self.profiler.stage("water_balance"):
+            if self.cells is not None:
+                p, pet = self.cells.compress(p), self.cells.compress(pet)
+            if np.ndim(p) > self._cell_ndim():
+                # Assign the precipitation field of its IDW exponent to each combination
+                p = p[0] if len(p) == 1 else p[self.idw_index]
+            fluxes = self.model.step(p, pet)
+        with self.profiler.stage("q"):
+            q = np.atleast_1d(self.model.q(fluxes["R"]))
+        return fluxes, q
+
+    def select(self, fluxes, index):
+        """
+        Selects the fluxes of one combination. Arrays without a combination axis (e.g. PET and precipitation) are
+        shared by all combinations and returned unchanged.
+        :param fluxes: arrays keyed by raster name, e.g. the output of step (type: dict)
+        :param index: index of the combination (type: integer)
+        :return: fluxes of the combination as grids (type: dict)
+        """
+        ndim = self._cell_ndim()
+        selected = {name: array[index] if np.ndim(array) > ndim else array for name, array in fluxes.items()}
+        if self.cells is not None:
+            selected = {name: self.cells.expand(array) for name, array in selected.items()}
+        return selected
+
+    def _cell_ndim(self):
+        """
+        :return: number of cell axes of the fluxes, 1 in compact mode (type: integer)
+        """
+        return self.grids.fc.ndim if self.cells is None else 1
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic base data of configurable size for benchmarks and regression checks.
+
+The generator writes a FileDataStore with smooth random fields of field capacity, wilting point and root depth, a
+meandering river as water mask, Haude-factors per month, an elliptic basin mask, precipitation stations with daily
+readings (including some missing ones) and a seasonal climate series. All values are derived from one seed.
+"""
+
+import datetime
+import os
+
+import numpy as np
+
+from .datastore import CLIMATE_FIELDS, PRECIPITATION_FIELDS, STATION_FIELDS, FileDataStore
+from .forcing import date_to_tages_id, tages_id_to_date
+from .grid import Grid
+from .kernel import MONTHS
+
+
+# Haude-factors of grassland from January to December
+HAUDE_FACTORS = [0.22, 0.22, 0.22, 0.29, 0.29, 0.28, 0.26, 0.25, 0.23, 0.22, 0.22, 0.22]
+BASIN_MASK = "EZG"
+
+
+def smooth_field(rng, shape, low, high, scale=8):
+    """
+    Creates a smooth random field by bilinear interpolation of a coarse random grid.
+    :param rng: random generator (type: numpy.random.Generator)
+    :param shape: rows and columns (type: tuple)
+    :param low: smallest value (type: float)
+    :param high: largest value (type: float)
+    :param scale: number of coarse cells along each axis (type: integer)
+    :return: field (type: array)
+    """
+    coarse = rng.random((scale + 1, scale + 1))
+    rows = np.linspace(0, scale, shape[0])
+    cols = np.linspace(0, scale, shape[1])
+    along_cols = np.array([np.interp(cols, np.arange(scale + 1), line) for line in coarse])
+    field = np.array([np.interp(rows, np.arange(scale + 1), line) for line in along_cols.T]).T
+    return low + (high - low) * field
+
+
+def synthetic_data(directory, nrows=100, ncols=100, n_days=365, n_stations=10, cellsize=100.0, start=20200101,
+                   seed=0):
+    """
+    Writes synthetic base data into a directory.
+    :param directory: directory of the data, created if missing (type: string)
+    :param nrows: number of rows (type: integer)
+    :param ncols: number of columns (type: integer)
+    :param n_days: number of days of the climate and precipitation series (type: integer)
+    :param n_stations: number of precipitation stations (type: integer)
+    :param cellsize: raster cellsize (type: float)
+    :param start: first daily ID (type: integer)
+    :param seed: seed of the random numbers (type: integer)
+    :return: data store, grid and the first and last daily ID (type: tuple)
+    """
+    os.makedirs(directory, exist_ok=True)
+    store = FileDataStore(directory)
+    rng = np.random.default_rng(seed)
+    grid = Grid(3500000.0, 5600000.0 + nrows * cellsize, cellsize, nrows, ncols)
+    shape = grid.shape
+
+    fc = smooth_field(rng, shape, 100.0, 300.0)
+    wp = fc * smooth_field(rng, shape, 0.2, 0.5)
+    store.write_raster("FK", fc, grid)
+    store.write_raster("WP", wp, grid)
+    store.write_raster("L_in_metern", smooth_field(rng, shape, 0.3, 1.5), grid)
+    # River meandering from west to east, about two cells wide
+    row, col = np.mgrid[0:nrows, 0:ncols]
+    centre = nrows / 2 + nrows / 6 * np.sin(col / max(ncols, 1) * 2 * np.pi)
+    store.write_raster("Gewaessermaske", (np.abs(row - centre) < 1).astype(np.float64), grid)
+    variation = smooth_field(rng, shape, 0.9, 1.1)
+    for month, factor in zip(MONTHS, HAUDE_FACTORS):
+        store.write_raster("Haude_" + month, factor * variation, grid)
+    inside = ((row - nrows / 2) / (0.45 * nrows)) ** 2 + ((col - ncols / 2) / (0.48 * ncols)) ** 2 <= 1
+    store.write_raster(BASIN_MASK, np.where(inside, 1.0, np.nan), grid)
+
+    # Stations in and around the extent
+    margin = 0.2 * np.array([grid.x_max - grid.x_min, grid.y_max - grid.y_min])
+    station_xy = rng.uniform([grid.x_min, grid.y_min] - margin, [grid.x_max, grid.y_max] + margin, (n_stations, 2))
+    stations = list(range(1001, 1001 + n_stations))
+    store.write_table("N_Messstationen", STATION_FIELDS,
+                      [[station, repr(float(x)), repr(float(y))] for station, (x, y) in zip(stations, station_xy)])
+
+    first = tages_id_to_date(start)
+    dates = [first + datetime.timedelta(days=i) for i in range(n_days)]
+    tages_id = [date_to_tages_id(date) for date in dates]
+    season = np.array([np.sin((date.timetuple().tm_yday - 105) / 365.25 * 2 * np.pi) for date in dates])
+
+    # Rain on about half of the days, varying between stations; about 1 % of the readings are missing
+    wet = rng.random(n_days) < 0.5
+    amount = rng.gamma(0.8, 6.0, n_days) * wet
+    station_factor = rng.uniform(0.6, 1.4, (n_days, n_stations))
+    missing = rng.random((n_days, n_stations)) < 0.01
+    missing[:, 0] = False  # Every day keeps at least one reading
+    store.write_table("N_Zeitreihen", PRECIPITATION_FIELDS,
+                      [[station, day, repr(round(float(amount[i] * station_factor[i, j]), 1))]
+                       for i, day in enumerate(tages_id) for j, station in enumerate(stations) if not missing[i, j]])
+
+    temperature = 9.0 + 9.0 * season + rng.normal(0.0, 2.5, n_days)
+    humidity = np.clip(78.0 - 12.0 * season + rng.normal(0.0, 6.0, n_days), 30.0, 100.0)
+    store.write_table("TempFeuchte", CLIMATE_FIELDS,
+                      [[day, date.year, date.month, date.day, repr(round(float(humidity[i]), 1)),
+                        repr(round(float(temperature[i]), 1))] for i, (day, date) in enumerate(zip(tages_id, dates))])
+    return store, grid, tages_id[0], tages_id[-1]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled execution for large domains: the grid is split into blocks that are simulated one after the other over the whole
+period.
+
+The model has no lateral flow, so the blocks only interact through the streamflow, which is the sum of the runoff of
+all cells and is therefore summed up over the blocks. Static grids and forcing are read block by block from
+memory-mapped arrays, so the memory needed depends on the block size and not on the size of the domain.
+"""
+
+import numpy as np
+
+from .compact import CellIndex
+from .sweep import ParameterSweep
+
+
+def tile_windows(shape, tile_size=None):
+    """
+    Splits a grid into square blocks.
+    :param shape: rows and columns of the grid (type: tuple)
+    :param tile_size: edge length of the blocks in cells, one block for the whole grid if None or 0 (type: integer)
+    :return: rows and columns of every block (type: list of tuples of slices)
+    """
+    nrows, ncols = shape
+    if not tile_size:
+        return [(slice(0, nrows), slice(0, ncols))]
+    tile_size = int(tile_size)
+    return [(slice(row, min(row + tile_size, nrows)), slice(col, min(col + tile_size, ncols)))
+            for row in range(0, nrows, tile_size) for col in range(0, ncols, tile_size)]
+
+
+def run_tiled(sweep, cube, n_days, tile_size, compact=True, log=None):
+    """
+    Simulates the combinations of a sweep block by block and sums up the streamflow of the blocks.
+    :param sweep: parameter sweep defining grids, initial soilwater content and combinations, its model is not used
+                  (type: ParameterSweep)
+    :param cube: precomputed forcing of the period (type: ForcingCube)
+    :param n_days: number of days (type: integer)
+    :param tile_size: edge length of the blocks in cells (type: integer)
+    :param compact: simulate the active cells of each block only (type: boolean)
+    :param log: function for messages (type: callable)
+    :return: streamflow per day and combination (type: array of shape (days, combinations))
+    """
+    windows = tile_windows(sweep.grids.shape, tile_size)
+    q = np.zeros((n_days, len(sweep)))
+    s_init = np.asarray(sweep.s_init)
+    for number, window in enumerate(windows, start=1):
+        rows, cols = window
+        grids = sweep.grids.window(rows, cols)
+        block_s_init = np.array(s_init[..., rows, cols], dtype=np.float64)
+        cells = CellIndex(grids, block_s_init) if compact else None
+        if (cells is not None and not len(cells)) or not (grids.land.any() or grids.water.any()):
+            continue  # Block outside the basin
+        block = ParameterSweep(grids, [], [], block_s_init, -np.inf, sweep.idw_exponent, sweep.combinations, cells,
+                               sweep.profiler)
+        for i in range(n_days):
+            _, q_block = block.step(cube.precipitation(i, window), cube.pet(i, window))
+            q[i] += q_block
+        if log:
+            log("Kachel {} von {} berechnet (Zeilen {}-{}, Spalten {}-{}).".format(
+                number, len(windows), rows.start, rows.stop - 1, cols.start, cols.stop - 1))
+    return q
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Background output of rasters: the simulation hands finished arrays over to a bounded queue and continues with the next
+day while a pool of writer threads saves them. If the writers fall behind, submitting blocks until a slot is free, so
+the number of arrays held in memory stays limited.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class AsyncRasterWriter(object):
+    def __init__(self, write, workers=1, max_pending=16, dtype=np.float32):
+        """
+        Writes arrays with a pool of background threads.
+        :param write: function saving an array to a path, called by the writer threads (type: callable)
+        :param workers: number of writer threads (type: integer)
+        :param max_pending: maximum number of arrays waiting or being written (type: integer)
+        :param dtype: data type the arrays are converted to before they are queued (type: numpy dtype)
+        """
+        self.write = write
+        self.dtype = dtype
+        self.written = 0
+        self._slots = threading.BoundedSemaphore(max(int(max_pending), 1))
+        self._lock = threading.Lock()
+        self._errors = []
+        self._executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="swm-raster")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, array, path):
+        """
+        Queues an array for writing. The array is copied, so it may be changed afterwards. Blocks while the queue is
+        full and raises the error of a failed write.
+        :param array: raster values (type: array)
+        :param path: path of the output raster (type: string)
+        """
+        self._raise_error()
+        self._slots.acquire()
+        try:
+            data = np.array(array, dtype=self.dtype)
+            self._executor.submit(self._write, data, path)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _write(self, array, path):
+        """
+        Writes one array in a writer thread and frees its slot in the queue.
+        """
+        try:
+            self.write(array, path)
+            with self._lock:
+                self.written += 1
+        except BaseException as error:
+            with self._lock:
+                self._errors.append((path, error))
+        finally:
+            self._slots.release()
+
+    def _raise_error(self):
+        """Raises the first error of the writer threads."""
+        with self._lock:
+            if not self._errors:
+                return
+            path, error = self._errors[0]
+        raise RuntimeError("Raster konnte nicht geschrieben werden: {}".format(path)) from error
+
+    def close(self):
+        """Waits until all queued arrays are written and raises the error of a failed write."""
+        self._executor.shutdown(wait=True)
+        self._raise_error()
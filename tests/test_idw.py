@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+IDW of many station subsets at once against the interpolation of every subset on its own.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from swm import Grid, idw_ranking, interpolate_precipitation
+
+
+def test_ranking_equals_single_subsets():
+    rng = np.random.default_rng(1)
+    grid = Grid(0.0, 60000.0, 1000.0, 60, 70)
+    station_xy = np.column_stack([rng.uniform(-10000.0, 80000.0, 30), rng.uniform(-10000.0, 70000.0, 30)])
+    station_xy[0] = [3500.0, 57500.0]  # Centre of a cell
+    values = rng.gamma(1.0, 3.0, (12, 30))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    values[1, 0] = np.nan  # Station on the cell without a reading
+    values[2, 5:] = np.nan  # Fewer stations than min_points
+    values[3] = np.nan  # No reading at all
+
+    fields = idw_ranking(station_xy, grid).interpolate(values, [1.0, 2.0])
+    assert fields.shape == (12, 2) + grid.shape
+    for member, member_values in enumerate(values):
+        expected = interpolate_precipitation(station_xy, member_values, grid, [1.0, 2.0])
+        np.testing.assert_allclose(fields[member], expected, rtol=1e-12, atol=0.0)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled and untiled runs on synthetic data with a day of missing station readings.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from swm import FileDataStore, ForcingCache, ParameterSweep, interpolate_precipitation, run_tiled, synthetic_data
+from swm.idw import IDW_MIN_POINTS, IDW_RADIUS
+from swm.parallel import simulate_q
+from swm.synthetic import BASIN_MASK
+
+
+IDW_EXPONENT = [1.0, 2.0]
+TILE_SIZE = 16
+MISSING_DAY = 5
+
+
+@pytest.fixture(scope="module")
+def case(tmp_path_factory):
+    """
+    Synthetic basin of 60 x 70 km, larger than the IDW search radius. On one day all neighbours of the north-west
+    corner are missing, so only the search among the reporting stations gives its cells a value.
+    :return: static grids, grid and forcing (type: tuple)
+    """
+    directory = str(tmp_path_factory.mktemp("data"))
+    store, grid, start, end = synthetic_data(directory, 60, 70, 20, 12, cellsize=1000.0, seed=3)
+    grids = FileDataStore(directory, BASIN_MASK).static_grids()
+    forcing, _ = store.load_forcing(start, end)
+    precipitation = forcing.precipitation
+    distance = np.hypot(*(precipitation.station_xy - [grid.x_min, grid.y_max]).T)
+    neighbours = (distance <= IDW_RADIUS) | (np.argsort(np.argsort(distance)) < IDW_MIN_POINTS)
+    assert not neighbours.all()
+    precipitation.values[MISSING_DAY, neighbours] = np.nan
+    return grids, grid, forcing
+
+
+def test_tiled_forcing_equals_whole_grid(case, tmp_path):
+    grids, grid, forcing = case
+    whole = ForcingCache(str(tmp_path / "whole")).open(grids, grid, forcing, IDW_EXPONENT)
+    tiled = ForcingCache(str(tmp_path / "tiled"), tile_size=TILE_SIZE).open(grids, grid, forcing, IDW_EXPONENT)
+    for i in range(len(forcing)):
+        np.testing.assert_allclose(tiled.precipitation(i), whole.precipitation(i), rtol=1e-12, atol=0.0)
+        np.testing.assert_allclose(tiled.pet(i), whole.pet(i), rtol=1e-12, atol=0.0)
+    whole.close()
+    tiled.close()
+
+
+def test_tiled_q_equals_untiled(case, tmp_path):
+    grids, grid, forcing = case
+    climate, precipitation = forcing.climate, forcing.precipitation
+    sweep = ParameterSweep(grids, [0.6, 0.85], [100, 250], grids.fc.copy(), None, IDW_EXPONENT)
+    untiled = simulate_q(
+        sweep, lambda i: grids.pet(int(climate.month[i]), climate.temperature[i], climate.humidity[i]),
+        lambda i: interpolate_precipitation(precipitation.station_xy, precipitation.values[i], grid, IDW_EXPONENT),
+        len(forcing))
+
+    cube = ForcingCache(str(tmp_path / "tiled"), tile_size=TILE_SIZE).open(grids, grid, forcing, IDW_EXPONENT)
+    tiled = run_tiled(sweep, cube, len(forcing), TILE_SIZE)
+    cube.close()
+    np.testing.assert_allclose(tiled, untiled, rtol=1e-9, atol=0.0)
+    assert untiled[MISSING_DAY].min() > 0